@@ -0,0 +1,113 @@
+from functools import wraps
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+
+
+RESPONSE_CACHE_TIMEOUT = 5*60
+# a version is reused for this many seconds, so changes that don't call
+# invalidate_model_version show up after this long
+MODEL_VERSION_TIMEOUT = 5*60
+# the timestamps included in the version of models that have them
+VERSION_FIELDS = ['updated_at', 'deleted_at', 'responded_at']
+
+
+def _model_version_key(model):
+    return 'api_cache_version:{}'.format(model._meta.label_lower)
+
+
+def _version_aggregates(model):
+    field_names = [field.name for field in model._meta.get_fields()]
+    aggregates = {'count': Count('pk'), 'max_pk': Max('pk')}
+    for name in VERSION_FIELDS:
+        if name in field_names:
+            aggregates[name] = Max(name)
+    return aggregates
+
+
+def get_model_version(model):
+    """
+    return the version of the rows of model. Saves bump the version with
+    invalidate_model_version, when there is no version in the cache it is
+    computed from the database with the number of rows, the largest primary
+    key and the latest timestamps.
+
+    The version is kept in the cache for MODEL_VERSION_TIMEOUT seconds, so
+    bulk_create and queryset updates that set updated_at are picked up
+    without relying on signals.
+    """
+    key = _model_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        values = model._base_manager.aggregate(**_version_aggregates(model))
+        version = tuple(
+            value.isoformat() if hasattr(value, 'isoformat') else str(value)
+            for name, value in sorted(values.items())
+        )
+        cache.set(key, version, MODEL_VERSION_TIMEOUT)
+    return version
+
+
+def invalidate_model_version(model):
+    """ bump the version of model now, and again once the current transaction
+    is committed. The new version doesn't need any queries """
+    key = _model_version_key(model)
+    bump = lambda: cache.set(key, ('bumped', uuid.uuid4().hex), MODEL_VERSION_TIMEOUT)
+    bump()
+    transaction.on_commit(bump)
+
+
+def _response_etag(request, models):
+    query = sorted((key, sorted(values)) for key, values in request.GET.lists())
+    versions = [get_model_version(model) for model in models]
+    today = timezone.now().date()
+    key = repr((request.path, query, versions, today))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def cache_json_response(models, max_age=60, timeout=RESPONSE_CACHE_TIMEOUT):
+    """
+    decorator for public JSON views that only depend on the given models. The
+    ETag is derived from the updated_at high-water marks of the models and the
+    normalized query string, conditional requests are answered with a 304 and
+    rendered responses are kept in the cache until the models change.
+    Authenticated requests are passed through since the response may depend
+    on the user.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                response = view_func(request, *args, **kwargs)
+                patch_cache_control(response, private=True)
+                return response
+
+            etag_value = _response_etag(request, models)
+            etag = quote_etag(etag_value)
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+            if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+                response = HttpResponseNotModified()
+            else:
+                cache_key = 'api_cache_response:{}'.format(etag_value)
+                cached = cache.get(cache_key)
+                if cached:
+                    content, content_type = cached
+                    response = HttpResponse(content, content_type=content_type)
+                else:
+                    response = view_func(request, *args, **kwargs)
+                    if response.status_code != 200 or response.streaming:
+                        return response
+                    cache.set(cache_key, (response.content, response['Content-Type']), timeout)
+
+            response['ETag'] = etag
+            patch_cache_control(response, public=True, max_age=max_age)
+            return response
+        return _wrapped_view
+    return decorator
@@ -1,6 +1,11 @@
 from math import radians, cos, sin, asin, sqrt
 import math
 
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+
 
 def getLatLonDelta(lat, lon, distance):
     """ 
@@ -24,3 +29,44 @@ def getLatLonDelta(lat, lon, distance):
     # lon_delta_bot = distance/km_per_lon_bot
     # lon_delta = max(lon_delta_top, lon_delta_bot)
     # return (lat_delta, lon_delta)
+
+
+def getBoundingBoxQuery(lat, lon, distance, lat_field='latitude', lon_field='longitude'):
+    """
+    return a Q object selecting points inside a bounding box around lat, lon
+    that contains all points within distance km. Longitude ranges wrap around
+    at the antimeridian and the box covers all longitudes near the poles.
+    """
+    lat_delta, lon_delta = getLatLonDelta(lat, lon, distance)
+    lat_min = max(-90, lat - lat_delta)
+    lat_max = min(90, lat + lat_delta)
+    query = Q(**{f'{lat_field}__gte': lat_min, f'{lat_field}__lte': lat_max})
+
+    # km per degree longitude shrinks away from lat, so a box around a pole
+    # needs to include all longitudes
+    if lat_max >= 90 or lat_min <= -90 or lon_delta >= 180:
+        return query
+
+    lon_min = lon - lon_delta
+    lon_max = lon + lon_delta
+    if lon_min < -180:
+        lon_query = Q(**{f'{lon_field}__gte': lon_min + 360}) | Q(**{f'{lon_field}__lte': lon_max})
+    elif lon_max > 180:
+        lon_query = Q(**{f'{lon_field}__gte': lon_min}) | Q(**{f'{lon_field}__lte': lon_max - 360})
+    else:
+        lon_query = Q(**{f'{lon_field}__gte': lon_min, f'{lon_field}__lte': lon_max})
+    return query & lon_query
+
+
+def haversineDistance(lat, lon, lat_field='latitude', lon_field='longitude'):
+    """
+    return a database expression for the great circle distance in km between
+    lat, lon and the coordinates stored in lat_field, lon_field
+    """
+    lat1 = Radians(Value(lat, output_field=FloatField()))
+    lon1 = Radians(Value(lon, output_field=FloatField()))
+    lat2 = Radians(Cast(F(lat_field), FloatField()))
+    lon2 = Radians(Cast(F(lon_field), FloatField()))
+    a = Power(Sin((lat2 - lat1) / 2), 2) + Cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    # guard against rounding errors pushing a slightly above 1
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(Least(Value(1.0, output_field=FloatField()), a)))
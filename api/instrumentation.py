@@ -0,0 +1,147 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager, ExitStack
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+MAX_SAMPLES = 1000
+
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_samples_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    """ queries, DB time and serialization time for a single request """
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.query_count += 1
+
+    @contextmanager
+    def serializing(self):
+        start = time.perf_counter()
+        db_time = self.db_time
+        try:
+            yield
+        finally:
+            # queries run while serializing are counted as DB time
+            self.serialize_time += time.perf_counter() - start - (self.db_time - db_time)
+
+
+@contextmanager
+def serializing(request):
+    """ add the time spent in the block to the serialization time of request,
+    for converting objects to JSON values as well as encoding them """
+    metrics = getattr(request, 'metrics', None)
+    if metrics is None:
+        yield
+        return
+    with metrics.serializing():
+        yield
+
+
+@contextmanager
+def _record_queries(metrics):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        yield
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def get_stats():
+    """ return percentiles for the recent requests to every instrumented view """
+    with _samples_lock:
+        samples = {view: list(view_samples) for view, view_samples in _samples.items()}
+    stats = {}
+    for view, view_samples in samples.items():
+        stats[view] = {"count": len(view_samples)}
+        for field in ["query_count", "db_ms", "serialize_ms", "total_ms", "size"]:
+            values = [sample[field] for sample in view_samples]
+            stats[view][field] = {
+                "p50": _percentile(values, 50),
+                "p90": _percentile(values, 90),
+                "p99": _percentile(values, 99),
+                "max": max(values),
+            }
+    return stats
+
+
+def reset_stats():
+    with _samples_lock:
+        _samples.clear()
+
+
+def get_query_budget(view_name):
+    return getattr(settings, 'API_QUERY_BUDGETS', {}).get(view_name)
+
+
+class InstrumentationMiddleware:
+    """
+    record the number of queries, DB time, serialization time and response
+    size for API views. The timings are added to the response in a
+    Server-Timing header. When API_QUERY_BUDGET_ENFORCE is set, a request that
+    runs more queries than the budget in API_QUERY_BUDGETS for the URL name
+    raises QueryBudgetExceeded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(getattr(settings, 'API_INSTRUMENTATION_PREFIX', '/api/')):
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        request.metrics = metrics
+        start = time.perf_counter()
+        with _record_queries(metrics):
+            response = self.get_response(request)
+        total_time = time.perf_counter() - start
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.url_name if resolver_match and resolver_match.url_name else request.path
+        size = 0 if response.streaming else len(response.content)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.1f};desc="{} queries"'.format(metrics.db_time*1000, metrics.query_count),
+            'serialize;dur={:.1f}'.format(metrics.serialize_time*1000),
+            'total;dur={:.1f}'.format(total_time*1000),
+        ])
+
+        with _samples_lock:
+            _samples[view_name].append({
+                "query_count": metrics.query_count,
+                "db_ms": round(metrics.db_time*1000, 1),
+                "serialize_ms": round(metrics.serialize_time*1000, 1),
+                "total_ms": round(total_time*1000, 1),
+                "size": size,
+            })
+
+        budget = get_query_budget(view_name)
+        if getattr(settings, 'API_QUERY_BUDGET_ENFORCE', False) and budget is not None and metrics.query_count > budget:
+            raise QueryBudgetExceeded(
+                '{} ran {} queries, the budget is {}'.format(view_name, metrics.query_count, budget)
+            )
+        return response
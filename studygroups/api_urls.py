@@ -1,21 +1,30 @@
 from django.conf.urls import url
 from django.views.generic import TemplateView
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+
+from api.cache import cache_json_response
 
 from . import views
+from .models import Application, Course, Meeting, StudyGroup, TeamMembership
+
+# the responses are filtered by team and include the names of the facilitators
+learning_circle_models = [StudyGroup, Course, Meeting, Application, TeamMembership, User]
+course_models = [Course, StudyGroup, Meeting, TeamMembership]
 
 urlpatterns = [
-    url(r'^learningcircles/$', views.LearningCircleListView.as_view(), name='api_learningcircles'),
+    url(r'^learningcircles/$', cache_json_response(learning_circle_models)(views.LearningCircleListView.as_view()), name='api_learningcircles'),
     url(r'^learningcircles/successes/$', views.FinalReportListView.as_view(), name='api_learningcircles_successes'),
-    url(r'^learningcircles/topics/$', views.LearningCircleTopicListView.as_view(), name='api_learningcircle_topics'),
-    url(r'^courses/$', views.CourseListView.as_view(), name='api_courses'),
-    url(r'^courses/topics/$', views.CourseTopicListView.as_view(), name='api_course_topics'),
-    url(r'^courses/languages/$', views.CourseLanguageListView.as_view(), name='api_course_languages'),
+    url(r'^learningcircles/topics/$', cache_json_response(course_models, max_age=5*60)(views.LearningCircleTopicListView.as_view()), name='api_learningcircle_topics'),
+    url(r'^courses/$', cache_json_response(course_models)(views.CourseListView.as_view()), name='api_courses'),
+    url(r'^courses/topics/$', cache_json_response([Course], max_age=5*60)(views.CourseTopicListView.as_view()), name='api_course_topics'),
+    url(r'^courses/languages/$', cache_json_response([Course], max_age=60*60)(views.CourseLanguageListView.as_view()), name='api_course_languages'),
     url(r'^courses/detect-platform/$', views.detect_platform_from_url, name='api_course_detect_platform'),
     url(r'^signup/$', views.SignupView.as_view(), name='api_learningcircles_signup'),
     url(r'^learning-circle/$', views.LearningCircleCreateView.as_view(), name='api_learningcircles_create'),
     url(r'^learning-circle/(?P<study_group_id>[\d]+)/$', views.LearningCircleUpdateView.as_view(), name='api_learningcircles_update'),
-    url(r'^landing-page-learning-circles/$', views.LandingPageLearningCirclesView.as_view(), name='api_learningcircles_meetings'),
+    url(r'^landing-page-learning-circles/$', cache_json_response(learning_circle_models, max_age=5*60)(views.LandingPageLearningCirclesView.as_view()), name='api_learningcircles_meetings'),
+    url(r'^instrumentation/$', views.InstrumentationStatsView.as_view(), name='api_instrumentation'),
     url(r'^landing-page-stats/$', views.LandingPageStatsView.as_view(), name='api_landing_page_stats'),
     url(r'^upload_image/$', views.ImageUploadView.as_view(), name='api_image_upload'),
     url(r'^learning-circles-map/$', views.LearningCirclesMapView.as_view(), name='api_learningcircles_map'),
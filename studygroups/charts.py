@@ -9,26 +9,39 @@ import pygal
 import json
 import os
 import boto3
+import bisect
 import datetime
+import hashlib
 
 from dateutil.relativedelta import relativedelta
 from pygal.style import Style
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 from collections import Counter
+from collections import defaultdict
+from itertools import accumulate
 
 from studygroups.forms import ApplicationForm
 from studygroups.models import StudyGroup
 from studygroups.models import Course
 from studygroups.models import Meeting
 from studygroups.models import Application
-from studygroups.models import get_studygroups_with_meetings
-from surveys.models import FacilitatorSurveyResponse
+from studygroups.models import Feedback
+from studygroups.models import TeamMembership
 from surveys.models import LearnerSurveyResponse
+from surveys.models import FacilitatorSurveyResponse
+from surveys.models import FacilitatorSurveySummary
+from surveys.models import LearnerSurveySummary
 from surveys.models import MAX_STAR_RATING
 from surveys.models import learner_survey_summary
-from surveys.models import facilitator_survey_summary
+from api.cache import get_model_version
 
 import logging
 
@@ -40,6 +53,25 @@ NO_DATA = "<p>No data</p>"
 
 theme_colors = ['#05C6B4', '#B7D500', '#FFBC1A', '#FC7100', '#e83e8c']
 
+# the models the report and stats dash charts are generated from, the team
+# stats dash charts depend on the members of the team
+CHART_DATA_MODELS = [StudyGroup, Meeting, Feedback, Application, Course, TeamMembership, LearnerSurveyResponse, FacilitatorSurveyResponse, LearnerSurveySummary, FacilitatorSurveySummary]
+CHART_CACHE_TIMEOUT = 24*60*60
+
+
+def cached_chart(name, params, render, models=CHART_DATA_MODELS, timeout=CHART_CACHE_TIMEOUT):
+    """ return the chart rendered by render(). The chart is kept in the cache
+    under a key derived from name, params and the versions of models, so it is
+    rendered again after one of the models changed. Charts that are no longer
+    used are evicted by the cache backend """
+    versions = [get_model_version(model) for model in models]
+    key = 'chart_cache:{}'.format(hashlib.md5(repr((name, params, versions)).encode('utf-8')).hexdigest())
+    chart = cache.get(key)
+    if chart is None:
+        chart = render()
+        cache.set(key, chart, timeout)
+    return chart
+
 
 def save_to_aws(file_, filename):
     s3 = boto3.resource('s3', aws_access_key_id=settings.P2PU_RESOURCES_AWS_ACCESS_KEY, aws_secret_access_key=settings.P2PU_RESOURCES_AWS_SECRET_KEY)
@@ -86,8 +118,8 @@ def get_typeform_survey_facilitator_responses(study_group):
 
 def get_question_field(study_group, question_id):
     if study_group.learnersurveyresponse_set.count() > 0:
-        survey_str = study_group.learnersurveyresponse_set.first().survey
-        survey_fields = json.loads(survey_str)['fields']
+        survey = study_group.learnersurveyresponse_set.first().get_survey()
+        survey_fields = survey.get('fields', [])
         return next((field for field in survey_fields if field["id"] == question_id), None)
 
 def get_response_field(response_str, question_id):
@@ -108,13 +140,73 @@ def percentage(total, divisor):
     return round((total / divisor) * 100)
 
 
+def month_windows(start, end, months=1):
+    """ return the boundaries of consecutive windows of months, starting at
+    start, for every window that starts on or before end """
+    boundaries = [start]
+    while boundaries[-1] <= end:
+        boundaries.append(boundaries[-1] + relativedelta(months=+months))
+    return boundaries
+
+
+def _comparable_boundaries(boundaries, value):
+    """ convert boundaries the way Django does when filtering by a field with value """
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            return [
+                timezone.make_aware(boundary) if timezone.is_naive(boundary) else boundary
+                for boundary in boundaries
+            ]
+        return boundaries
+    if isinstance(value, datetime.date):
+        return [
+            (timezone.make_naive(boundary) if timezone.is_aware(boundary) else boundary).date()
+            if isinstance(boundary, datetime.datetime) else boundary
+            for boundary in boundaries
+        ]
+    return boundaries
+
+
+def window_index(boundaries, value):
+    """ return i for boundaries[i] <= value < boundaries[i+1], or None """
+    boundaries = _comparable_boundaries(boundaries, value)
+    i = bisect.bisect_right(boundaries, value) - 1
+    return i if 0 <= i < len(boundaries) - 1 else None
+
+
+def count_by_window(queryset, field, boundaries, group_by=None):
+    """
+    Count the rows in queryset in every window between consecutive boundaries,
+    ie. boundaries[i] <= field < boundaries[i+1], using one grouped query.
+    Returns a list with the count for every window, or a Counter with the
+    count for every value of group_by in every window.
+    """
+    counts = [Counter() for i in range(len(boundaries) - 1)]
+    if counts:
+        fields = [field, group_by] if group_by else [field]
+        rows = queryset.filter(**{
+            '{}__gte'.format(field): boundaries[0],
+            '{}__lt'.format(field): boundaries[-1],
+        }).order_by().values(*fields).annotate(count=Count('pk', distinct=True))
+        rows = list(rows)
+        if rows:
+            boundaries = _comparable_boundaries(boundaries, rows[0][field])
+        for row in rows:
+            window = window_index(boundaries, row[field])
+            if window is not None:
+                counts[window][row[group_by] if group_by else None] += row['count']
+    if group_by:
+        return counts
+    return [counter[None] for counter in counts]
+
+
 def goals_chart(study_group):
     # get all application goals
     applications = study_group.application_set.active()
     goals = [ appl.get_goal() for appl in applications if appl.get_goal() ]
     # add all survey responses for which do do not have goals
     application_ids = [ appl.pk for appl in applications if appl.get_goal() ]
-    survey_responses = study_group.learnersurveyresponse_set.exclude(learner__in=application_ids)
+    survey_responses = study_group.learnersurveyresponse_set.exclude(learner__in=application_ids).select_related('summary', 'learner')
     survey_data = map(learner_survey_summary, survey_responses)
     goals += [ response.get("goal") for response in survey_data if response.get("goal")]
     goals = list(set(goals))
@@ -131,8 +223,8 @@ def goals_chart(study_group):
 
 def next_steps_chart(study_group):
     html = "<div><ul class='quote-list list-unstyled'>"
-    chart_data = map(learner_survey_summary, study_group.learnersurveyresponse_set.all())
-    values = [ response.get("next_steps") for response in chart_data if response.get("next_steps")]
+    summaries = LearnerSurveySummary.objects.filter(study_group=study_group)
+    values = [ value for value in summaries.values_list("next_steps", flat=True) if value]
     values = list(set(values))
     for value in values[:5]:
         html += "<li class='pl-2 my-3 font-italic'>&quot;{}&quot;</li>".format(value)
@@ -146,12 +238,11 @@ def attendance_chart(study_group):
     # precedence: reported in survey, recorded in weekly feedback
     meetings = study_group.meeting_set.active().order_by('meeting_date', 'meeting_time')
     attendance = [m.feedback_set.first().attendance if m.feedback_set.first() else None for m in meetings]
-    survey_responses = study_group.facilitatorsurveyresponse_set.all()
-    if survey_responses.count():
-        facilitator_survey_response = survey_responses.first()  #TODO there could be more than 1 reply
-        attendance_1 = facilitator_survey_response.get_value_by_ref('attendance_1_alt')
-        attendance_2 = facilitator_survey_response.get_value_by_ref('attendance_2_alt')
-        attendance_n = facilitator_survey_response.get_value_by_ref('attendance_n_alt')
+    survey_summary = FacilitatorSurveySummary.objects.filter(study_group=study_group).order_by('response').first()  #TODO there could be more than 1 reply
+    if survey_summary:
+        attendance_1 = survey_summary.attendance_1
+        attendance_2 = survey_summary.attendance_2
+        attendance_n = survey_summary.attendance_n
         if attendance_1 and len(attendance):
             attendance[0] = attendance_1
         if attendance_2 and len(attendance) > 1:
@@ -171,10 +262,8 @@ def attendance_chart(study_group):
 
 
 def recommendation_chart(study_group):
-    applications = study_group.application_set.active()
-    survey_responses = study_group.learnersurveyresponse_set.all()
-    survey_data = map(learner_survey_summary, survey_responses)
-    recommendations = [ response.get("recommendation_rating") for response in survey_data if response.get("recommendation_rating")]
+    summaries = LearnerSurveySummary.objects.filter(study_group=study_group)
+    recommendations = [ value for value in summaries.values_list("recommendation_rating", flat=True) if value]
     if not len(recommendations):
         return NO_DATA
     counts = [ sum(1 for x in recommendations if x == i) for i in range(1,6) ]
@@ -186,13 +275,11 @@ def recommendation_chart(study_group):
 
 
 def recommendation_reasons_chart(study_group):
-    applications = study_group.application_set.active()
-    survey_responses = study_group.learnersurveyresponse_set.all()
-    survey_data = map(learner_survey_summary, survey_responses)
+    summaries = LearnerSurveySummary.objects.filter(study_group=study_group)
     why = [
-        (r.get("recommendation_rating_reason"), r.get('recommendation_rating'))
-        for r in survey_data
-        if r.get("recommendation_rating_reason") and r.get('recommendation_rating')
+        (reason, rating)
+        for reason, rating in summaries.values_list("recommendation_rating_reason", "recommendation_rating")
+        if reason and rating
     ]
     why.sort(key=lambda i: i[1])
     why.reverse()
@@ -220,7 +307,7 @@ class GoalsMetChart():
     def get_data(self):
         """ Combine data from applications and surveys """
         rating_counts = [0]*5
-        survey_responses = self.study_group.learnersurveyresponse_set.all()
+        survey_responses = self.study_group.learnersurveyresponse_set.select_related('summary', 'learner')
         survey_summaries = map(learner_survey_summary, survey_responses)
         goal_ratings = [res.get('goal_rating') for res in survey_summaries if res.get('goal_rating')]
         applications = self.study_group.application_set.filter(goal_met__isnull=False, learnersurveyresponse__isnull=True)
@@ -254,8 +341,8 @@ class GoalsMetChart():
 
 
 def topic_confidence_chart(study_group):
-    survey_data = map(learner_survey_summary, study_group.learnersurveyresponse_set.all())
-    ratings = [res.get('subject_confidence') for res in survey_data if res.get('subject_confidence')]
+    summaries = LearnerSurveySummary.objects.filter(study_group=study_group)
+    ratings = [rating for rating in summaries.values_list('subject_confidence', flat=True) if rating]
     if not len(ratings):
         return NO_DATA
     counts = [0]*5
@@ -378,18 +465,20 @@ class LearningCircleMeetingsChart():
         start_date = datetime.date(2016, 1, 1)
         end_date = datetime.date(2016, 1, 31)
 
+        # the total number of meetings before the last day of every month
+        end_dates = []
         while end_date <= self.report_date:
-            meetings_count = Meeting.objects.active().filter(meeting_date__gte=start_date, meeting_date__lt=end_date, study_group__deleted_at__isnull=True, study_group__draft=False).count()
             if end_date.month % 3 == 1:
                 data["dates"].append(end_date.strftime("%b %Y"))
             else:
                 data["dates"].append("")
-            data["meetings"].append(meetings_count)
+            end_dates.append(end_date)
             end_date = end_date + relativedelta(months=+2)
             end_date = end_date.replace(day=1) - relativedelta(days=1)
 
-        meetings_count = Meeting.objects.active().filter(meeting_date__gte=start_date, meeting_date__lt=self.report_date, study_group__deleted_at__isnull=True, study_group__draft=False).count()
-        data["meetings"].append(meetings_count)
+        meetings = Meeting.objects.active().filter(study_group__deleted_at__isnull=True, study_group__draft=False)
+        counts = count_by_window(meetings, 'meeting_date', [start_date] + end_dates + [self.report_date])
+        data["meetings"] = list(accumulate(counts))
 
         return data
 
@@ -419,30 +508,32 @@ class LearningCircleCountriesChart():
         self.start_date = start_date
         self.report_date = report_date
 
+    def get_studygroups(self):
+        """ return the published learning circles with meetings from start_date to report_date """
+        meeting_dates = StudyGroup.objects.published().annotate(
+            first_meeting_date=Min('meeting__meeting_date', filter=Q(meeting__deleted_at__isnull=True)),
+            last_meeting_date=Max('meeting__meeting_date', filter=Q(meeting__deleted_at__isnull=True)),
+        ).filter(
+            Q(first_meeting_date__gte=self.start_date, first_meeting_date__lte=self.report_date)
+            | Q(last_meeting_date__gte=self.start_date, last_meeting_date__lte=self.report_date)
+            | Q(first_meeting_date__lte=self.start_date, last_meeting_date__gte=self.report_date)
+        )
+        return StudyGroup.objects.filter(pk__in=meeting_dates.values('pk'))
+
     def get_data(self):
         data = { "Not reported": 0 }
 
-        studygroups = StudyGroup.objects.published()
-
-        for sg in studygroups:
-            first_meeting = sg.first_meeting()
-            last_meeting = sg.last_meeting()
-
-            if first_meeting is not None and last_meeting is not None:
-                if (first_meeting.meeting_date >= self.start_date and first_meeting.meeting_date <= self.report_date)\
-                or (last_meeting.meeting_date >= self.start_date and last_meeting.meeting_date <= self.report_date)\
-                or (first_meeting.meeting_date <= self.start_date and last_meeting.meeting_date >= self.report_date):
-                    country = sg.country_en
-                    country = "USA" if country == "United States of America" else country
+        countries = self.get_studygroups().values('country_en').annotate(count=Count('id')).order_by('-count', 'country_en')
+        for row in countries:
+            country = row['country_en']
+            country = "USA" if country == "United States of America" else country
 
-                    country = "USA" if country == "United States of America" else country
-
-                    if country in data:
-                        data[country] += 1
-                    elif country is "" or country is None:
-                        data["Not reported"] += 1
-                    else:
-                        data[country] = 1
+            if country in data:
+                data[country] += row['count']
+            elif not country:
+                data["Not reported"] += row['count']
+            else:
+                data[country] = row['count']
 
         return data
 
@@ -532,15 +623,19 @@ class TotalLearnersChart():
         start_date = datetime.date(2016, 1, 1)
         end_date = datetime.date(2016, 1, 31)
 
+        end_dates = []
         while end_date <= self.report_date:
-            meetings_count = Meeting.objects.active().filter(meeting_date__gte=start_date, meeting_date__lt=end_date, study_group__deleted_at__isnull=True, study_group__draft=False).count()
             if end_date.month % 3 == 1:
                 data["dates"].append(end_date.strftime("%b %Y"))
             else:
                 data["dates"].append("")
-            data["meetings"].append(meetings_count)
+            end_dates.append(end_date)
             end_date = end_date + relativedelta(months=+1)
 
+        meetings = Meeting.objects.active().filter(study_group__deleted_at__isnull=True, study_group__draft=False)
+        counts = count_by_window(meetings, 'meeting_date', [start_date] + end_dates)
+        data["meetings"] = list(accumulate(counts))
+
         return data
 
 
@@ -580,29 +675,26 @@ class FacilitatorRatingOverTimeChart():
         if self.study_groups.count() < 1:
             return None
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            lcs = self.study_groups.filter(end_date__gte=window_start, end_date__lt=window_end)
-            # get rating, presedence: goal_rating > faciltator_rating > survey goal rating
-            ratings = list(lcs.filter(facilitator_goal_rating__isnull=False).values_list('facilitator_goal_rating', flat=True))
-            ratings += list(lcs.filter(facilitator_goal_rating__isnull=True, facilitator_rating__isnull=False).values_list('facilitator_rating', flat=True))
-            #ratings = [s.facilitator_goal_rating if s.facilitator_goal_rating else s.facilitator_rating for s in lcs]
-            surveys = FacilitatorSurveyResponse.objects.filter(study_group__in=lcs.filter(facilitator_goal_rating__isnull=True, facilitator_rating__isnull=True))
-            surveys = map(facilitator_survey_summary, surveys)
-            ratings += [r.get('goal_rating') for r in surveys]
-            ratings += [None]*(lcs.count()-len(ratings))  # pad ratings with None's as all other learning circles are considered unrated
-            ratings_counter = Counter(ratings)
+        boundaries = month_windows(self.start_time, self.end_time)
+        lcs = self.study_groups
+        lc_counts = count_by_window(lcs, 'end_date', boundaries)
+        # get rating, presedence: goal_rating > faciltator_rating > survey goal rating
+        goal_ratings = count_by_window(lcs.filter(facilitator_goal_rating__isnull=False), 'end_date', boundaries, group_by='facilitator_goal_rating')
+        facilitator_ratings = count_by_window(lcs.filter(facilitator_goal_rating__isnull=True, facilitator_rating__isnull=False), 'end_date', boundaries, group_by='facilitator_rating')
+        surveys = FacilitatorSurveySummary.objects.filter(study_group__in=lcs.filter(facilitator_goal_rating__isnull=True, facilitator_rating__isnull=True))
+        # surveys without a rating are counted as None
+        survey_ratings = count_by_window(surveys, 'study_group__end_date', boundaries, group_by='goal_rating')
+
+        for window_start, lc_count, *window_ratings in zip(boundaries, lc_counts, goal_ratings, facilitator_ratings, survey_ratings):
+            ratings_counter = sum(window_ratings, Counter())
+            # pad ratings with None's as all other learning circles are considered unrated
+            ratings_counter[None] += max(lc_count - sum(ratings_counter.values()), 0)
 
             for rating, collection in data.items():
                 collection.append(ratings_counter[rating])
 
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
-
         return { "data": data, "dates": dates }
 
     def generate(self, **opts):
@@ -649,26 +741,16 @@ class FacilitatorCourseApprovalChart():
         if self.study_groups.count() < 1:
             return None
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            survey_responses = FacilitatorSurveyResponse.objects.filter(study_group__in=self.study_groups, responded_at__gte=window_start, responded_at__lt=window_end)
-
-            ratings = map(facilitator_survey_summary, survey_responses)
-            ratings = [r.get('course_rating') for r in ratings if r.get('course_rating')]
-
-            ratings_counter = Counter(ratings)
+        boundaries = month_windows(self.start_time, self.end_time)
+        summaries = FacilitatorSurveySummary.objects.filter(study_group__in=self.study_groups)
+        window_ratings = count_by_window(summaries, 'response__responded_at', boundaries, group_by='course_rating')
 
+        for window_start, ratings_counter in zip(boundaries, window_ratings):
             for rating, collection in data.items():
                 collection.append(ratings_counter[rating])
 
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
-
-
         return { "data": data, "dates": dates }
 
     def generate(self, **opts):
@@ -713,25 +795,16 @@ class LearnerCourseApprovalChart():
         if self.study_groups.count() < 1:
             return None
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            survey_responses = LearnerSurveyResponse.objects.filter(study_group__in=self.study_groups, responded_at__gte=window_start, responded_at__lt=window_end)
-
-            ratings = map(learner_survey_summary, survey_responses)
-            ratings = [r.get('course_rating') for r in ratings if r.get('course_rating')]
-            ratings_counter = Counter(ratings)
+        boundaries = month_windows(self.start_time, self.end_time)
+        summaries = LearnerSurveySummary.objects.filter(study_group__in=self.study_groups)
+        window_ratings = count_by_window(summaries, 'response__responded_at', boundaries, group_by='course_rating')
 
+        for window_start, ratings_counter in zip(boundaries, window_ratings):
             for rating, collection in data.items():
                 collection.append(ratings_counter[rating])
 
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
-
-
         return { "data": data, "dates": dates }
 
 
@@ -775,19 +848,26 @@ class FacilitatorExperienceChart():
 
         data["5+"] = []
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            study_groups = self.study_groups.filter(start_date__gte=window_start, start_date__lt=window_end)
-
-            counts = []
-
-            for sg in study_groups:
-                facilitator = sg.facilitator
-                sg_count = StudyGroup.objects.published().filter(start_date__lte=sg.start_date, facilitator=facilitator).count()
-                counts.append(sg_count)
-
+        boundaries = month_windows(self.start_time, self.end_time)
+        study_groups = self.study_groups.filter(start_date__gte=boundaries[0], start_date__lt=boundaries[-1])
+        study_groups = list(study_groups.values_list('id', 'facilitator_id', 'start_date'))
+
+        # start dates of all the learning circles of the facilitators
+        start_dates = defaultdict(list)
+        facilitator_study_groups = StudyGroup.objects.published().filter(facilitator__in=[facilitator_id for id_, facilitator_id, start_date in study_groups])
+        for facilitator_id, start_date in facilitator_study_groups.values_list('facilitator_id', 'start_date'):
+            start_dates[facilitator_id].append(start_date)
+        for facilitator_start_dates in start_dates.values():
+            facilitator_start_dates.sort()
+
+        window_counts = [[] for window_start in boundaries[:-1]]
+        for id_, facilitator_id, start_date in study_groups:
+            window = window_index(boundaries, start_date)
+            if window is not None:
+                # learning circles started by the facilitator on or before start_date
+                window_counts[window].append(bisect.bisect_right(start_dates[facilitator_id], start_date))
+
+        for window_start, counts in zip(boundaries, window_counts):
             counter = Counter(counts)
 
             over_5 = 0
@@ -806,9 +886,6 @@ class FacilitatorExperienceChart():
             data["5+"].append(over_5)
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_start + relativedelta(months=+1)
-            window_end = window_start + relativedelta(months=+1)
-
         return { "data": data, "dates": dates }
 
 
@@ -845,27 +922,32 @@ class ParticipantsOverTimeChart():
 
     def get_data(self):
         data = { "first_time_participants": [], "veteran_participants": [], "dates": [] }
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            participants = Application.objects.active().filter(accepted_at__gte=window_start, accepted_at__lt=window_end, study_group__in=self.study_groups)
-
-            first_time_participants = 0
-            veteran_participants = 0
-
-            for participant in participants:
-                if Application.objects.active().filter(accepted_at__lt=window_end, email=participant.email).count() > 1:
-                    veteran_participants += 1
-                else:
-                    first_time_participants += 1
-
-            data["veteran_participants"].append(veteran_participants)
-            data["first_time_participants"].append(first_time_participants)
-            data["dates"].append(window_end.strftime("%b %Y"))
+        boundaries = month_windows(self.start_time, self.end_time)
+        participants = Application.objects.active().filter(accepted_at__gte=boundaries[0], accepted_at__lt=boundaries[-1], study_group__in=self.study_groups)
+
+        # when every participant signed up for any learning circle
+        accepted_at = defaultdict(list)
+        applications = Application.objects.active().filter(accepted_at__lt=boundaries[-1], email__in=participants.values('email'))
+        for email, application_accepted_at in applications.values_list('email', 'accepted_at'):
+            accepted_at[email].append(application_accepted_at)
+        for application_dates in accepted_at.values():
+            application_dates.sort()
+
+        first_time_participants = [0]*(len(boundaries) - 1)
+        veteran_participants = [0]*(len(boundaries) - 1)
+        for email, participant_accepted_at in participants.values_list('email', 'accepted_at'):
+            window = window_index(boundaries, participant_accepted_at)
+            if window is None:
+                continue
+            window_end = _comparable_boundaries(boundaries, participant_accepted_at)[window + 1]
+            if bisect.bisect_left(accepted_at[email], window_end) > 1:
+                veteran_participants[window] += 1
+            else:
+                first_time_participants[window] += 1
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
+        data["veteran_participants"] = veteran_participants
+        data["first_time_participants"] = first_time_participants
+        data["dates"] = [window_end.strftime("%b %Y") for window_end in boundaries[1:]]
 
         return data
 
@@ -996,30 +1078,16 @@ class MeetingsOverTimeChart():
     def get_data(self):
         data = { "current_year": [], "previous_year": [], "dates": [] }
 
-        window_start = datetime.datetime(self.previous_year, 1, 1)
-        window_end = window_start + relativedelta(months=+1)
-        end_date = datetime.datetime(self.previous_year, 12, 31)
-
-        while window_start <= end_date:
-            meetings_count = Meeting.objects.active().filter(meeting_date__gte=window_start, meeting_date__lt=window_end, study_group__deleted_at__isnull=True, study_group__draft=False).count()
-
-            data["dates"].append(window_start.strftime("%b"))
-            data["previous_year"].append(meetings_count)
-
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
+        previous_year = month_windows(datetime.datetime(self.previous_year, 1, 1), datetime.datetime(self.previous_year, 12, 31))
+        current_year = month_windows(self.end_time.replace(month=1, day=1), self.end_time)
 
+        # the months of the previous year end where the current year starts
+        meetings = Meeting.objects.active().filter(study_group__deleted_at__isnull=True, study_group__draft=False)
+        counts = count_by_window(meetings, 'meeting_date', previous_year[:-1] + current_year)
 
-        window_start = self.end_time.replace(month=1, day=1)
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            meetings_count = Meeting.objects.active().filter(meeting_date__gte=window_start, meeting_date__lt=window_end, study_group__deleted_at__isnull=True, study_group__draft=False).count()
-
-            data["current_year"].append(meetings_count)
-
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
+        data["dates"] = [window_start.strftime("%b") for window_start in previous_year[:-1]]
+        data["previous_year"] = counts[:len(previous_year) - 1]
+        data["current_year"] = counts[len(previous_year) - 1:]
 
         return data
 
@@ -1065,23 +1133,28 @@ class StudygroupsByCountryOverTimeChart():
 
         data["Not reported"] = []
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            studygroups_that_met = get_studygroups_with_meetings(window_start, window_end)
-
+        boundaries = month_windows(self.start_time, self.end_time)
+        # the learning circles that met in every window by country
+        window_study_groups = [defaultdict(set) for window_start in boundaries[:-1]]
+        meetings = Meeting.objects.filter(
+            deleted_at__isnull=True,
+            study_group__in=StudyGroup.objects.published(),
+            meeting_date__gte=boundaries[0],
+            meeting_date__lt=boundaries[-1],
+        )
+        for study_group_id, country, meeting_date in meetings.values_list('study_group_id', 'study_group__country_en', 'meeting_date').distinct():
+            window = window_index(boundaries, meeting_date)
+            if window is not None:
+                window_study_groups[window][country].add(study_group_id)
+
+        for window_start, study_groups in zip(boundaries, window_study_groups):
             for country, collection in data.items():
                 if country == "Not reported":
-                    sgs_count = studygroups_that_met.filter(country_en=None).count()
+                    collection.append(len(study_groups[None]))
                 else:
-                    sgs_count = studygroups_that_met.filter(country_en=country).count()
-
-                data[country].append(sgs_count)
+                    collection.append(len(study_groups[country]))
 
             dates.append(window_start.strftime("%b %Y"))
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
 
         return { "data": data, "dates": dates }
 
@@ -1132,26 +1205,19 @@ class LearnerGoalReachedChart():
         if self.study_groups.count() < 1:
             return None
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
-
-        while window_start <= self.end_time:
-            survey_responses = LearnerSurveyResponse.objects.filter(study_group__in=self.study_groups, responded_at__gte=window_start, responded_at__lt=window_end)
-            ratings = [
-                r.get('goal_rating') for r in map(learner_survey_summary, survey_responses)
-                if r.get('goal_rating')
-            ]
-
-            ratings_counter = Counter(ratings)
+        boundaries = month_windows(self.start_time, self.end_time)
+        # the goal rating of the learner takes precedence over the survey, like in learner_survey_summary
+        survey_responses = LearnerSurveyResponse.objects.filter(study_group__in=self.study_groups).annotate(
+            goal_rating=Coalesce('learner__goal_met', 'summary__goal_rating')
+        )
+        window_ratings = count_by_window(survey_responses, 'responded_at', boundaries, group_by='goal_rating')
 
+        for window_start, ratings_counter in zip(boundaries, window_ratings):
             for rating, collection in data.items():
                 collection.append(ratings_counter[rating])
 
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
-
         return { "data": data, "dates": dates }
 
     def generate(self, **opts):
@@ -1193,21 +1259,16 @@ class LearnerResponseRateChart():
         if self.study_groups.count() < 1:
             return None
 
-        window_start = self.start_time
-        window_end = window_start + relativedelta(months=+1)
+        boundaries = month_windows(self.start_time, self.end_time)
+        applications = Application.objects.filter(study_group__in=self.study_groups)
+        application_counts = count_by_window(applications, 'study_group__end_date', boundaries)
+        # TODO This doesn't take surveys without learned data into account
+        response_counts = count_by_window(applications.filter(goal_met__isnull=False), 'study_group__end_date', boundaries)
 
-        while window_start <= self.end_time:
-            applications = Application.objects.filter(study_group__in=self.study_groups, study_group__end_date__gte=window_start, study_group__end_date__lt=window_end)
-            applications_with_responses = applications.filter(goal_met__isnull=False)
-            # TODO This doesn't take surveys without learned data into account
-
-            value = percentage(applications_with_responses.count(), applications.count())
-            data.append(value)
+        for window_start, application_count, response_count in zip(boundaries, application_counts, response_counts):
+            data.append(percentage(response_count, application_count))
             dates.append(window_start.strftime("%b %Y"))
 
-            window_start = window_end
-            window_end = window_start + relativedelta(months=+1)
-
         return { "data": data, "dates": dates }
 
     def generate(self, **opts):
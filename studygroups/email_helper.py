@@ -1,15 +1,78 @@
 from studygroups.utils import render_to_string_ctx
 from premailer import Premailer
 from django.conf import settings
+from django.core.mail import get_connection
 
+from xml.sax.saxutils import escape
 
-def render_html_with_css(template, context):
-    html = render_to_string_ctx(template, context)
+import re
+import threading
+import time
+import uuid
+
+
+# maximum number of parsed stylesheets kept, the stylesheets come from
+# templates, so the cache stays small in practice
+CSS_CACHE_SIZE = 2000
+
+_css_cache_lock = threading.Lock()
+_style_rules_cache = {}
+_inline_stats = {"count": 0, "seconds": 0.0}
+
+
+def _cached(cache, key, compute):
+    with _css_cache_lock:
+        if key in cache:
+            return cache[key]
+    value = compute()
+    with _css_cache_lock:
+        if len(cache) >= CSS_CACHE_SIZE:
+            cache.clear()
+        cache[key] = value
+    return value
+
+
+class CachingPremailer(Premailer):
+    """ Premailer that keeps the rules parsed from a stylesheet for the
+    next email using the same template, parsing the stylesheets themselves
+    is cached by Premailer when cache_css_parsing is set """
+
+    def _parse_style_rules(self, css_body, ruleset_index):
+        return _cached(
+            _style_rules_cache,
+            (css_body, ruleset_index, self.disable_validation),
+            lambda: super(CachingPremailer, self)._parse_style_rules(css_body, ruleset_index)
+        )
+
+
+def inline_css(html):
+    start = time.perf_counter()
     base_url = f"{settings.PROTOCOL}://{settings.DOMAIN}"
-    html_with_inlined_css = Premailer(html, base_url=base_url, disable_validation=True).transform()
+    html_with_inlined_css = CachingPremailer(html, base_url=base_url, disable_validation=True, cache_css_parsing=True).transform()
+    with _css_cache_lock:
+        _inline_stats["count"] += 1
+        _inline_stats["seconds"] += time.perf_counter() - start
     return html_with_inlined_css
 
 
+def get_inline_stats():
+    """ return the number of emails inlined by this process and the time it took """
+    with _css_cache_lock:
+        count, seconds = _inline_stats["count"], _inline_stats["seconds"]
+        cached_stylesheets = len(_style_rules_cache)
+    return {
+        "count": count,
+        "total_ms": round(seconds*1000, 1),
+        "mean_ms": round(seconds*1000/count, 1) if count else 0,
+        "cached_stylesheets": cached_stylesheets,
+    }
+
+
+def render_html_with_css(template, context):
+    html = render_to_string_ctx(template, context)
+    return inline_css(html)
+
+
 def render_email_templates(template_base, context):
     """ use template_base to render subject, text and html for email """
     # TODO make text template optional - use html to text when not specified
@@ -26,3 +89,68 @@ def render_email_templates(template_base, context):
         context
     )
     return subject, txt, html
+
+
+SCRIPT_RE = re.compile(r'(<script.*?</script>)', re.DOTALL)
+
+
+def prerender_email_templates(template_base, context, recipient_keys):
+    """ render subject, text and html for an email sent to many recipients once
+
+    The context variables in recipient_keys are rendered as placeholders and
+    a function is returned that takes a dict with the values for a recipient
+    and returns subject, text and html with the placeholders replaced. The
+    values for a recipient should be URLs or plain text.
+    """
+    token = uuid.uuid4().hex
+    # placeholders look like absolute URLs so that Premailer leaves them as is in links
+    placeholders = {key: 'https://placeholder.invalid/{}/{}'.format(token, key) for key in recipient_keys}
+    subject, txt, html = render_email_templates(template_base, {**context, **placeholders})
+    # Premailer escapes the html, except for the content of script tags
+    html_parts = SCRIPT_RE.split(html)
+
+    def render_for_recipient(recipient_context):
+        rendered_subject, rendered_txt, rendered_html_parts = subject, txt, list(html_parts)
+        for key, placeholder in placeholders.items():
+            value = str(recipient_context[key])
+            rendered_subject = rendered_subject.replace(placeholder, value)
+            rendered_txt = rendered_txt.replace(placeholder, value)
+            rendered_html_parts = [
+                part.replace(placeholder, value if i % 2 else escape(value))
+                for i, part in enumerate(rendered_html_parts)
+            ]
+        return rendered_subject, rendered_txt, ''.join(rendered_html_parts)
+
+    return render_for_recipient
+
+
+def send_messages(messages, connection=None, rate_limit=0):
+    """ send messages over a single connection to the mail server
+
+    Returns a list with None for every message that was sent and the
+    exception for every message that failed, in the order of messages. A
+    failed message doesn't stop the remaining messages from being sent.
+    rate_limit is the maximum number of messages sent per second.
+    """
+    connection = connection or get_connection()
+    errors = []
+    try:
+        for i, message in enumerate(messages):
+            if rate_limit and i:
+                time.sleep(1.0/rate_limit)
+            try:
+                # open is a noop while the connection is open
+                connection.open()
+                connection.send_messages([message])
+            except Exception as e:
+                errors.append(e)
+                # the server may have dropped the connection, open a new one for the next message
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            else:
+                errors.append(None)
+    finally:
+        connection.close()
+    return errors
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db import transaction
+from django.test.utils import CaptureQueriesContext
+
+from studygroups.charts import LearningCircleCountriesChart
+from studygroups.models import Course
+from studygroups.models import Meeting
+from studygroups.models import StudyGroup
+
+import datetime
+import timeit
+
+
+COUNTRIES = ["United States of America", "South Africa", "Kenya", "Germany", "Brazil", ""]
+
+
+class Rollback(Exception):
+    pass
+
+
+def _countries_by_meeting_lookups(start_date, report_date):
+    """ count the learning circles per country with two meeting queries for
+    every published learning circle, like the chart used to """
+    data = { "Not reported": 0 }
+    for sg in StudyGroup.objects.published():
+        first_meeting = sg.first_meeting()
+        last_meeting = sg.last_meeting()
+        if first_meeting is None or last_meeting is None:
+            continue
+        if (start_date <= first_meeting.meeting_date <= report_date)\
+        or (start_date <= last_meeting.meeting_date <= report_date)\
+        or (first_meeting.meeting_date <= start_date and last_meeting.meeting_date >= report_date):
+            country = "USA" if sg.country_en == "United States of America" else sg.country_en
+            if not country:
+                country = "Not reported"
+            data[country] = data.get(country, 0) + 1
+    return data
+
+
+def _seed(count):
+    facilitator = User.objects.create_user('benchmark_countries_chart', 'benchmark@example.net', 'password')
+    course = Course.objects.create(
+        title='Benchmark course', provider='P2PU', link='https://example.net/course',
+        caption='', on_demand=True, topics='', language='en', created_by=facilitator
+    )
+    study_groups = StudyGroup.objects.bulk_create([
+        StudyGroup(
+            name='Learning circle {}'.format(i),
+            course=course,
+            venue_name='Public library',
+            venue_address='1 Main street',
+            venue_details='',
+            city='Chicago',
+            country_en=COUNTRIES[i % len(COUNTRIES)],
+            language='en',
+            facilitator=facilitator,
+            start_date=datetime.date(2019, 1, 1) + datetime.timedelta(days=i % 700),
+            meeting_time=datetime.time(18, 30),
+            end_date=datetime.date(2019, 2, 5) + datetime.timedelta(days=i % 700),
+            timezone='UTC',
+            draft=i % 10 == 0,
+        )
+        for i in range(count)
+    ])
+    meetings = []
+    for i, sg in enumerate(study_groups):
+        for week in range(i % 7):
+            meetings.append(Meeting(
+                study_group=sg,
+                meeting_date=sg.start_date + datetime.timedelta(weeks=week),
+                meeting_time=sg.meeting_time,
+                deleted_at=sg.created_at if week == 3 else None,
+            ))
+    Meeting.objects.bulk_create(meetings, batch_size=1000)
+    return len(meetings)
+
+
+class Command(BaseCommand):
+    help = 'Compare counting learning circles per country with a query per learning circle and with one grouped query, using a seeded database that is rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        count, repeat = options['count'], options['repeat']
+        start_date, report_date = datetime.date(2019, 6, 1), datetime.date(2019, 12, 31)
+        chart = LearningCircleCountriesChart(start_date, report_date)
+        try:
+            with transaction.atomic():
+                meetings = _seed(count)
+                expected = _countries_by_meeting_lookups(start_date, report_date)
+                if chart.get_data() != expected:
+                    raise Exception('Country counts are different: {} != {}'.format(chart.get_data(), expected))
+
+                paths = [
+                    ('query per learning circle', lambda: _countries_by_meeting_lookups(start_date, report_date)),
+                    ('grouped query', chart.get_data),
+                ]
+                print("Counting countries for {} learning circles with {} meetings, best of {}".format(count, meetings, repeat))
+                for name, func in paths:
+                    with CaptureQueriesContext(connection) as queries:
+                        func()
+                    best = min(timeit.repeat(func, number=1, repeat=repeat))
+                    print("{:<30} {:8.1f} ms {:8} queries".format(name, best*1000, len(queries)))
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from uxhelpers.utils import json_value
+from uxhelpers.utils import _iterencode
+from uxhelpers.utils import _stdlib_dumps
+from uxhelpers.utils import json_dumps
+
+from decimal import Decimal
+import datetime
+import json
+import pytz
+import timeit
+
+
+START_DATETIME = datetime.datetime(2020, 1, 1, 18, 30, 0, 123456, tzinfo=pytz.utc)
+
+
+def _synthetic_learning_circle(i, convert):
+    start_date = datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 365)
+    values = {
+        "latitude": Decimal('41.850030') + Decimal(i % 1000) / 1000,
+        "longitude": Decimal('-87.650050') - Decimal(i % 1000) / 1000,
+        "start_date": start_date,
+        "start_datetime": START_DATETIME + datetime.timedelta(hours=i),
+        "meeting_time": datetime.time(18, 30),
+    }
+    if convert:
+        values = {key: json_value(value) for key, value in values.items()}
+    return dict(values, **{
+        "course": {
+            "id": i % 200,
+            "title": "Course {}".format(i % 200),
+            "provider": "P2PU",
+            "link": "https://example.net/course/{}".format(i % 200),
+        },
+        "id": i,
+        "name": "Learning circle {}".format(i),
+        "facilitator": "Facilitator",
+        "venue": "Public library",
+        "city": "Chicago",
+        "country": "United States of America",
+        "language": "en",
+        "weeks": 6,
+        "draft": False,
+        "signup_count": i % 20,
+    })
+
+
+class Command(BaseCommand):
+    help = 'Compare the old and new JSON encoding paths used by json_response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        count, repeat = options['count'], options['repeat']
+        raw = {"items": [_synthetic_learning_circle(i, False) for i in range(count)]}
+        converted = {"items": [_synthetic_learning_circle(i, True) for i in range(count)]}
+
+        if json.loads(json.dumps(raw, cls=DjangoJSONEncoder)) != json.loads(json_dumps(converted)):
+            raise Exception('Encoders produce different results')
+
+        paths = [
+            ('DjangoJSONEncoder', lambda: json.dumps(raw, cls=DjangoJSONEncoder)),
+            ('stdlib encoder, unconverted', lambda: _stdlib_dumps(raw)),
+            ('stdlib encoder, converted', lambda: _stdlib_dumps(converted)),
+            ('json_dumps ({})'.format(json_dumps.__name__), lambda: json_dumps(converted)),
+            ('json_dumps streamed', lambda: ''.join(_iterencode(converted, json_dumps))),
+        ]
+        print("Encoding {} learning circles, best of {}".format(count, repeat))
+        for name, func in paths:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print("{:<30} {:8.1f} ms".format(name, best*1000))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
-from studygroups.models import send_learner_survey
+from studygroups.tasks import send_learner_survey
+from studygroups.models.outbox import send_queued
 from studygroups.models import StudyGroup
 
 import datetime
@@ -23,7 +24,6 @@ class Command(BaseCommand):
                 applications = study_group.application_set.active().filter(accepted_at__isnull=False).exclude(email='')
                 timezone.deactivate()
 
-                for application in applications:
-                    send_learner_survey(application)
+                send_queued([send_learner_survey(application) for application in applications])
 
 
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from studygroups.models import Course
+from studygroups.models import StudyGroup
+
+class Command(BaseCommand):
+    help = 'Update the stored full text search vectors for all courses and learning circles'
+
+    def handle(self, *args, **options):
+        count = Course.objects.all().update_search_vector()
+        print("Updated search vector for {} courses".format(count))
+        count = StudyGroup.objects.all().update_search_vector()
+        print("Updated search vector for {} learning circles".format(count))
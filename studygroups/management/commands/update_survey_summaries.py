@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from surveys.models import LearnerSurveyResponse
+from surveys.models import FacilitatorSurveyResponse
+from surveys.models import save_survey_summaries
+from surveys.community_feedback import calculate_all_course_ratings
+
+BATCH_SIZE = 1000
+
+class Command(BaseCommand):
+    help = 'Recalculate the stored summaries of all Typeform survey responses'
+
+    def handle(self, *args, **options):
+        for model in [LearnerSurveyResponse, FacilitatorSurveyResponse]:
+            survey_responses = model.objects.select_related('study_group').order_by('pk')
+            count = 0
+            for start in range(0, survey_responses.count(), BATCH_SIZE):
+                count += len(save_survey_summaries(survey_responses[start:start + BATCH_SIZE]))
+            print("Updated summaries for {} {} objects".format(count, model.__name__))
+        # the course ratings are counted from the summaries
+        print("Updated the ratings of {} courses".format(calculate_all_course_ratings()))
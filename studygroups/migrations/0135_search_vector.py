@@ -0,0 +1,63 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:02
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+# a copy of the search fields at the time of this migration
+COURSE_SEARCH_FIELDS = ['topics', 'title', 'caption', 'provider']
+STUDY_GROUP_SEARCH_FIELDS = [
+    'city',
+    'name',
+    'course__title',
+    'course__provider',
+    'course__topics',
+    'venue_name',
+    'venue_address',
+    'venue_details',
+    'facilitator__first_name',
+    'facilitator__last_name',
+]
+
+
+def set_search_vectors(apps, schema_editor):
+    Course = apps.get_model('studygroups', 'Course')
+    StudyGroup = apps.get_model('studygroups', 'StudyGroup')
+    Course.objects.update(search_vector=SearchVector(*COURSE_SEARCH_FIELDS, config='simple'))
+    # joined fields can't be used in an update, so compute the vector in a subquery
+    vector = StudyGroup.objects.filter(pk=OuterRef('pk')).annotate(
+        search=SearchVector(*STUDY_GROUP_SEARCH_FIELDS, config='simple')
+    ).values('search')[:1]
+    StudyGroup.objects.update(search_vector=Subquery(vector))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0134_auto_20200723_0430'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='studygroup',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='studygroups_search__471361_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='studygroup',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='studygroups_search__163425_gin'),
+        ),
+        migrations.RunPython(set_search_vectors, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0135_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studygroup',
+            index=models.Index(fields=['latitude', 'longitude'], name='studygroups_latitud_4c6cf3_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_course_topics(apps, schema_editor):
+    Course = apps.get_model('studygroups', 'Course')
+    CourseTopic = apps.get_model('studygroups', 'CourseTopic')
+    course_topics = []
+    for course in Course.objects.exclude(topics=''):
+        topics = [topic.strip().lower() for topic in course.topics.split(',') if topic.strip()]
+        course_topics += [CourseTopic(course=course, topic=topic) for topic in topics]
+    CourseTopic.objects.bulk_create(course_topics)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0136_studygroup_location_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseTopic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(db_index=True, max_length=500)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='studygroups.Course')),
+            ],
+        ),
+        migrations.RunPython(create_course_topics, reverse_code=migrations.RunPython.noop),
+    ]
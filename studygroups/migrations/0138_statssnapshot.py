@@ -0,0 +1,22 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0137_coursetopic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=128, unique=True)),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+    ]
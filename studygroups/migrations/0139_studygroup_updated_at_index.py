@@ -0,0 +1,17 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0138_statssnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studygroup',
+            index=models.Index(fields=['updated_at'], name='studygroups_updated_a309d6_idx'),
+        ),
+    ]
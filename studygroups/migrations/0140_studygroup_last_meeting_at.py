@@ -0,0 +1,34 @@
+# Generated by Django 2.2.13 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+import datetime
+import pytz
+
+
+def set_last_meeting_at(apps, schema_editor):
+    StudyGroup = apps.get_model('studygroups', 'StudyGroup')
+    Meeting = apps.get_model('studygroups', 'Meeting')
+    last_meetings = Meeting.objects.filter(deleted_at__isnull=True).order_by(
+        'study_group_id', '-meeting_date', '-meeting_time'
+    ).distinct('study_group_id').select_related('study_group')
+    for meeting in last_meetings:
+        tz = pytz.timezone(meeting.study_group.timezone)
+        last_meeting_at = tz.localize(datetime.datetime.combine(meeting.meeting_date, meeting.meeting_time))
+        StudyGroup.objects.filter(pk=meeting.study_group_id).update(last_meeting_at=last_meeting_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0139_studygroup_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studygroup',
+            name='last_meeting_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(set_last_meeting_at, reverse_code=migrations.RunPython.noop),
+    ]
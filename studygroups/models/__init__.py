@@ -1,6 +1,6 @@
 # coding=utf-8
 from django.db import models
-from django.db.models import Count, Max, Q, Sum, Case, When, IntegerField, Value, OuterRef, Subquery
+from django.db.models import Count, Max, Min, Q, Sum, Case, When, IntegerField, Value, OuterRef, Subquery
 from django.db.models import F
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
@@ -13,9 +13,13 @@ from collections import Counter
 from .base import SoftDeleteQuerySet
 from .base import LifeTimeTrackingModel
 from .course import Course
+from .course import CourseTopic
 from .team import *
 from .announcement import Announcement
 from .profile import Profile
+from .snapshot import StatsSnapshot
+from .snapshot import get_snapshot
+from .outbox import OutboxMessage
 from .learningcircle import StudyGroup
 from .learningcircle import Meeting
 from .learningcircle import Application
@@ -376,3 +380,39 @@ def stats_dash_data(start_time, end_time, team=None):
         "unrated_studygroups": unrated_studygroups,
         "unpublished_studygroups": unpublished_studygroups,
     }
+
+
+def landing_page_stats():
+    """ Return stats for the landing page
+
+    - Number of active learning circles
+    - Number of cities where learning circle happened
+    - Number of facilitators who ran at least 1 learning circle
+    - Number of learning circles to date
+    """
+    study_groups = StudyGroup.objects.published().filter(
+        meeting__meeting_date__gte=timezone.now()
+    ).annotate(
+        next_meeting_date=Min('meeting__meeting_date')
+    )
+    cities = StudyGroup.objects.published().filter(
+        latitude__isnull=False,
+        longitude__isnull=False,
+    ).distinct('city').values('city')
+    learning_circle_count = StudyGroup.objects.published().count()
+    facilitators = StudyGroup.objects.active().distinct('facilitator').values('facilitator')
+    cities_s = list(set([c['city'].split(',')[0].strip() for c in cities]))
+    return {
+        "active_learning_circles": study_groups.count(),
+        "cities": len(cities_s),
+        "facilitators": facilitators.count(),
+        "learning_circle_count": learning_circle_count
+    }
+
+
+LANDING_PAGE_STATS_SNAPSHOT = 'landing_page_stats'
+
+
+def get_landing_page_stats(fresh=False):
+    """ Return landing page stats from the latest snapshot, along with the time the snapshot was taken """
+    return get_snapshot(LANDING_PAGE_STATS_SNAPSHOT, landing_page_stats, fresh=fresh)
@@ -1,4 +1,8 @@
 from django.db import models
+from django.core.cache import cache
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.contrib.postgres.search import SearchVectorField
 from django.db.models import Count, Max, Q, Sum, Case, When, IntegerField, Value
 from django.urls import reverse  # TODO ideally this shouldn't be in the model
 from django.utils import timezone
@@ -6,6 +10,7 @@ from django.contrib.auth.models import User
 from django.db.models import F
 from django.utils.translation import ugettext_lazy as _
 
+from .base import SoftDeleteQuerySet
 from .base import LifeTimeTrackingModel
 
 KNOWN_COURSE_PLATFORMS = {
@@ -35,6 +40,16 @@ def course_platform_from_url(url):
     return platform
 
 
+COURSE_SEARCH_FIELDS = ['topics', 'title', 'caption', 'provider']
+
+
+class CourseQuerySet(SoftDeleteQuerySet):
+
+    def update_search_vector(self):
+        """ update the stored full text search vector for courses in the queryset """
+        return self.update(search_vector=SearchVector(*COURSE_SEARCH_FIELDS, config='simple'))
+
+
 class Course(LifeTimeTrackingModel):
     OER_LICENSES = ['CC-BY', 'CC-BY-SA', 'CC-BY-NC', 'CC-BY-NC-SA', 'Public Domain']
 
@@ -55,6 +70,14 @@ class Course(LifeTimeTrackingModel):
     total_ratings = models.SmallIntegerField(default=0)
     rating_step_counts = models.TextField(default="{}") # JSON value
     discourse_topic_url = models.URLField(blank=True)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)  # maintained by signals
+
+    objects = CourseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         return self.title
@@ -87,3 +110,86 @@ class Course(LifeTimeTrackingModel):
 
     def discourse_topic_default_body(self):
         return _("<p>What recommendations do you have for other facilitators who are using \"{}\"? Consider sharing additional resources you found helpful, activities that worked particularly well, and some reflections on who this course is best suited for. For more information, see this course on <a href='https://learningcircles.p2pu.org{}'>P2PU’s course page</a>.</p>".format(self.title, reverse('studygroups_course_page', args=(self.id,))))
+
+
+class CourseTopic(models.Model):
+    """ Normalized topics for a course, maintained from Course.topics by update_course_topics """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    topic = models.CharField(max_length=500, db_index=True)
+
+    def __str__(self):
+        return self.topic
+
+
+def split_topics(topics):
+    return [topic.strip().lower() for topic in topics.split(',') if topic.strip()]
+
+
+def update_course_topics(course):
+    CourseTopic.objects.filter(course=course).delete()
+    CourseTopic.objects.bulk_create([
+        CourseTopic(course=course, topic=topic) for topic in split_topics(course.topics)
+    ])
+
+
+COURSE_TOPIC_COUNTS_CACHE_KEY = 'course_topic_counts'
+TOPIC_COUNTS_CACHE_TIMEOUT = 60*60
+
+
+def _learning_circle_topic_counts_cache_key(date):
+    # learning circles stop having upcoming meetings as the days pass without
+    # any model being saved, so the counts are cached per day
+    return 'learning_circle_topic_counts:{}'.format(date.isoformat())
+
+
+def _count_topics(courses):
+    return dict(
+        CourseTopic.objects.filter(course__in=courses)
+        .values_list('topic')
+        .annotate(Count('id'))
+        .order_by()
+    )
+
+
+def get_course_topic_counts():
+    """ return a dict with the number of listed courses using every topic
+
+    The result is cached until invalidate_topic_counts is called or the cache
+    times out.
+    """
+    topics = cache.get(COURSE_TOPIC_COUNTS_CACHE_KEY)
+    if topics is None:
+        topics = _count_topics(Course.objects.active().filter(unlisted=False))
+        cache.set(COURSE_TOPIC_COUNTS_CACHE_KEY, topics, TOPIC_COUNTS_CACHE_TIMEOUT)
+    return topics
+
+
+def get_learning_circle_topic_counts():
+    """ return a dict with the number of listed courses using every topic,
+    counting only courses used by published learning circles with upcoming
+    meetings
+
+    The result is cached for the current day until invalidate_topic_counts
+    is called or the cache times out.
+    """
+    today = timezone.now().date()
+    cache_key = _learning_circle_topic_counts_cache_key(today)
+    topics = cache.get(cache_key)
+    if topics is None:
+        courses = Course.objects.active().filter(
+            unlisted=False,
+            studygroup__deleted_at__isnull=True,
+            studygroup__draft=False,
+            studygroup__meeting__deleted_at__isnull=True,
+            studygroup__meeting__meeting_date__gte=today,
+        )
+        topics = _count_topics(courses)
+        cache.set(cache_key, topics, TOPIC_COUNTS_CACHE_TIMEOUT)
+    return topics
+
+
+def invalidate_topic_counts():
+    cache.delete_many([
+        COURSE_TOPIC_COUNTS_CACHE_KEY,
+        _learning_circle_topic_counts_cache_key(timezone.now().date()),
+    ])
@@ -1,5 +1,9 @@
 # coding=utf-8
 from django.db import models
+from django.db.models import OuterRef, Subquery
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.utils.text import slugify
@@ -31,12 +35,34 @@ class Organizer(models.Model):
         return self.user.__str__()
 
 
+STUDY_GROUP_SEARCH_FIELDS = [
+    'city',
+    'name',
+    'course__title',
+    'course__provider',
+    'course__topics',
+    'venue_name',
+    'venue_address',
+    'venue_details',
+    'facilitator__first_name',
+    'facilitator__last_name',
+]
+
+
 class StudyGroupQuerySet(SoftDeleteQuerySet):
 
     def published(self):
         """ exclude drafts from public learning circles """
         return self.active().filter(draft=False)
 
+    def update_search_vector(self):
+        """ update the stored full text search vector for learning circles in the queryset """
+        # joined fields can't be used in an update, so compute the vector in a subquery
+        vector = self.model.objects.filter(pk=OuterRef('pk')).annotate(
+            search=SearchVector(*STUDY_GROUP_SEARCH_FIELDS, config='simple')
+        ).values('search')[:1]
+        return self.update(search_vector=Subquery(vector))
+
 
 class StudyGroup(LifeTimeTrackingModel):
     name = models.CharField(max_length=128, blank=True)
@@ -72,9 +98,18 @@ class StudyGroup(LifeTimeTrackingModel):
     facilitator_goal_rating = models.IntegerField(blank=True, null=True)  # Self reported rating of whether the facilitator goal was met.
     attach_ics = models.BooleanField(default=True)
     did_not_happen = models.NullBooleanField(blank=True, null=True)  # Used by the facilitator to report if the learning circle didn't happen
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)  # maintained by signals
+    last_meeting_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)  # start of the last active meeting, maintained by signals
 
     objects = StudyGroupQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['updated_at']),
+        ]
+
     def save(self, *args, **kwargs):
         # use course.caption if course_description is not set
         if self.course_description is None:
@@ -108,6 +143,14 @@ class StudyGroup(LifeTimeTrackingModel):
     def last_meeting(self):
         return self.meeting_set.active().order_by('-meeting_date', '-meeting_time').first()
 
+    def update_last_meeting_at(self):
+        """ store the start of the last active meeting in last_meeting_at """
+        last_meeting = self.last_meeting()
+        if last_meeting:
+            last_meeting.study_group = self
+        self.last_meeting_at = last_meeting.meeting_datetime() if last_meeting else None
+        StudyGroup.objects.filter(pk=self.pk).update(last_meeting_at=self.last_meeting_at)
+
     def first_meeting(self):
         return self.meeting_set.active().order_by('meeting_date', 'meeting_time').first()
 
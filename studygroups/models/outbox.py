@@ -0,0 +1,176 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import models
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from email.mime.text import MIMEText
+
+from studygroups.email_helper import send_messages
+
+import datetime
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+# maximum number of workers sending a backlog at the same time
+OUTBOX_WORKERS = 4
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = datetime.timedelta(minutes=5)
+# messages claimed by a worker that stopped before sending them are claimed again after this
+OUTBOX_CLAIM_TIMEOUT = datetime.timedelta(minutes=15)
+# sent messages are deleted after this, their dedupe keys only apply until then
+OUTBOX_RETENTION = datetime.timedelta(days=30)
+
+
+class OutboxMessage(models.Model):
+    """ An email waiting to be sent, or the record of having sent it """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    dedupe_key = models.CharField(max_length=512, unique=True)
+    subject = models.TextField()
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=256)
+    recipients = models.TextField()  # JSON value with to, cc, bcc and reply_to lists
+    attachments = models.TextField(default='[]')  # JSON list of [filename, content, mimetype]
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after']),
+        ]
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.dedupe_key, self.status)
+
+    def to_email(self):
+        recipients = json.loads(self.recipients)
+        email = EmailMultiAlternatives(
+            self.subject,
+            self.body,
+            self.from_email,
+            recipients['to'],
+            cc=recipients['cc'],
+            bcc=recipients['bcc'],
+            reply_to=recipients['reply_to'],
+        )
+        if self.html_body:
+            email.attach_alternative(self.html_body, 'text/html')
+        for filename, content, mimetype in json.loads(self.attachments):
+            part = MIMEText(content, mimetype.split('/')[1])
+            part.add_header('Content-Disposition', 'attachment', filename=filename)
+            email.attach(part)
+        return email
+
+
+def queue_email(dedupe_key, email):
+    """ add an EmailMultiAlternatives to the outbox
+
+    Only the first message queued with a dedupe_key is stored, None is
+    returned if a message with the same dedupe_key was already queued.
+    Attachments must be given as (filename, content, mimetype).
+    """
+    html_body = next((content for content, mimetype in getattr(email, 'alternatives', []) if mimetype == 'text/html'), '')
+    message, created = OutboxMessage.objects.get_or_create(dedupe_key=dedupe_key, defaults={
+        'subject': email.subject,
+        'body': email.body,
+        'html_body': html_body,
+        'from_email': email.from_email,
+        'recipients': json.dumps({
+            'to': email.to,
+            'cc': email.cc,
+            'bcc': email.bcc,
+            'reply_to': email.reply_to,
+        }),
+        'attachments': json.dumps([list(attachment) for attachment in email.attachments]),
+    })
+    return message if created else None
+
+
+def _claim_messages(queryset, batch_size):
+    """ mark up to batch_size due messages as being sent by this worker, other
+    workers skip the rows while they are claimed """
+    now = timezone.now()
+    due = Q(status=OutboxMessage.PENDING, send_after__lte=now)
+    abandoned = Q(status=OutboxMessage.SENDING, claimed_at__lt=now - OUTBOX_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        ids = list(
+            queryset.filter(due | abandoned).select_for_update(skip_locked=True).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        OutboxMessage.objects.filter(id__in=ids).update(status=OutboxMessage.SENDING, claimed_at=now)
+    return OutboxMessage.objects.filter(id__in=ids).order_by('id')
+
+
+def deliver_outbox(messages=None, batch_size=OUTBOX_BATCH_SIZE):
+    """ send due messages from the outbox and return the number sent
+
+    If messages is given, only those messages are sent. All messages are
+    sent over one connection to the mail server. Failed messages are
+    retried with an increasing delay until OUTBOX_MAX_ATTEMPTS is reached.
+
+    Delivery is at least once: if a worker stops after the mail server
+    accepted a message but before it is marked as sent, the message is sent
+    again once the claim times out.
+    """
+    queryset = OutboxMessage.objects.all()
+    if messages is not None:
+        queryset = queryset.filter(pk__in=[message.pk for message in messages if message])
+    rate_limit = getattr(settings, 'OUTBOX_RATE_LIMIT', 0)
+
+    messages = list(_claim_messages(queryset, batch_size))
+    errors = send_messages([message.to_email() for message in messages], rate_limit=rate_limit)
+
+    sent = 0
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        if error:
+            message.last_error = str(error)
+            if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.exception('Could not send outbox message %s', message.dedupe_key, exc_info=error)
+                message.status = OutboxMessage.FAILED
+            else:
+                logger.warning('Could not send outbox message %s, will retry: %s', message.dedupe_key, error)
+                message.status = OutboxMessage.PENDING
+                message.send_after = timezone.now() + OUTBOX_RETRY_DELAY * 2**(message.attempts - 1)
+        else:
+            message.status = OutboxMessage.SENT
+            message.sent_at = timezone.now()
+            sent += 1
+        message.save(update_fields=['attempts', 'last_error', 'status', 'send_after', 'sent_at'])
+    return sent
+
+
+def send_queued(messages):
+    """ send messages that were just queued, unless there are too many to send
+    right away, then they are left for the outbox workers """
+    messages = [message for message in messages if message]
+    if len(messages) <= OUTBOX_BATCH_SIZE:
+        deliver_outbox(messages, batch_size=len(messages))
+
+
+def purge_outbox(retention=OUTBOX_RETENTION):
+    """ delete messages sent longer than retention ago and return the number deleted """
+    deleted, _ = OutboxMessage.objects.filter(
+        status=OutboxMessage.SENT, sent_at__lt=timezone.now() - retention
+    ).delete()
+    return deleted
@@ -0,0 +1,35 @@
+from django.db import models
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+
+import json
+
+
+class StatsSnapshot(models.Model):
+    """ Precomputed stats, stored to avoid running expensive queries on every request """
+    key = models.CharField(max_length=128, unique=True)
+    data = models.TextField()  # JSON value
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return '{0} at {1}'.format(self.key, self.created_at)
+
+
+def update_snapshot(key, generate):
+    """ store the result of calling generate() as the snapshot for key """
+    snapshot, created = StatsSnapshot.objects.update_or_create(key=key, defaults={
+        'data': json.dumps(generate(), cls=DjangoJSONEncoder),
+        'created_at': timezone.now(),
+    })
+    return snapshot
+
+
+def get_snapshot(key, generate, fresh=False):
+    """ return the data and creation time of the snapshot for key
+
+    A new snapshot is created when none exist or when fresh is True.
+    """
+    snapshot = None if fresh else StatsSnapshot.objects.filter(key=key).first()
+    if snapshot is None:
+        snapshot = update_snapshot(key, generate)
+    return json.loads(snapshot.data), snapshot.created_at
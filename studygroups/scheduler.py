@@ -0,0 +1,29 @@
+from django.utils import timezone
+
+from studygroups.models import StudyGroup
+
+import datetime
+
+
+# time relative to the start of the last meeting when messages are sent
+LEARNER_SURVEY_OFFSET = datetime.timedelta(hours=-1)
+FACILITATOR_SURVEY_OFFSET = datetime.timedelta(hours=-1)
+FACILITATOR_LEARNER_SURVEY_PROMPT_OFFSET = datetime.timedelta(days=2)
+FINAL_REPORT_OFFSET = datetime.timedelta(days=7)
+
+
+def current_window(now=None):
+    """ return the start and end of the current hour """
+    now = now or timezone.now()
+    start_of_window = now.replace(minute=0, second=0, microsecond=0)
+    return start_of_window, start_of_window + datetime.timedelta(hours=1)
+
+
+def study_groups_due(offset, now=None):
+    """ return published learning circles where the start of the last meeting
+    plus offset falls in the current hour """
+    start_of_window, end_of_window = current_window(now)
+    return StudyGroup.objects.published().filter(
+        last_meeting_at__gte=start_of_window - offset,
+        last_meeting_at__lt=end_of_window - offset,
+    )
@@ -1,98 +1,189 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from studygroups.utils import render_to_string_ctx
-from django.core.mail import EmailMultiAlternatives, send_mail
 from django.conf import settings
-from django.utils import timezone
-
-from studygroups.email_helper import render_html_with_css
+from django.contrib.auth.models import User
+from django.db import transaction
 
 from .models import Application
 from .models import StudyGroup
 from .models import Course
-from .models import get_study_group_organizers
+from .models import Meeting
+from .models import Feedback
+from .models import TeamMembership
+from .models.course import update_course_topics
+from .models.course import invalidate_topic_counts
+
+from .tasks import send_new_application_email
+from .tasks import send_new_study_group_email
+from .tasks import refresh_landing_page_stats
+
+from api.cache import invalidate_model_version
+
+from surveys.models import LearnerSurveyResponse
+from surveys.models import FacilitatorSurveyResponse
+from surveys.models import LearnerSurveySummary
+from surveys.models import FacilitatorSurveySummary
+from surveys.community_feedback import add_course_ratings
+from surveys.community_feedback import save_survey_summaries_and_ratings
+
+from collections import Counter
+
 
-from .utils import html_body_to_text
-from .utils import use_language
+def _send_after_commit(task, pk):
+    """ run the task in Celery once the object is saved, or right away when
+    SIGNAL_EMAILS_SYNC is set """
+    if getattr(settings, 'SIGNAL_EMAILS_SYNC', False):
+        task(pk)
+    else:
+        transaction.on_commit(lambda: task.delay(pk))
 
-from advice.models import Advice
 
-import pytz
+# fields of a learning circle that post_save receivers compare with the saved values
+TRACKED_STUDY_GROUP_FIELDS = ['draft', 'deleted_at', 'course_id']
+
+
+@receiver(pre_save, sender=StudyGroup)
+def track_study_group_changes(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ keep the saved values of TRACKED_STUDY_GROUP_FIELDS in instance._saved_values,
+    None for new learning circles """
+    if not instance.pk or raw:
+        instance._saved_values = None
+    elif update_fields and not set(TRACKED_STUDY_GROUP_FIELDS) & {sender._meta.get_field(field).attname for field in update_fields}:
+        # none of the fields can change
+        instance._saved_values = {field: getattr(instance, field) for field in TRACKED_STUDY_GROUP_FIELDS}
+    else:
+        instance._saved_values = StudyGroup.objects.filter(pk=instance.pk).values(*TRACKED_STUDY_GROUP_FIELDS).first()
+
+
+def _study_group_changed(instance, fields):
+    saved_values = getattr(instance, '_saved_values', None)
+    if saved_values is None:
+        return True
+    return any(saved_values[field] != getattr(instance, field) for field in fields)
+
 
 @receiver(post_save, sender=Application)
 def handle_new_application(sender, instance, created, **kwargs):
     """ Send welcome message to learner introducing them to their facilitator """
     if not created:
         return
-
-    application = instance
-
-    # get a random piece of advice
-    # TODO only supported in English atm
-    advice = None
-    if application.study_group.language == 'en':
-        advice = Advice.objects.order_by('?').first()
-
-    # activate language and timezone for message reminder
-    with use_language(application.study_group.language), timezone.override(pytz.timezone(application.study_group.timezone)):
-        # Send welcome message to learner
-        learner_signup_subject = render_to_string_ctx(
-            'studygroups/email/learner_signup-subject.txt', {
-                'application': application,
-                'advice': advice,
-            }
-        ).strip('\n')
-
-        learner_signup_html = render_html_with_css(
-            'studygroups/email/learner_signup.html', {
-                'application': application,
-                'advice': advice,
-            }
-        )
-        learner_signup_body = html_body_to_text(learner_signup_html)
-
-    to = [application.email]
-    # CC facilitator and put in reply-to
-    welcome_message = EmailMultiAlternatives(
-        learner_signup_subject,
-        learner_signup_body,
-        settings.DEFAULT_FROM_EMAIL,
-        to,
-        cc=[application.study_group.facilitator.email],
-        reply_to=[application.study_group.facilitator.email]
-    )
-    welcome_message.attach_alternative(learner_signup_html, 'text/html')
-    welcome_message.send()
+    _send_after_commit(send_new_application_email, instance.pk)
 
 
 @receiver(post_save, sender=StudyGroup)
 def handle_new_study_group_creation(sender, instance, created, **kwargs):
     if not created:
         return
+    _send_after_commit(send_new_study_group_email, instance.pk)
 
-    study_group = instance
-    context = {
-        'study_group': study_group,
-    }
-    subject = render_to_string_ctx('studygroups/email/learning_circle_created-subject.txt', context).strip(' \n')
-    html_body = render_html_with_css('studygroups/email/learning_circle_created.html', context)
-    text_body = html_body_to_text(html_body)
-
-    # on all learning circles, CC p2pu
-    cc = [settings.TEAM_EMAIL]
-    # if the user is part of a team, send to the organizer(s)
-    cc += [ o.email for o in get_study_group_organizers(study_group)]
-    # if there is a question, send to the welcoming comitte
-    if study_group.facilitator_concerns:
-        cc += [settings.COMMUNITY_MANAGER]
-
-    notification = EmailMultiAlternatives(
-        subject,
-        text_body,
-        settings.DEFAULT_FROM_EMAIL,
-        [study_group.facilitator.email],
-        cc=cc,
-        reply_to=[study_group.facilitator.email] + cc
-    )
-    notification.attach_alternative(html_body, 'text/html')
-    notification.send()
+
+@receiver(post_save, sender=StudyGroup)
+def update_study_group_search_vector(sender, instance, **kwargs):
+    StudyGroup.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Course)
+def update_course_search_vector(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.pk).update_search_vector()
+    StudyGroup.objects.filter(course=instance).update_search_vector()
+
+
+@receiver(post_save, sender=User)
+def update_facilitator_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    StudyGroup.objects.filter(facilitator=instance).update_search_vector()
+
+
+@receiver(post_save, sender=LearnerSurveyResponse)
+@receiver(post_save, sender=FacilitatorSurveyResponse)
+def handle_survey_response_summary_update(sender, instance, **kwargs):
+    save_survey_summaries_and_ratings([instance])
+
+
+@receiver(post_save, sender=StudyGroup)
+def handle_survey_summary_course_update(sender, instance, created, raw=False, **kwargs):
+    # survey summaries store the course of the learning circle
+    if created or raw or not _study_group_changed(instance, ['course_id']):
+        return
+    rating_changes = Counter()
+    for model in [LearnerSurveySummary, FacilitatorSurveySummary]:
+        summaries = list(model.objects.filter(study_group=instance).exclude(course=instance.course_id).values_list('id', 'course_id', 'course_rating'))
+        if not summaries:
+            continue
+        model.objects.filter(id__in=[id_ for id_, course_id, rating in summaries]).update(course=instance.course_id)
+        rating_changes.subtract((course_id, rating) for id_, course_id, rating in summaries)
+        rating_changes.update((instance.course_id, rating) for id_, course_id, rating in summaries)
+    add_course_ratings(rating_changes)
+
+
+@receiver(post_save, sender=Course)
+def handle_course_topics_update(sender, instance, **kwargs):
+    update_course_topics(instance)
+    invalidate_topic_counts()
+
+
+@receiver(post_save, sender=StudyGroup)
+@receiver(post_save, sender=Meeting)
+def handle_learning_circle_topics_update(sender, **kwargs):
+    # learning circle topics depend on learning circles with upcoming meetings
+    invalidate_topic_counts()
+
+
+@receiver(post_save, sender=StudyGroup)
+def handle_landing_page_stats_update(sender, instance, created, raw=False, **kwargs):
+    # the home page counts published learning circles, refresh the snapshot
+    # when a learning circle is published, unpublished or deleted
+    if raw:
+        return
+    if created and (instance.draft or instance.deleted_at):
+        return
+    if _study_group_changed(instance, ['draft', 'deleted_at']):
+        transaction.on_commit(lambda: refresh_landing_page_stats.delay())
+
+
+@receiver(post_delete, sender=StudyGroup)
+def handle_landing_page_stats_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_landing_page_stats.delay())
+
+
+@receiver(post_save, sender=StudyGroup)
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Meeting)
+@receiver(post_save, sender=Application)
+@receiver(post_save, sender=Feedback)
+@receiver(post_save, sender=TeamMembership)
+@receiver(post_delete, sender=StudyGroup)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Meeting)
+@receiver(post_delete, sender=Application)
+@receiver(post_delete, sender=Feedback)
+@receiver(post_delete, sender=TeamMembership)
+@receiver(post_delete, sender=LearnerSurveyResponse)
+@receiver(post_delete, sender=FacilitatorSurveyResponse)
+def handle_api_cache_update(sender, instance, **kwargs):
+    # changes the ETag of cached API responses and the key of cached charts that depend on sender
+    invalidate_model_version(sender)
+
+
+@receiver(post_save, sender=User)
+def handle_facilitator_api_cache_update(sender, instance, update_fields=None, **kwargs):
+    # the names of facilitators are included in the learning circle API
+    if update_fields and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    invalidate_model_version(sender)
+
+
+@receiver(post_save, sender=Meeting)
+@receiver(post_delete, sender=Meeting)
+def handle_meeting_last_meeting_at_update(sender, instance, **kwargs):
+    study_group = StudyGroup.objects.filter(pk=instance.study_group_id).first()
+    if study_group:
+        study_group.update_last_meeting_at()
+
+
+@receiver(post_save, sender=StudyGroup)
+def handle_study_group_last_meeting_at_update(sender, instance, raw=False, **kwargs):
+    # the time zone of the learning circle could have changed
+    if not raw:
+        instance.update_last_meeting_at()
@@ -1,13 +1,78 @@
 from django.conf import settings
 
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+TWILIO_API_URL = 'https://api.twilio.com'
+# maximum number of messages sent at the same time by send_bulk_message
+SMS_WORKERS = 4
+
+_local = threading.local()
+_rate_limit_lock = threading.Lock()
+_next_send_time = {}
+
+
+class _HttpClient(TwilioHttpClient):
+    """ keeps the HTTP connection to the API open between messages and sends
+    requests to settings.TWILIO_API_URL, which can point at a local server """
+
+    def request(self, method, url, *args, **kwargs):
+        api_url = getattr(settings, 'TWILIO_API_URL', TWILIO_API_URL)
+        if url.startswith(TWILIO_API_URL) and api_url != TWILIO_API_URL:
+            url = api_url.rstrip('/') + url[len(TWILIO_API_URL):]
+        return super().request(method, url, *args, **kwargs)
+
+
+def get_client():
+    """ return the Twilio client for the current thread, the client is
+    reused for all messages sent by the thread """
+    credentials = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+    if getattr(_local, 'credentials', None) != credentials:
+        _local.client = Client(*credentials, http_client=_HttpClient())
+        _local.credentials = credentials
+    return _local.client
+
+
+def _wait_for_rate_limit(from_):
+    """ wait until another message can be sent from the number from_ """
+    rate_limit = getattr(settings, 'TWILIO_RATE_LIMIT', 0)
+    if not rate_limit:
+        return
+    with _rate_limit_lock:
+        now = time.monotonic()
+        send_time = max(now, _next_send_time.get(from_, now))
+        _next_send_time[from_] = send_time + 1.0/rate_limit
+    time.sleep(send_time - now)
+
 
 def send_message(to, body):
-    client = Client(
-        settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN 
-    )
-    message = client.messages.create(
+    _wait_for_rate_limit(settings.TWILIO_NUMBER)
+    message = get_client().messages.create(
         body=body,
         to=to,
         from_=settings.TWILIO_NUMBER
     )
+    return message
+
+
+def send_bulk_message(tos, body):
+    """ send body to every number in tos using up to SMS_WORKERS threads
+
+    Returns a dict with None for every number the message was sent to and
+    the exception for every number it couldn't be sent to.
+    """
+    def send(to):
+        try:
+            send_message(to, body)
+        except Exception as e:
+            return e
+        return None
+
+    tos = list(dict.fromkeys(tos))
+    with ThreadPoolExecutor(max_workers=SMS_WORKERS) as executor:
+        return dict(zip(tos, executor.map(send, tos)))
@@ -1,6 +1,4 @@
 from celery import shared_task
-from twilio.base.exceptions import TwilioRestException
-from email.mime.text import MIMEText
 
 from django.conf import settings
 from django.utils import timezone
@@ -9,21 +7,38 @@ from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 from django.core.mail import EmailMultiAlternatives
 from django.urls import reverse
+from django.db.models import Exists, OuterRef
 
 from studygroups.models import StudyGroup, Meeting, Reminder, Team, TeamMembership
+from studygroups.models import Application
+from studygroups.models.outbox import queue_email
+from studygroups.models.outbox import send_queued
+from studygroups.models.outbox import deliver_outbox
+from studygroups.models.outbox import purge_outbox
+from studygroups.models.outbox import OutboxMessage
+from studygroups.models.outbox import OUTBOX_BATCH_SIZE
+from studygroups.models.outbox import OUTBOX_WORKERS
 from studygroups.models import report_data
 from studygroups.models import community_digest_data
 from studygroups.models import get_study_group_organizers
 from studygroups.models import get_json_response
+from studygroups.models import landing_page_stats
+from studygroups.models import LANDING_PAGE_STATS_SNAPSHOT
+from studygroups.models.snapshot import update_snapshot
 from studygroups import charts
-from studygroups.sms import send_message
+from studygroups import scheduler
+from studygroups.sms import send_bulk_message
 from studygroups.utils import render_to_string_ctx
 from studygroups.email_helper import render_email_templates
 from studygroups.email_helper import render_html_with_css
+from studygroups.email_helper import prerender_email_templates
+from studygroups.email_helper import send_messages
 from .utils import html_body_to_text
 from .utils import use_language
 from .ics import make_meeting_ics
 
+from advice.models import Advice
+
 import datetime
 import logging
 import pytz
@@ -33,6 +48,69 @@ import os
 logger = logging.getLogger(__name__)
 
 
+def _render_reminder(study_group, next_meeting):
+    """ create a reminder for next_meeting, the reminder isn't saved """
+    reminder = Reminder()
+    reminder.study_group = study_group
+    reminder.study_group_meeting = next_meeting
+    context = {
+        'facilitator': study_group.facilitator,
+        'study_group': study_group,
+        'next_meeting': next_meeting,
+        'reminder': reminder,
+    }
+    previous_meeting = study_group.meeting_set.filter(meeting_date__lt=next_meeting.meeting_date).order_by('meeting_date').last()
+    if previous_meeting and previous_meeting.feedback_set.first():
+        context['feedback'] = previous_meeting.feedback_set.first()
+    timezone.activate(pytz.timezone(study_group.timezone))
+    with use_language(study_group.language):
+        reminder.email_subject = render_to_string_ctx(
+            'studygroups/email/reminder-subject.txt',
+            context
+        ).strip('\n')
+        reminder.email_body = render_to_string_ctx(
+            'studygroups/email/reminder.txt',
+            context
+        )
+        reminder.sms_body = render_to_string_ctx(
+            'studygroups/email/sms.txt',
+            context
+        )
+    timezone.deactivate()
+    # TODO - handle SMS reminders that are too long
+    if len(reminder.sms_body) > 160:
+        logger.error('SMS body too long: ' + reminder.sms_body)
+    reminder.sms_body = reminder.sms_body[:160]
+    return reminder, context
+
+
+def _reminder_notification(reminder, context):
+    """ render the email letting the facilitator know that a reminder was generated """
+    study_group = reminder.study_group
+    timezone.activate(pytz.timezone(study_group.timezone))
+    with use_language(reminder.study_group.language):
+        facilitator_notification_subject = _('A reminder for %(studygroup_name)s was generated' % {"studygroup_name": study_group.name})
+        facilitator_notification_html = render_html_with_css(
+            'studygroups/email/reminder_notification.html',
+            context
+        )
+        facilitator_notification_txt = render_to_string_ctx(
+            'studygroups/email/reminder_notification.txt',
+            context
+        )
+
+    timezone.deactivate()
+    to = [study_group.facilitator.email]
+    notification = EmailMultiAlternatives(
+        facilitator_notification_subject,
+        facilitator_notification_txt,
+        settings.DEFAULT_FROM_EMAIL,
+        to
+    )
+    notification.attach_alternative(facilitator_notification_html, 'text/html')
+    return notification
+
+
 def generate_reminder(study_group):
     now = timezone.now()
     next_meeting = study_group.next_meeting()
@@ -40,59 +118,54 @@ def generate_reminder(study_group):
     if next_meeting and next_meeting.meeting_datetime() - now < datetime.timedelta(days=4):
         # check if a notifcation already exists for this meeting
         if not Reminder.objects.filter(study_group=study_group, study_group_meeting=next_meeting).exists():
-            reminder = Reminder()
-            reminder.study_group = study_group
-            reminder.study_group_meeting = next_meeting
-            context = {
-                'facilitator': study_group.facilitator,
-                'study_group': study_group,
-                'next_meeting': next_meeting,
-                'reminder': reminder,
-            }
-            previous_meeting = study_group.meeting_set.filter(meeting_date__lt=next_meeting.meeting_date).order_by('meeting_date').last()
-            if previous_meeting and previous_meeting.feedback_set.first():
-                context['feedback'] = previous_meeting.feedback_set.first()
-            timezone.activate(pytz.timezone(study_group.timezone))
-            with use_language(study_group.language):
-                reminder.email_subject = render_to_string_ctx(
-                    'studygroups/email/reminder-subject.txt',
-                    context
-                ).strip('\n')
-                reminder.email_body = render_to_string_ctx(
-                    'studygroups/email/reminder.txt',
-                    context
-                )
-                reminder.sms_body = render_to_string_ctx(
-                    'studygroups/email/sms.txt',
-                    context
-                )
-            # TODO - handle SMS reminders that are too long
-            if len(reminder.sms_body) > 160:
-                logger.error('SMS body too long: ' + reminder.sms_body)
-            reminder.sms_body = reminder.sms_body[:160]
+            reminder, context = _render_reminder(study_group, next_meeting)
             reminder.save()
-
-            with use_language(reminder.study_group.language):
-                facilitator_notification_subject = _('A reminder for %(studygroup_name)s was generated' % {"studygroup_name": study_group.name})
-                facilitator_notification_html = render_html_with_css(
-                    'studygroups/email/reminder_notification.html',
-                    context
-                )
-                facilitator_notification_txt = render_to_string_ctx(
-                    'studygroups/email/reminder_notification.txt',
-                    context
-                )
-
-            timezone.deactivate()
-            to = [study_group.facilitator.email]
-            notification = EmailMultiAlternatives(
-                facilitator_notification_subject,
-                facilitator_notification_txt,
-                settings.DEFAULT_FROM_EMAIL,
-                to
-            )
-            notification.attach_alternative(facilitator_notification_html, 'text/html')
-            notification.send()
+            _reminder_notification(reminder, context).send()
+
+
+def get_meetings_needing_reminders(now=None):
+    """ return the next meeting for every published learning circle if it is
+    less than 4 days away and doesn't have a reminder yet """
+    now = now or timezone.now()
+    # meeting dates are local to the learning circle, allow a day either side for the time zone
+    today = now.date()
+    meetings = Meeting.objects.active().filter(
+        study_group__deleted_at__isnull=True,
+        study_group__draft=False,
+        meeting_date__gte=today - datetime.timedelta(days=1),
+        meeting_date__lte=today + datetime.timedelta(days=5),
+    ).annotate(
+        has_reminder=Exists(Reminder.objects.filter(study_group_meeting=OuterRef('pk')))
+    ).select_related(
+        'study_group', 'study_group__facilitator'
+    ).order_by('study_group_id', 'meeting_date', 'meeting_time')
+
+    next_meetings = {}
+    for meeting in meetings:
+        if meeting.study_group_id not in next_meetings and meeting.meeting_datetime() > now:
+            next_meetings[meeting.study_group_id] = meeting
+
+    # a reminder is only generated for the next meeting, even if a later
+    # meeting in the window doesn't have a reminder yet
+    return [
+        meeting for meeting in next_meetings.values()
+        if not meeting.has_reminder and meeting.meeting_datetime() - now < datetime.timedelta(days=4)
+    ]
+
+
+def generate_reminders():
+    """ generate reminders for all learning circles that meet in the next 4 days """
+    translation.activate(settings.LANGUAGE_CODE)
+    rendered = [ _render_reminder(meeting.study_group, meeting) for meeting in get_meetings_needing_reminders() ]
+    Reminder.objects.bulk_create([reminder for reminder, context in rendered])
+    notifications = []
+    for reminder, context in rendered:
+        translation.activate(settings.LANGUAGE_CODE)
+        notifications.append(_reminder_notification(reminder, context))
+    errors = send_messages(notifications)
+    for (reminder, context), error in zip(rendered, errors):
+        if error:
+            logger.exception('Could not send reminder notification for %s', reminder.study_group.name, exc_info=error)
 
 
 def _send_facilitator_survey(study_group):
@@ -139,7 +212,7 @@ def send_facilitator_survey(study_group):
     now = timezone.now()
     start_of_window = now.replace(minute=0, second=0, microsecond=0)
     end_of_window = start_of_window + datetime.timedelta(hours=1)
-    time_to_send = last_meeting.meeting_datetime() - datetime.timedelta(hours=1)
+    time_to_send = last_meeting.meeting_datetime() + scheduler.FACILITATOR_SURVEY_OFFSET
 
     if start_of_window <= time_to_send and time_to_send < end_of_window:
         _send_facilitator_survey(study_group)
@@ -163,7 +236,7 @@ def send_facilitator_learner_survey_prompt(study_group):
 
     start_of_window = now.replace(minute=0, second=0, microsecond=0)
     end_of_window = start_of_window + datetime.timedelta(hours=1)
-    time_to_send = last_meeting.meeting_datetime() + datetime.timedelta(days=2)
+    time_to_send = last_meeting.meeting_datetime() + scheduler.FACILITATOR_LEARNER_SURVEY_PROMPT_OFFSET
 
     if start_of_window <= time_to_send and time_to_send < end_of_window:
         timezone.deactivate()
@@ -253,7 +326,7 @@ def _send_learning_circle_insights(study_group):
         reply_to=[study_group.facilitator.email]
     )
     notification.attach_alternative(html, 'text/html')
-    notification.send()
+    send_queued([queue_email('final-report-{}'.format(study_group.pk), notification)])
 
 
 # send learning circle report two days after last meeting
@@ -272,15 +345,16 @@ def send_final_learning_circle_report(study_group):
         logger.warning('Published learning circle does not have any associated meetings. StudyGroup.id={0}'.format(study_group.id))
         return
 
-    time_to_send = last_meeting.meeting_datetime() + datetime.timedelta(days=7)
+    time_to_send = last_meeting.meeting_datetime() + scheduler.FINAL_REPORT_OFFSET
 
     if start_of_window <= time_to_send and time_to_send < end_of_window:
         _send_learning_circle_insights(study_group)
 
 
 def send_learner_survey(application):
-    """ send email to learner with link to survey, if goal is specified, also ask if they
-    achieved their goal """
+    """ queue email to learner with link to survey, if goal is specified, also ask if they
+    achieved their goal. Returns the queued message, or None if the learner
+    was already sent the survey for this learning circle """
     learner_goal = application.get_signup_questions().get('goals', None)
     base_url = f'{settings.PROTOCOL}://{settings.DOMAIN}'
     path = reverse(
@@ -311,7 +385,8 @@ def send_learner_survey(application):
         reply_to=[facilitator_email]
     )
     notification.attach_alternative(html, 'text/html')
-    notification.send()
+    dedupe_key = 'learner-survey-{}-{}'.format(application.study_group_id, application.pk)
+    return queue_email(dedupe_key, notification)
 
 
 # send an hour before the last meeting
@@ -325,7 +400,7 @@ def send_learner_surveys(study_group):
     if not last_meeting:
         return
 
-    time_to_send = last_meeting.meeting_datetime() - datetime.timedelta(hours=1)
+    time_to_send = last_meeting.meeting_datetime() + scheduler.LEARNER_SURVEY_OFFSET
     start_of_window = timezone.now().replace(minute=0, second=0, microsecond=0)
     end_of_window = start_of_window + datetime.timedelta(hours=1)
 
@@ -333,35 +408,38 @@ def send_learner_surveys(study_group):
         applications = study_group.application_set.active().filter(accepted_at__isnull=False).exclude(email='')
         timezone.deactivate()
 
-        for application in applications:
-            send_learner_survey(application)
+        send_queued([send_learner_survey(application) for application in applications])
 
 
 def send_meeting_reminder(reminder):
     to = [su.email for su in reminder.study_group.application_set.active().filter(accepted_at__isnull=False).exclude(email='')]
     sender = 'P2PU <{0}>'.format(settings.DEFAULT_FROM_EMAIL)
+    messages = []
+
+    # render the email once and only substitute the links for every learner
+    with use_language(reminder.study_group.language):
+        context = {
+            "reminder": reminder,
+            "learning_circle": reminder.study_group,
+            "facilitator_message": reminder.email_body,
+            "event_meta": True,
+        }
+        render_for_learner = prerender_email_templates(
+            'studygroups/email/learner_meeting_reminder',
+            context,
+            ['rsvp_yes_link', 'rsvp_no_link', 'unsubscribe_link']
+        )
+    if reminder.study_group.attach_ics:
+        ical = make_meeting_ics(reminder.study_group_meeting)
 
     for email in to:
-        # activate correct language
-        with use_language(reminder.study_group.language):
-            yes_link = reminder.study_group_meeting.rsvp_yes_link(email)
-            no_link = reminder.study_group_meeting.rsvp_no_link(email)
-            application = reminder.study_group_meeting.study_group.application_set.active().filter(email__iexact=email).first()
-            unsubscribe_link = application.unapply_link()
-            context = {
-                "reminder": reminder,
-                "learning_circle": reminder.study_group,
-                "facilitator_message": reminder.email_body,
-                "rsvp_yes_link": yes_link,
-                "rsvp_no_link": no_link,
-                "unsubscribe_link": unsubscribe_link,
-                "event_meta": True,
-            }
-            subject, text_body, html_body = render_email_templates(
-                'studygroups/email/learner_meeting_reminder',
-                context
-            )
-            # TODO not using subject
+        application = reminder.study_group_meeting.study_group.application_set.active().filter(email__iexact=email).first()
+        subject, text_body, html_body = render_for_learner({
+            "rsvp_yes_link": reminder.study_group_meeting.rsvp_yes_link(email),
+            "rsvp_no_link": reminder.study_group_meeting.rsvp_no_link(email),
+            "unsubscribe_link": application.unapply_link(),
+        })
+        # TODO not using subject
         try:
             reminder_email = EmailMultiAlternatives(
                 reminder.email_subject.strip('\n'),
@@ -373,12 +451,8 @@ def send_meeting_reminder(reminder):
             reminder_email.attach_alternative(html_body, 'text/html')
             # attach icalendar event
             if reminder.study_group.attach_ics:
-                ical = make_meeting_ics(reminder.study_group_meeting)
-                part = MIMEText(ical, 'calendar')
-                part.add_header('Filename', 'shifts.ics')
-                part.add_header('Content-Disposition', 'attachment; filename=lc.ics')
-                reminder_email.attach(part)
-            reminder_email.send()
+                reminder_email.attach('lc.ics', ical, 'text/calendar')
+            messages += [queue_email('reminder-{}-{}'.format(reminder.pk, email.lower()), reminder_email)]
         except Exception as e:
             logger.exception('Could not send email to ', email, exc_info=e)
     # Send to organizer without RSVP & unsubscribe links
@@ -400,19 +474,16 @@ def send_meeting_reminder(reminder):
             [reminder.study_group.facilitator.email]
         )
         reminder_email.attach_alternative(html_body, 'text/html')
-        reminder_email.send()
+        messages += [queue_email('reminder-{}-facilitator'.format(reminder.pk), reminder_email)]
 
     except Exception as e:
         logger.exception('Could not send email to ', reminder.study_group.facilitator.email, exc_info=e)
+    send_queued(messages)
 
 
 # If called directly, be sure to activate language to use for constructing URLs
 # Failed text delivery won't case this function to fail, simply log an error
 def send_reminder(reminder):
-    # mark it as sent, we don't retry any failures
-    reminder.sent_at = timezone.now()
-    reminder.save()
-
     to = [su.email for su in reminder.study_group.application_set.active().filter(accepted_at__isnull=False).exclude(email='')]
     if reminder.study_group_meeting:
         send_meeting_reminder(reminder)
@@ -439,20 +510,23 @@ def send_reminder(reminder):
                 reply_to=[reminder.study_group.facilitator.email],
             )
             reminder_email.attach_alternative(html_body, 'text/html')
-            reminder_email.send()
+            send_queued([queue_email('reminder-{}'.format(reminder.pk), reminder_email)])
         except Exception as e:
             logger.exception('Could not send reminder to whole study group', exc_info=e)
 
+    # emails that couldn't be sent are retried from the outbox
+    reminder.sent_at = timezone.now()
+    reminder.save()
+
     # send SMS
     if reminder.sms_body != '':
         applications = reminder.study_group.application_set.active().filter(accepted_at__isnull=False).exclude(mobile='')
         applications = applications.filter(mobile_opt_out_at__isnull=True)
         tos = [su.mobile for su in applications]
-        for to in tos:
-            try:
-                send_message(to, reminder.sms_body)
-            except TwilioRestException as e:
-                logger.exception("Could not send text message to %s", to, exc_info=e)
+        results = send_bulk_message(tos, reminder.sms_body) if tos else {}
+        for to, error in results.items():
+            if error:
+                logger.exception("Could not send text message to %s", to, exc_info=error)
 
 
 @shared_task
@@ -486,11 +560,89 @@ def send_meeting_change_notification(old_meeting, new_meeting):
     applications = study_group.application_set.active().filter(accepted_at__isnull=False).exclude(mobile='')
     applications = applications.filter(mobile_opt_out_at__isnull=True)
     tos = [su.mobile for su in applications]
-    for to in tos:
-        try:
-            send_message(to, sms_body)
-        except TwilioRestException as e:
-            logger.exception("Could not send text message to %s", to, exc_info=e)
+    results = send_bulk_message(tos, sms_body) if tos else {}
+    for to, error in results.items():
+        if error:
+            logger.exception("Could not send text message to %s", to, exc_info=error)
+
+
+@shared_task
+def send_new_application_email(application_id):
+    """ Send welcome message to learner introducing them to their facilitator """
+    application = Application.objects.filter(pk=application_id).select_related('study_group__facilitator').first()
+    if application is None:
+        return
+
+    # get a random piece of advice
+    # TODO only supported in English atm
+    advice = None
+    if application.study_group.language == 'en':
+        advice = Advice.objects.order_by('?').first()
+
+    # activate language and timezone for message reminder
+    with use_language(application.study_group.language), timezone.override(pytz.timezone(application.study_group.timezone)):
+        # Send welcome message to learner
+        learner_signup_subject = render_to_string_ctx(
+            'studygroups/email/learner_signup-subject.txt', {
+                'application': application,
+                'advice': advice,
+            }
+        ).strip('\n')
+
+        learner_signup_html = render_html_with_css(
+            'studygroups/email/learner_signup.html', {
+                'application': application,
+                'advice': advice,
+            }
+        )
+        learner_signup_body = html_body_to_text(learner_signup_html)
+
+    to = [application.email]
+    # CC facilitator and put in reply-to
+    welcome_message = EmailMultiAlternatives(
+        learner_signup_subject,
+        learner_signup_body,
+        settings.DEFAULT_FROM_EMAIL,
+        to,
+        cc=[application.study_group.facilitator.email],
+        reply_to=[application.study_group.facilitator.email]
+    )
+    welcome_message.attach_alternative(learner_signup_html, 'text/html')
+    welcome_message.send()
+
+
+@shared_task
+def send_new_study_group_email(study_group_id):
+    """ Let the facilitator, P2PU and team organizers know about a new learning circle """
+    study_group = StudyGroup.objects.filter(pk=study_group_id).select_related('facilitator').first()
+    if study_group is None:
+        return
+
+    context = {
+        'study_group': study_group,
+    }
+    subject = render_to_string_ctx('studygroups/email/learning_circle_created-subject.txt', context).strip(' \n')
+    html_body = render_html_with_css('studygroups/email/learning_circle_created.html', context)
+    text_body = html_body_to_text(html_body)
+
+    # on all learning circles, CC p2pu
+    cc = [settings.TEAM_EMAIL]
+    # if the user is part of a team, send to the organizer(s)
+    cc += [ o.email for o in get_study_group_organizers(study_group)]
+    # if there is a question, send to the welcoming comitte
+    if study_group.facilitator_concerns:
+        cc += [settings.COMMUNITY_MANAGER]
+
+    notification = EmailMultiAlternatives(
+        subject,
+        text_body,
+        settings.DEFAULT_FROM_EMAIL,
+        [study_group.facilitator.email],
+        cc=cc,
+        reply_to=[study_group.facilitator.email] + cc
+    )
+    notification.attach_alternative(html_body, 'text/html')
+    notification.send()
 
 
 def send_team_invitation_email(team, email, organizer):
@@ -532,6 +684,7 @@ def send_weekly_update():
         'email': True,
     }
 
+    updates = []
     for team in Team.objects.all():
         report_context = report_data(start_time, end_time, team)
         # If there wasn't any activity during this period discard the update
@@ -554,7 +707,7 @@ def send_weekly_update():
             bcc=staff
         )
         update.attach_alternative(html_body, 'text/html')
-        update.send()
+        updates.append(update)
 
     # send weekly update to staff
     report_context = report_data(start_time, end_time)
@@ -573,7 +726,12 @@ def send_weekly_update():
         to
     )
     update.attach_alternative(html_body, 'text/html')
-    update.send()
+    updates.append(update)
+
+    errors = send_messages(updates)
+    for update, error in zip(updates, errors):
+        if error:
+            logger.exception('Could not send weekly update "%s"', update.subject, exc_info=error)
 
 
 @shared_task
@@ -618,9 +776,7 @@ def send_reminders():
 
 @shared_task
 def gen_reminders():
-    for study_group in StudyGroup.objects.published():
-        translation.activate(settings.LANGUAGE_CODE)
-        generate_reminder(study_group)
+    generate_reminders()
 
 
 @shared_task
@@ -631,28 +787,28 @@ def weekly_update():
 
 @shared_task
 def send_all_studygroup_survey_reminders():
-    for study_group in StudyGroup.objects.published():
+    for study_group in scheduler.study_groups_due(scheduler.LEARNER_SURVEY_OFFSET):
         translation.activate(settings.LANGUAGE_CODE)
         send_learner_surveys(study_group)
 
 
 @shared_task
 def send_all_facilitator_surveys():
-    for study_group in StudyGroup.objects.published():
+    for study_group in scheduler.study_groups_due(scheduler.FACILITATOR_SURVEY_OFFSET):
         translation.activate(settings.LANGUAGE_CODE)
         send_facilitator_survey(study_group)
 
 
 @shared_task
 def send_all_facilitator_survey_reminders():
-    for study_group in StudyGroup.objects.published():
+    for study_group in scheduler.study_groups_due(scheduler.FACILITATOR_LEARNER_SURVEY_PROMPT_OFFSET):
         translation.activate(settings.LANGUAGE_CODE)
         send_facilitator_learner_survey_prompt(study_group)
 
 
 @shared_task
 def send_all_learning_circle_reports():
-    for study_group in StudyGroup.objects.published():
+    for study_group in scheduler.study_groups_due(scheduler.FINAL_REPORT_OFFSET):
         translation.activate(settings.LANGUAGE_CODE)
         send_final_learning_circle_report(study_group)
 
@@ -685,3 +841,27 @@ def refresh_instagram_token():
     else:
         logger.error('Could not refresh Instagram token: {}'.format(response))
 
+
+@shared_task
+def refresh_landing_page_stats():
+    update_snapshot(LANDING_PAGE_STATS_SNAPSHOT, landing_page_stats)
+
+
+@shared_task
+def deliver_outbox_batch():
+    deliver_outbox()
+
+
+@shared_task
+def send_outbox():
+    """ Send pending emails from the outbox, large backlogs are shared with other workers """
+    pending = OutboxMessage.objects.filter(status=OutboxMessage.PENDING, send_after__lte=timezone.now()).count()
+    extra_batches = min(pending // OUTBOX_BATCH_SIZE, OUTBOX_WORKERS - 1)
+    for i in range(extra_batches):
+        deliver_outbox_batch.delay()
+    deliver_outbox()
+
+
+@shared_task
+def purge_sent_outbox_messages():
+    purge_outbox()
@@ -7,6 +7,7 @@ from studygroups.models import Announcement
 
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True)
 class TestAnnouncementsApi(TestCase):
 
     fixtures = ['test_announcements.json']
@@ -1,6 +1,7 @@
 # coding: utf-8
 from django.test import TestCase, override_settings
 from django.test import Client
+from django.core.cache import cache
 from django.core import mail
 from django.contrib.auth.models import User, Group
 from django.utils import timezone
@@ -18,10 +19,25 @@ from custom_registration.models import create_user
 import datetime
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True)
 class TestCourseApi(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
 
+    def setUp(self):
+        # API responses are cached across tests
+        cache.clear()
+
+    def test_list_courses_paginated(self):
+        c = Client()
+        resp = c.get('/api/courses/', {'offset': 2, 'limit': 1})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(len(data["items"]), 1)
+        titles = [item["title"] for item in c.get('/api/courses/').json()["items"]]
+        self.assertEqual(data["items"][0]["title"], titles[2])
+
     def test_list_all_courses(self):
         c = Client()
         resp = c.get('/api/courses/')
@@ -81,6 +97,63 @@ class TestCourseApi(TestCase):
         self.assertEqual(resp.json()["count"], 1)
 
 
+    def test_find_by_q_after_update(self):
+        c = Client()
+        course = Course.objects.get(pk=1)
+        course.title = 'Supercalifragilistic'
+        course.save()
+        resp = c.get('/api/courses/', {'q': 'supercali'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["count"], 1)
+        self.assertEqual(resp.json()["items"][0]["id"], 1)
+
+        # learning circles using the course should also match
+        resp = c.get('/api/learningcircles/', {'q': 'supercali'})
+        self.assertEqual(resp.json()["count"], StudyGroup.objects.published().filter(course=course).count())
+
+
+    def test_course_topics(self):
+        c = Client()
+        resp = c.get('/api/courses/topics/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["topics"], {
+            "math": 1,
+            "science": 1,
+            "uniquetopic1": 1,
+            "writing": 1,
+            "uniquetopic2": 1,
+        })
+
+        course = Course.objects.get(pk=3)
+        course.topics = 'Math, Art'
+        course.save()
+        resp = c.get('/api/courses/topics/')
+        self.assertEqual(resp.json()["topics"]["math"], 2)
+        self.assertEqual(resp.json()["topics"]["art"], 1)
+
+        course.delete()
+        resp = c.get('/api/courses/topics/')
+        self.assertEqual(resp.json()["topics"]["math"], 1)
+        self.assertNotIn("art", resp.json()["topics"])
+
+
+    def test_learning_circle_topics(self):
+        c = Client()
+        resp = c.get('/api/learningcircles/topics/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["topics"], {})
+
+        sg = StudyGroup.objects.filter(course_id=2).published().first()
+        sg.meeting_set.create(meeting_date=datetime.date.today() + datetime.timedelta(days=7), meeting_time=datetime.time(18, 0))
+        resp = c.get('/api/learningcircles/topics/')
+        self.assertEqual(resp.json()["topics"], {"writing": 1, "uniquetopic2": 1})
+
+        # the meeting is no longer upcoming once its date has passed
+        with patch('studygroups.models.course.timezone.now', return_value=timezone.now() + datetime.timedelta(days=8)):
+            resp = c.get('/api/learningcircles/topics/')
+        self.assertEqual(resp.json()["topics"], {})
+
+
     def test_search_by_topics(self):
         c = Client()
         # no matches
@@ -0,0 +1,93 @@
+# coding: utf-8
+from django.test import TestCase, override_settings
+from django.test import Client
+from django.core.cache import cache
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from mock import patch
+
+from studygroups.models import StudyGroup
+from studygroups.models import Application
+from studygroups.models import generate_all_meetings
+from surveys.models import LearnerSurveyResponse
+from custom_registration.models import create_user
+from api.instrumentation import reset_stats
+from api.instrumentation import QueryBudgetExceeded
+
+import datetime
+import re
+import time
+
+
+@override_settings(API_QUERY_BUDGET_ENFORCE=True)
+class TestInstrumentation(TestCase):
+
+    fixtures = ['test_courses.json', 'test_studygroups.json']
+
+    def setUp(self):
+        cache.clear()
+        reset_stats()
+        with patch('custom_registration.signals.send_email_confirm_email'):
+            user = create_user('admin@test.com', 'admin', 'h', 'password')
+        user.is_staff = True
+        user.save()
+
+    def test_server_timing(self):
+        c = Client()
+        resp = c.get('/api/courses/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertRegex(resp['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+        # other requests aren't instrumented
+        resp = c.get('/en/')
+        self.assertFalse(resp.has_header('Server-Timing'))
+
+    def test_serialize_time_includes_mapping(self):
+        c = Client()
+        def slow_course_to_json(course):
+            time.sleep(0.02)
+            return {"id": course.id}
+        with patch('studygroups.views.api._course_to_json', side_effect=slow_course_to_json) as course_to_json:
+            resp = c.get('/api/courses/')
+        serialize_ms = float(re.search(r'serialize;dur=([\d.]+)', resp['Server-Timing']).group(1))
+        self.assertGreaterEqual(serialize_ms, 20*course_to_json.call_count)
+
+    def test_stats(self):
+        c = Client()
+        for i in range(3):
+            c.get('/api/courses/', {'offset': i})
+
+        resp = c.get('/api/instrumentation/')
+        self.assertEqual(resp.status_code, 302)
+
+        c.login(username='admin@test.com', password='password')
+        resp = c.get('/api/instrumentation/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("email_inlining", resp.json())
+        stats = resp.json()["views"]
+        self.assertEqual(stats["api_courses"]["count"], 3)
+        self.assertEqual(sorted(stats["api_courses"]["query_count"].keys()), ["max", "p50", "p90", "p99"])
+        self.assertGreater(stats["api_courses"]["size"]["p50"], 0)
+
+    def test_query_budgets(self):
+        # the number of queries shouldn't depend on the number of learning circles
+        for sg in StudyGroup.objects.all():
+            sg.start_date = datetime.date(2019, 6, 1)
+            sg.end_date = sg.start_date + datetime.timedelta(weeks=2)
+            sg.save()
+            sg.refresh_from_db()
+            generate_all_meetings(sg)
+            learner = Application.objects.create(study_group=sg, name='learner', email='learner{}@example.net'.format(sg.pk))
+            LearnerSurveyResponse.objects.create(study_group=sg, learner=learner, typeform_key='key{}'.format(sg.pk), responded_at=timezone.now())
+
+        c = Client()
+        for url_name in settings.API_QUERY_BUDGETS.keys():
+            cache.clear()
+            resp = c.get(reverse(url_name))
+            self.assertEqual(resp.status_code, 200)
+
+        with override_settings(API_QUERY_BUDGETS={'api_courses': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                c.get('/api/courses/')
@@ -1,6 +1,7 @@
 # coding: utf-8
 from django.test import TestCase, override_settings
 from django.test import Client
+from django.core.cache import cache
 from django.conf import settings
 from django.core import mail
 from django.contrib.auth.models import User, Group
@@ -13,16 +14,23 @@ from freezegun import freeze_time
 from studygroups.models import StudyGroup
 from studygroups.models import Meeting
 from studygroups.models import Application
+from studygroups.models import StatsSnapshot
+from studygroups.tasks import refresh_landing_page_stats
 
 from surveys.models import LearnerSurveyResponse
 
 import datetime
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True)
 class TestLandingPageApi(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
 
+    def setUp(self):
+        # API responses are cached across tests
+        cache.clear()
+
     def test_landing_page_learning_circles(self):
         c = Client()
         meeting_1 = Meeting.objects.create(
@@ -67,6 +75,49 @@ class TestLandingPageApi(TestCase):
             self.assertEqual(len(resp.json()["items"]), 3)
 
 
+    def test_landing_page_stats(self):
+        c = Client()
+        with freeze_time("2017-10-24 17:55:34"):
+            resp = c.get('/api/landing-page-stats/')
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["learning_circle_count"], 4)
+        self.assertEqual(data["snapshot_at"], "2017-10-24T17:55:34Z")
+
+        # served from the snapshot
+        StatsSnapshot.objects.update(data=json.dumps({"learning_circle_count": 10}))
+        resp = c.get('/api/landing-page-stats/', {'fresh': 1})
+        self.assertEqual(resp.json()["learning_circle_count"], 10)
+
+        # staff can get fresh stats
+        staff = User.objects.create_user('staff', 'staff@example.net', 'password', is_staff=True)
+        c.login(username='staff', password='password')
+        resp = c.get('/api/landing-page-stats/', {'fresh': 1})
+        self.assertEqual(resp.json()["learning_circle_count"], 4)
+
+        # unpublishing a learning circle refreshes the snapshot after the commit
+        c.logout()
+        sg = StudyGroup.objects.get(pk=1)
+        with patch('studygroups.signals.transaction.on_commit') as on_commit, \
+                patch('studygroups.tasks.refresh_landing_page_stats.delay', side_effect=refresh_landing_page_stats) as delay:
+            # other changes don't
+            sg.name = 'Renamed'
+            sg.save()
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+            self.assertFalse(delay.called)
+
+            sg.draft = True
+            sg.save()
+            resp = c.get('/api/landing-page-stats/')
+            self.assertEqual(resp.json()["learning_circle_count"], 4)
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+            self.assertEqual(delay.call_count, 1)
+        resp = c.get('/api/landing-page-stats/')
+        self.assertEqual(resp.json()["learning_circle_count"], 3)
+
+
     def test_learning_circles_map_view(self):
         c = Client()
 
@@ -123,3 +174,66 @@ class TestLandingPageApi(TestCase):
                 'start_date': '2015-03-23',
                 'title': "The Bandits of Hell's Bend"
             })
+
+
+    def test_learning_circles_map_view_columnar(self):
+        c = Client()
+        StudyGroup.objects.filter(pk=1).update(end_date=datetime.date(2017,3,23), latitude=10, longitude=170)
+        StudyGroup.objects.filter(pk=3).update(latitude=10.001, longitude=170.001)
+        StudyGroup.objects.filter(pk=4).update(latitude=None, longitude=None)
+        finished_studygroup = StudyGroup.objects.get(pk=2)
+        learner = Application.objects.create(study_group=finished_studygroup)
+        LearnerSurveyResponse.objects.create(
+            study_group=finished_studygroup,
+            learner=learner,
+            responded_at=timezone.make_aware(datetime.datetime(2017,2,23))
+        )
+
+        with freeze_time("2017-3-20 17:55:34"):
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json(), {
+                "count": 3,
+                "id": [1, 2, 3],
+                "latitude": [10.0, 41.85003, 10.001],
+                "longitude": [170.0, -87.65005, 170.001],
+                "flags": [1, 2, 0],
+            })
+
+            # bbox crossing the antimeridian
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar', 'bbox': '160,0,-170,20'})
+            self.assertEqual(resp.json()["id"], [1, 3])
+
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar', 'zoom': 3})
+            data = resp.json()
+            self.assertEqual(data["count"], 2)
+            self.assertEqual(sorted(data["size"]), [1, 2])
+            cluster = data["size"].index(2)
+            self.assertEqual(data["id"][cluster], None)
+            self.assertEqual(data["active"][cluster], 1)
+            self.assertEqual(data["id"][data["size"].index(1)], 2)
+
+
+    def test_learning_circles_map_view_conditional(self):
+        c = Client()
+        with freeze_time("2017-3-20 17:55:34"):
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar'})
+            self.assertEqual(resp.status_code, 200)
+            etag = resp['ETag']
+            last_modified = resp['Last-Modified']
+
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 304)
+
+            resp = c.get('/api/learning-circles-map/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar'}, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(resp.status_code, 304)
+
+        with freeze_time("2017-3-20 18:55:34"):
+            sg = StudyGroup.objects.get(pk=1)
+            sg.city = 'Cape Town'
+            sg.save()
+            resp = c.get('/api/learning-circles-map/', {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
@@ -1,28 +1,38 @@
 # coding: utf-8
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test import Client
+from django.core.cache import cache
 from django.core import mail
 from django.utils import timezone
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from mock import patch
 from freezegun import freeze_time
 
 from studygroups.models import generate_all_meetings
 from studygroups.models import StudyGroup
+from studygroups.models import Meeting
+from studygroups.models import Application
 from studygroups.models import Profile
 from studygroups.models import Team, TeamMembership
 from custom_registration.models import create_user
+from api.cache import get_model_version
+from api.cache import invalidate_model_version
 
 
 import datetime
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True, SIGNAL_EMAILS_SYNC=True)
 class TestLearningCircleApi(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
 
     def setUp(self):
+        # API responses are cached across tests
+        cache.clear()
         with patch('custom_registration.signals.send_email_confirm_email'):
             user = create_user('faci@example.net', 'b', 't', 'password', False)
             user.save()
@@ -745,6 +755,50 @@ class TestLearningCircleApi(TestCase):
         self.assertEqual(data["items"][0]["course"]["title"], "Academic Writing")
 
 
+    def test_get_learning_circles_full_text_search_after_update(self):
+        c = Client()
+        resp = c.get('/api/learningcircles/', {'q': 'zanzibar'})
+        self.assertEqual(resp.json()["count"], 0)
+
+        sg = StudyGroup.objects.get(pk=1)
+        sg.venue_name = 'Zanzibar library'
+        sg.save()
+        resp = c.get('/api/learningcircles/', {'q': 'zanzibar'})
+        self.assertEqual(resp.json()["count"], 1)
+        self.assertEqual(resp.json()["items"][0]["id"], 1)
+
+        facilitator = sg.facilitator
+        facilitator.last_name = 'Quixotic'
+        facilitator.save()
+        resp = c.get('/api/learningcircles/', {'q': 'quixo'})
+        self.assertEqual(resp.json()["count"], StudyGroup.objects.published().filter(facilitator=facilitator).count())
+
+
+    def test_get_learning_circles_by_location(self):
+        locations = {
+            1: (45, 179.5),  # ~40km from the search point, across the antimeridian
+            2: (45, -179.9),  # ~8km from the search point
+            3: (45.45, -179.4),  # inside the bounding box, but ~68km away
+            4: (10, -179.4),
+        }
+        for pk, (latitude, longitude) in locations.items():
+            StudyGroup.objects.filter(pk=pk).update(latitude=latitude, longitude=longitude)
+
+        c = Client()
+        resp = c.get('/api/learningcircles/', {'latitude': 45, 'longitude': -179.99, 'distance': 60})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual([item["id"] for item in data["items"]], [2, 1])
+        self.assertAlmostEqual(data["items"][0]["distance_km"], 7, delta=1)
+        self.assertAlmostEqual(data["items"][1]["distance_km"], 40, delta=1)
+
+        resp = c.get('/api/learningcircles/', {'latitude': 45, 'longitude': 179.99, 'distance': 120, 'limit': 2})
+        data = resp.json()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual([item["id"] for item in data["items"]], [2, 1])
+
+
     @freeze_time("2019-05-31")
     def test_get_learning_circles_by_scope(self):
         sg = StudyGroup.objects.get(pk=1)
@@ -843,3 +897,135 @@ class TestLearningCircleApi(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json()["count"], 1)
         self.assertEqual(data["items"][0]["last_meeting_date"], "2019-05-15")
+
+
+    def test_get_learning_circles_paginated(self):
+        c = Client()
+        resp = c.get('/api/learningcircles/', {'offset': 1, 'limit': 2})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(data["offset"], 1)
+        self.assertEqual(data["limit"], 2)
+        self.assertEqual([item["id"] for item in data["items"]], [2, 3])
+
+        resp = c.get('/api/learningcircles/', {'offset': 10, 'limit': 2})
+        data = resp.json()
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(data["items"], [])
+
+        resp = c.get('/api/learningcircles/', {'after': 2, 'limit': 1})
+        data = resp.json()
+        self.assertEqual(data["count"], 4)
+        self.assertEqual([item["id"] for item in data["items"]], [3])
+
+        resp = c.get('/api/learningcircles/', {'after': 'x'})
+        self.assertEqual(resp.json()["status"], "error")
+
+
+    @freeze_time("2019-05-31")
+    def test_get_learning_circles_query_count(self):
+        for sg in StudyGroup.objects.all():
+            sg.start_date = datetime.date(2019,6,1)
+            sg.end_date = sg.start_date + datetime.timedelta(weeks=sg.pk)
+            sg.save()
+            sg.refresh_from_db()
+            generate_all_meetings(sg)
+            for i in range(sg.pk):
+                Application.objects.create(study_group=sg, name='learner', email='learner{}@example.net'.format(i))
+
+        c = Client()
+        # look up the versions used for the response cache before counting
+        c.get('/api/learningcircles/', {'limit': 2})
+        with CaptureQueriesContext(connection) as single_page:
+            resp = c.get('/api/learningcircles/', {'limit': 1})
+        self.assertEqual(len(resp.json()["items"]), 1)
+
+        with CaptureQueriesContext(connection) as full_page:
+            resp = c.get('/api/learningcircles/', {'limit': 4})
+        data = resp.json()
+        self.assertEqual(len(data["items"]), 4)
+        self.assertEqual(len(single_page), len(full_page))
+
+        for item in data["items"]:
+            self.assertEqual(item["weeks"], item["id"] + 1)
+            self.assertEqual(item["signup_count"], item["id"])
+
+
+    def test_model_version_without_signals(self):
+        with patch('api.cache.MODEL_VERSION_TIMEOUT', 0):
+            version = get_model_version(Meeting)
+            # bulk_create doesn't send post_save
+            Meeting.objects.bulk_create([
+                Meeting(study_group_id=1, meeting_date=datetime.date(2020, 1, 1), meeting_time=datetime.time(18, 0))
+            ])
+            self.assertNotEqual(get_model_version(Meeting), version)
+            version = get_model_version(Meeting)
+            # neither does a soft delete of a queryset
+            Meeting.objects.filter(study_group_id=1).delete()
+            self.assertNotEqual(get_model_version(Meeting), version)
+
+        # otherwise the version is reused for a few minutes
+        version = get_model_version(Meeting)
+        Meeting.objects.filter(study_group_id=1).update(deleted_at=None)
+        self.assertEqual(get_model_version(Meeting), version)
+
+
+    def test_model_version_bumped(self):
+        version = get_model_version(Meeting)
+        invalidate_model_version(Meeting)
+        # the bumped version doesn't need the aggregate queries
+        with self.assertNumQueries(0):
+            self.assertNotEqual(get_model_version(Meeting), version)
+
+
+    def test_get_learning_circles_conditional(self):
+        c = Client()
+        resp = c.get('/api/learningcircles/', {'limit': 10, 'offset': 0})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('public', resp['Cache-Control'])
+        etag = resp['ETag']
+
+        # the same query in a different order has the same ETag
+        resp = c.get('/api/learningcircles/?offset=0&limit=10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        # cached responses are served with the same body
+        with CaptureQueriesContext(connection) as queries:
+            cached = c.get('/api/learningcircles/', {'limit': 10, 'offset': 0})
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached['ETag'], etag)
+
+        # saving a learning circle invalidates the response
+        sg = StudyGroup.objects.get(pk=1)
+        sg.name = 'Updated name'
+        sg.save()
+        resp = c.get('/api/learningcircles/', {'limit': 10, 'offset': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertIn('Updated name', [item['name'] for item in resp.json()['items']])
+
+        # renaming a facilitator invalidates the response
+        etag = resp['ETag']
+        facilitator = sg.facilitator
+        facilitator.first_name = 'Renamed'
+        facilitator.save()
+        resp = c.get('/api/learningcircles/', {'limit': 10, 'offset': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Renamed', [item['facilitator'] for item in resp.json()['items']])
+
+        # so does adding a facilitator to a team
+        team = Team.objects.create(name='test team', page_slug='test-team')
+        resp = c.get('/api/learningcircles/', {'team_id': team.pk})
+        self.assertEqual(resp.json()['count'], 0)
+        TeamMembership.objects.create(team=team, user=facilitator, role=TeamMembership.MEMBER)
+        resp = c.get('/api/learningcircles/', {'team_id': team.pk}, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(resp.json()['count'], 0)
+
+        # the response isn't shared with logged in users
+        c.login(username='faci@example.net', password='password')
+        resp = c.get('/api/learningcircles/', {'limit': 10, 'offset': 0})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.has_header('ETag'))
+        self.assertIn('private', resp['Cache-Control'])
@@ -14,6 +14,7 @@ from studygroups.models import Application
 import datetime
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True, SIGNAL_EMAILS_SYNC=True)
 class TestApiSignupView(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
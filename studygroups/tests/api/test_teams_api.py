@@ -9,6 +9,7 @@ from studygroups.models import Team
 
 import json
 
+@override_settings(API_QUERY_BUDGET_ENFORCE=True)
 class TestTeamsApi(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json', 'test_teams.json']
@@ -71,6 +72,21 @@ class TestTeamsApi(TestCase):
             self.assertIn(key, resp_keys)
 
 
+    def test_list_teams_with_image(self):
+        c = Client()
+        # count includes the teams without an image
+        response = c.get('/api/teams/?image=true')
+        res_data = response.json()
+        self.assertEqual(res_data["count"], 2)
+        self.assertEqual([team["id"] for team in res_data["items"]], [1])
+
+        response = c.get('/api/teams/?image=true&limit=10&offset=0')
+        res_data = response.json()
+        self.assertEqual(list(res_data.keys()), ["count", "offset", "limit", "items"])
+        self.assertEqual(res_data["count"], 2)
+        self.assertEqual(len(res_data["items"]), 1)
+
+
     def test_team_data(self):
         c = Client()
         response = c.get('/api/teams/')
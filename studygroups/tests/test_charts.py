@@ -1,10 +1,22 @@
 # coding: utf-8
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+from django.core.cache import cache
 
 from mock import patch
+from mock import Mock
 
 from studygroups.models import StudyGroup
+from studygroups.models import Meeting
+from studygroups.models import Application
+from studygroups.models import Team
+from studygroups.models import TeamMembership
 from surveys.models import LearnerSurveyResponse
+from surveys.models import FacilitatorSurveyResponse
+from surveys.models import LearnerSurveySummary
+from custom_registration.models import create_user
 
 from studygroups.charts import get_question_field
 from studygroups.charts import get_response_field
@@ -13,8 +25,14 @@ from studygroups.charts import NewLearnersChart
 from studygroups.charts import LearnerRatingChart
 from studygroups.charts import OverallRatingBarChart
 from studygroups.charts import NO_DATA
+from studygroups.charts import count_by_window
+from studygroups.charts import month_windows
+from studygroups import charts
+from api.cache import invalidate_model_version
 
+import datetime
 import pygal
+import uuid
 
 
 class TestCharts(TestCase):
@@ -148,3 +166,224 @@ class TestCharts(TestCase):
         result = chart_object.generate()
         self.assertIn('xmlns:xlink="http://www.w3.org/1999/xlink"', result)
 
+
+    def test_count_by_window(self):
+        study_group = StudyGroup.objects.get(pk=1)
+        for meeting_date in ['2020-01-01', '2020-01-31', '2020-02-01', '2020-03-15', '2020-04-01']:
+            Meeting.objects.create(study_group=study_group, meeting_date=meeting_date, meeting_time='17:00')
+        start = timezone.make_aware(datetime.datetime(2020, 1, 1))
+        boundaries = month_windows(start, timezone.make_aware(datetime.datetime(2020, 3, 31)))
+        self.assertEqual(len(boundaries), 4)
+        meetings = Meeting.objects.filter(study_group=study_group)
+        with self.assertNumQueries(1):
+            self.assertEqual(count_by_window(meetings, 'meeting_date', boundaries), [2, 1, 1])
+        counts = count_by_window(meetings, 'meeting_date', boundaries, group_by='meeting_time')
+        self.assertEqual(counts[0], {datetime.time(17, 0): 2})
+        self.assertEqual(count_by_window(meetings, 'meeting_date', [start]), [])
+
+
+    def test_over_time_chart_queries(self):
+        study_groups = StudyGroup.objects.published()
+        start = timezone.make_aware(datetime.datetime(2015, 1, 1))
+        chart_classes = [
+            charts.FacilitatorRatingOverTimeChart,
+            charts.FacilitatorCourseApprovalChart,
+            charts.LearnerCourseApprovalChart,
+            charts.FacilitatorExperienceChart,
+            charts.ParticipantsOverTimeChart,
+            charts.StudygroupsByCountryOverTimeChart,
+            charts.LearnerGoalReachedChart,
+            charts.LearnerResponseRateChart,
+        ]
+        for chart_class in chart_classes:
+            query_counts = []
+            for months in [2, 60]:
+                end = start + datetime.timedelta(days=months*30)
+                with CaptureQueriesContext(connection) as queries:
+                    chart_class(start, end, study_groups).get_data()
+                query_counts.append(len(queries))
+            self.assertEqual(query_counts[0], query_counts[1], chart_class.__name__)
+
+        query_counts = []
+        for report_date in [datetime.date(2016, 3, 1), datetime.date(2020, 3, 1)]:
+            with CaptureQueriesContext(connection) as queries:
+                charts.LearningCircleMeetingsChart(report_date).get_data()
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts, [1, 1])
+        with self.assertNumQueries(1):
+            charts.MeetingsOverTimeChart(start, timezone.make_aware(datetime.datetime(2016, 6, 30))).get_data()
+
+
+    def _study_group(self, **fields):
+        study_group = StudyGroup.objects.get(pk=1)
+        study_group.pk = None
+        study_group.uuid = uuid.uuid4()
+        for field, value in fields.items():
+            setattr(study_group, field, value)
+        study_group.save()
+        return study_group
+
+
+    def _aware(self, *args):
+        return timezone.make_aware(datetime.datetime(*args))
+
+
+    def test_participants_over_time_chart(self):
+        other_study_group = StudyGroup.objects.get(pk=2)
+        study_group = StudyGroup.objects.get(pk=1)
+        applications = [
+            ('returning@mail.com', other_study_group, self._aware(2019, 12, 15)),
+            ('returning@mail.com', study_group, self._aware(2020, 1, 10)),
+            ('new@mail.com', study_group, self._aware(2020, 1, 5)),
+            # returning in the second window only
+            ('twice@mail.com', study_group, self._aware(2020, 1, 20)),
+            ('twice@mail.com', study_group, self._aware(2020, 2, 10)),
+            # on the boundaries of the windows
+            ('feb@mail.com', study_group, self._aware(2020, 2, 1)),
+            ('march@mail.com', study_group, self._aware(2020, 3, 1)),
+            ('other@mail.com', other_study_group, self._aware(2020, 1, 15)),
+        ]
+        for email, application_study_group, accepted_at in applications:
+            Application.objects.create(study_group=application_study_group, name='Learner', email=email, accepted_at=accepted_at)
+
+        study_groups = StudyGroup.objects.filter(pk=1)
+        data = charts.ParticipantsOverTimeChart(self._aware(2020, 1, 1), self._aware(2020, 2, 15), study_groups).get_data()
+        self.assertEqual(data["first_time_participants"], [2, 1])
+        self.assertEqual(data["veteran_participants"], [1, 1])
+        self.assertEqual(data["dates"], ["Feb 2020", "Mar 2020"])
+
+        naive_data = charts.ParticipantsOverTimeChart(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 15), study_groups).get_data()
+        self.assertEqual(naive_data, data)
+
+
+    def test_facilitator_experience_chart(self):
+        facilitator = create_user('experienced@mail.com', 'experienced', 'facilitator', 'password')
+        veteran = create_user('veteran@mail.com', 'veteran', 'facilitator', 'password')
+        for start_date in ['2019-12-01', '2020-01-10', '2020-02-01', '2020-03-01']:
+            self._study_group(facilitator=facilitator, start_date=start_date)
+        for month in range(1, 6):
+            self._study_group(facilitator=veteran, start_date=datetime.date(2019, month, 1))
+        self._study_group(facilitator=veteran, start_date=datetime.date(2020, 1, 31))
+        # drafts aren't counted
+        self._study_group(facilitator=veteran, start_date=datetime.date(2019, 6, 1), draft=True)
+
+        chart = charts.FacilitatorExperienceChart(self._aware(2020, 1, 1), self._aware(2020, 2, 15), StudyGroup.objects.published())
+        data = chart.get_data()["data"]
+        self.assertEqual(data[1], [0, 0])
+        self.assertEqual(data[2], [1, 0])
+        self.assertEqual(data[3], [0, 1])
+        self.assertEqual(data[4], [0, 0])
+        self.assertEqual(data["5+"], [1, 0])
+
+
+    def _survey_response(self, model, study_group, responded_at, summary, **fields):
+        survey_response = model.objects.create(
+            study_group=study_group,
+            typeform_key=uuid.uuid4().hex,
+            form_id='form',
+            response='{}',
+            responded_at=responded_at,
+            **fields
+        )
+        type(survey_response.summary).objects.filter(response=survey_response).update(**summary)
+        return survey_response
+
+
+    def test_facilitator_rating_over_time_chart(self):
+        study_groups = [
+            # the goal rating takes precedence
+            self._study_group(end_date=datetime.date(2020, 1, 10), facilitator_goal_rating=5, facilitator_rating=2),
+            self._study_group(end_date=datetime.date(2020, 1, 20), facilitator_rating=3),
+            # a survey without a rating
+            self._study_group(end_date=datetime.date(2020, 1, 31)),
+            # no survey, counted as unrated
+            self._study_group(end_date=datetime.date(2020, 2, 1)),
+            self._study_group(end_date=datetime.date(2020, 2, 5)),
+            self._study_group(end_date=datetime.date(2020, 3, 1), facilitator_rating=1),
+        ]
+        self._survey_response(FacilitatorSurveyResponse, study_groups[0], self._aware(2020, 1, 11), {'goal_rating': 1})
+        self._survey_response(FacilitatorSurveyResponse, study_groups[2], self._aware(2020, 2, 1), {'goal_rating': None})
+        self._survey_response(FacilitatorSurveyResponse, study_groups[4], self._aware(2020, 2, 6), {'goal_rating': 4})
+
+        study_groups = StudyGroup.objects.filter(pk__in=[study_group.pk for study_group in study_groups])
+        data = charts.FacilitatorRatingOverTimeChart(self._aware(2020, 1, 1), self._aware(2020, 2, 15), study_groups).get_data()["data"]
+        self.assertEqual(data, {None: [1, 1], 1: [0, 0], 2: [0, 0], 3: [1, 0], 4: [0, 1], 5: [1, 0]})
+
+
+    def test_learner_goal_reached_chart(self):
+        study_group = self._study_group()
+        learner = Application.objects.create(study_group=study_group, name='Learner', email='learner@mail.com', goal_met=5)
+        learner_without_rating = Application.objects.create(study_group=study_group, name='Learner', email='learner2@mail.com')
+        responses = [
+            # the goal rating of the learner takes precedence
+            (learner, self._aware(2020, 1, 10), 2),
+            (learner_without_rating, self._aware(2020, 1, 20), 3),
+            (None, self._aware(2020, 1, 31, 23, 59), None),
+            (None, self._aware(2020, 2, 1), 1),
+            (None, self._aware(2020, 3, 1), 1),
+        ]
+        for response_learner, responded_at, goal_rating in responses:
+            self._survey_response(LearnerSurveyResponse, study_group, responded_at, {'goal_rating': goal_rating}, learner=response_learner)
+
+        study_groups = StudyGroup.objects.filter(pk=study_group.pk)
+        data = charts.LearnerGoalReachedChart(self._aware(2020, 1, 1), self._aware(2020, 2, 15), study_groups).get_data()["data"]
+        self.assertEqual(data, {1: [0, 1], 2: [0, 0], 3: [1, 0], 4: [0, 0], 5: [1, 0]})
+
+
+    def test_learning_circle_countries_chart(self):
+        countries = {1: "United States of America", 2: "Kenya", 3: "", 4: "Kenya"}
+        meeting_dates = {
+            1: [(datetime.date(2019, 5, 1), None), (datetime.date(2019, 6, 15), None)],
+            2: [(datetime.date(2019, 1, 1), None), (datetime.date(2020, 3, 1), None)],
+            3: [(datetime.date(2019, 7, 1), None), (datetime.date(2020, 5, 1), timezone.now())],
+            4: [(datetime.date(2019, 1, 1), None), (datetime.date(2019, 7, 1), timezone.now())],
+        }
+        for study_group in StudyGroup.objects.all():
+            study_group.country_en = countries[study_group.pk]
+            study_group.save()
+            for meeting_date, deleted_at in meeting_dates[study_group.pk]:
+                Meeting.objects.create(study_group=study_group, meeting_date=meeting_date, meeting_time=datetime.time(17, 0), deleted_at=deleted_at)
+
+        chart = charts.LearningCircleCountriesChart(datetime.date(2019, 6, 1), datetime.date(2019, 12, 31))
+        with self.assertNumQueries(1):
+            data = chart.get_data()
+        self.assertEqual(data, {"Not reported": 1, "USA": 1, "Kenya": 1})
+
+
+    def test_cached_chart(self):
+        cache.clear()
+        render = Mock(return_value='<svg></svg>')
+        self.assertEqual(charts.cached_chart('attendance_chart', 1, render), '<svg></svg>')
+        self.assertEqual(charts.cached_chart('attendance_chart', 1, render), '<svg></svg>')
+        self.assertEqual(render.call_count, 1)
+
+        charts.cached_chart('attendance_chart', 2, render)
+        charts.cached_chart('recommendation_chart', 1, render)
+        self.assertEqual(render.call_count, 3)
+
+        # new survey responses change the key of the cached charts
+        LearnerSurveyResponse.objects.first().save()
+        charts.cached_chart('attendance_chart', 1, render)
+        self.assertEqual(render.call_count, 4)
+
+        Meeting.objects.create(study_group_id=1, meeting_date=datetime.date(2020, 1, 1), meeting_time=datetime.time(17, 0))
+        charts.cached_chart('attendance_chart', 1, render)
+        charts.cached_chart('attendance_chart', 1, render)
+        self.assertEqual(render.call_count, 5)
+
+        # the team stats dash charts depend on the members of the team
+        team = Team.objects.create(name='test team', page_slug='test-team')
+        TeamMembership.objects.create(team=team, user_id=1, role=TeamMembership.MEMBER)
+        charts.cached_chart('attendance_chart', 1, render)
+        self.assertEqual(render.call_count, 6)
+
+        # reading a response without a summary doesn't change the key
+        LearnerSurveySummary.objects.filter(response_id=1).delete()
+        invalidate_model_version(LearnerSurveySummary)
+        charts.cached_chart('attendance_chart', 1, render)
+        self.assertEqual(render.call_count, 7)
+        with patch('surveys.models.invalidate_model_version') as invalidate:
+            LearnerSurveyResponse.objects.get(pk=1).get_summary()
+        self.assertFalse(invalidate.called)
+        charts.cached_chart('attendance_chart', 1, render)
+        self.assertEqual(render.call_count, 7)
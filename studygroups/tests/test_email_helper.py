@@ -0,0 +1,26 @@
+from django.test import TestCase
+from django.conf import settings
+
+from premailer import Premailer
+
+from studygroups.utils import render_to_string_ctx
+from studygroups.email_helper import inline_css
+from studygroups.email_helper import get_inline_stats
+
+
+class TestEmailHelper(TestCase):
+
+    def test_inline_css(self):
+        base_url = f"{settings.PROTOCOL}://{settings.DOMAIN}"
+        count = get_inline_stats()["count"]
+        for link in ['https://example.net/rsvp/?user=1&attending=yes', 'https://example.net/rsvp/?user=2&attending=no']:
+            html = render_to_string_ctx('studygroups/email/learner_meeting_reminder.html', {
+                "facilitator_message": "See you <b>soon</b>",
+                "rsvp_yes_link": link,
+                "rsvp_no_link": link,
+                "unsubscribe_link": link,
+            })
+            # the cached stylesheets are used for the second email
+            self.assertEqual(inline_css(html), Premailer(html, base_url=base_url, disable_validation=True).transform())
+        self.assertEqual(get_inline_stats()["count"], count + 2)
+        self.assertGreater(get_inline_stats()["cached_stylesheets"], 0)
@@ -37,6 +37,7 @@ import json
 """
 Tests for when facilitators interact with the system
 """
+@override_settings(SIGNAL_EMAILS_SYNC=True)
 class TestFacilitatorViews(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
@@ -451,7 +452,7 @@ class TestFacilitatorViews(TestCase):
             self.assertEquals(meeting.reminder_set.count(), 0)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_email(self, send_message):
         # Test sending a message
         c = Client()
@@ -480,7 +481,7 @@ class TestFacilitatorViews(TestCase):
         self.assertIn('{}/en/optout/'.format(settings.DOMAIN), mail.outbox[0].body)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_sms(self, send_message):
         c = Client()
         c.login(username='admin@test.com', password='password')
@@ -504,7 +505,7 @@ class TestFacilitatorViews(TestCase):
         self.assertTrue(send_message.called)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_dont_send_blank_sms(self, send_message):
         c = Client()
         c.login(username='admin@test.com', password='password')
@@ -0,0 +1,99 @@
+# coding: utf-8
+from django.test import TestCase
+from django.test import RequestFactory
+from django.test import Client
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.translation import gettext_lazy as _
+
+from mock import patch
+
+from uxhelpers import utils
+from uxhelpers.utils import json_response
+from uxhelpers.utils import json_value
+
+from decimal import Decimal
+import datetime
+import json
+import pytz
+
+
+class TestJsonResponse(TestCase):
+
+    fixtures = ['test_courses.json', 'test_studygroups.json']
+
+    data = {
+        "items": [
+            {
+                "latitude": Decimal('41.850030'),
+                "start_date": datetime.date(2020, 3, 1),
+                "start_datetime": datetime.datetime(2020, 3, 1, 18, 30, 0, 123456, tzinfo=pytz.utc),
+                "meeting_time": datetime.time(18, 30),
+                "title": _('Learning circles'),
+                "unicode": "Быстрее и лучше",
+            },
+        ] * 3,
+        "count": 3,
+    }
+
+    def _content(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content).decode('utf-8')
+        return response.content.decode('utf-8')
+
+    def test_same_result_as_django_encoder(self):
+        expected = json.loads(json.dumps(self.data, cls=DjangoJSONEncoder))
+        request = RequestFactory().get('/api/')
+        encoders = [utils._stdlib_dumps]
+        if utils.orjson:
+            encoders += [utils._orjson_dumps]
+        for dumps in encoders:
+            for stream in [False, True]:
+                resp = json_response(request, self.data, dumps=dumps, stream=stream)
+                self.assertEqual(resp['Content-Type'], 'application/json')
+                self.assertEqual(json.loads(self._content(resp)), expected)
+
+        prepared = {"items": [{key: json_value(value) for key, value in item.items()} for item in self.data["items"]]}
+        self.assertEqual(json.loads(utils._stdlib_dumps(prepared))["items"], expected["items"])
+
+    def test_jsonp(self):
+        request = RequestFactory().get('/api/', {'callback': 'cb'})
+        for stream in [False, True]:
+            resp = json_response(request, {"items": iter([1, 2, 3])}, stream=stream) if stream else json_response(request, {"items": [1, 2, 3]})
+            self.assertEqual(resp['Content-Type'], 'text/javascript; charset=utf-8')
+            content = self._content(resp)
+            self.assertTrue(content.startswith('cb('))
+            self.assertTrue(content.endswith(');'))
+            self.assertEqual(json.loads(content[3:-2]), {"items": [1, 2, 3]})
+
+    def test_jsonp_non_ascii(self):
+        data = {"city": "Kraków", "title": "Быстрее и лучше", "emoji": "\U0001f600", "separator": "\u2028"}
+        request = RequestFactory().get('/api/', {'callback': 'cb'})
+        encoders = [utils._stdlib_dumps]
+        if utils.orjson:
+            encoders += [utils._orjson_dumps]
+        for dumps in encoders:
+            for stream in [False, True]:
+                resp = json_response(request, data, dumps=dumps, stream=stream)
+                self.assertEqual(resp['Content-Type'], 'text/javascript; charset=utf-8')
+                content = b''.join(resp.streaming_content) if stream else resp.content
+                # the same escapes as json.dumps with ensure_ascii
+                content = content.decode('ascii')
+                self.assertIn('Krak\\u00f3w', content)
+                self.assertIn('\\ud83d\\ude00', content)
+                self.assertEqual(json.loads(content[3:-2]), data)
+
+
+    def test_stream_chunks(self):
+        request = RequestFactory().get('/api/')
+        with patch('uxhelpers.utils.STREAM_CHUNK_SIZE', 2):
+            resp = json_response(request, {"items": (i for i in range(5)), "empty": []}, stream=True)
+            self.assertEqual(json.loads(self._content(resp)), {"items": [0, 1, 2, 3, 4], "empty": []})
+
+    def test_map_view_stream(self):
+        c = Client()
+        expected = c.get('/api/learning-circles-map/').json()
+        self.assertEqual(len(expected["items"]), 4)
+        with patch('studygroups.views.api.LearningCirclesMapView.MAP_STREAM_THRESHOLD', 2):
+            resp = c.get('/api/learning-circles-map/')
+        self.assertTrue(resp.streaming)
+        self.assertEqual(json.loads(self._content(resp)), expected)
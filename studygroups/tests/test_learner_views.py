@@ -32,6 +32,7 @@ Tests for when a learner interacts with the system. IOW:
     - signups
     - rsvps
 """
+@override_settings(SIGNAL_EMAILS_SYNC=True)
 class TestLearnerViews(TestCase):
 
     fixtures = ['test_courses.json', 'test_studygroups.json']
@@ -61,6 +62,22 @@ class TestLearnerViews(TestCase):
         self.assertEqual(mail.outbox[0].to[0], self.APPLICATION_DATA['email'])
 
 
+    @override_settings(SIGNAL_EMAILS_SYNC=False)
+    def test_submit_application_email_after_commit(self):
+        c = Client()
+        with patch('studygroups.signals.transaction.on_commit') as on_commit, \
+                patch('studygroups.tasks.send_new_application_email.delay') as delay:
+            resp = c.post('/en/signup/foo-bob-1/', self.APPLICATION_DATA)
+            self.assertRedirects(resp, '/en/signup/1/success/')
+            # the email isn't sent in the request
+            self.assertEqual(len(mail.outbox), 0)
+            self.assertFalse(delay.called)
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+        application = Application.objects.active().get()
+        delay.assert_called_once_with(application.pk)
+
+
     def test_application_welcome_message(self):
         c = Client()
         study_group = StudyGroup.objects.get(pk=1)
@@ -1,4 +1,5 @@
-from django.test import TestCase
+from django.apps import apps
+from django.test import TestCase, override_settings
 from django.core import mail
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -18,11 +19,13 @@ from studygroups.utils import gen_rsvp_querystring
 from studygroups.utils import check_rsvp_signature
 from studygroups.utils import check_unsubscribe_signature
 from studygroups.tasks import send_meeting_change_notification
+from studygroups.tasks import send_new_study_group_email
 
 from custom_registration.models import create_user
 
 from unittest.mock import patch
 import datetime
+import importlib
 import pytz
 import urllib.request
 import urllib.parse
@@ -158,10 +161,9 @@ class TestSignupModels(TestCase):
         self.assertEqual(Rsvp.objects.all().count(), 1)
         self.assertFalse(Rsvp.objects.all().first().attending)
 
-    def test_new_study_group_email(self):
+    def _new_study_group(self):
         facilitator = create_user('facil@test.com', 'facil', 'itate', 'password')
-        mail.outbox = []
-        sg = StudyGroup(
+        return StudyGroup(
             course=Course.objects.first(),
             facilitator=facilitator,
             description='blah',
@@ -179,12 +181,32 @@ class TestSignupModels(TestCase):
             facilitator_goal='the_facilitator_goal',
             facilitator_concerns='the_facilitators_concerns'
         )
+
+    @override_settings(SIGNAL_EMAILS_SYNC=True)
+    def test_new_study_group_email(self):
+        sg = self._new_study_group()
+        mail.outbox = []
         sg.save()
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn('the_facilitator_goal', mail.outbox[0].body)
         self.assertIn('the_facilitators_concerns', mail.outbox[0].body)
 
-    @patch('studygroups.tasks.send_message')
+    def test_new_study_group_email_after_commit(self):
+        sg = self._new_study_group()
+        mail.outbox = []
+        with patch('studygroups.signals.transaction.on_commit') as on_commit, \
+                patch('studygroups.tasks.send_new_study_group_email.delay', side_effect=send_new_study_group_email) as delay:
+            sg.save()
+            # nothing is sent until the transaction commits
+            self.assertEqual(len(mail.outbox), 0)
+            self.assertFalse(delay.called)
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+        delay.assert_called_once_with(sg.pk)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('the_facilitator_goal', mail.outbox[0].body)
+
+    @patch('studygroups.tasks.send_bulk_message')
     def test_meeting_change_notification(self, send_message):
         sg = StudyGroup.objects.first()
         data = self.APPLICATION_DATA
@@ -206,7 +228,7 @@ class TestSignupModels(TestCase):
         self.assertIn('signup2@mail.com', mail.outbox[0].bcc)
         self.assertEqual(meeting.meeting_time, datetime.time(18, 30))
         self.assertEqual(mail.outbox[0].subject, 'Test learning circle at Harold Washington now meets Monday, 1 April, 6:30PM.')
-        send_message.assert_called_with('+27713213213', 'Your learning circle on Monday, 23 March, 6:30PM has been rescheduled. Reply STOP to unsubscribe.')
+        send_message.assert_called_with(['+27713213213'], 'Your learning circle on Monday, 23 March, 6:30PM has been rescheduled. Reply STOP to unsubscribe.')
 
 
 class TestCourseModel(TestCase):
@@ -217,3 +239,17 @@ class TestCourseModel(TestCase):
         self.assertEqual(course.platform, "")
         course.detect_platform_from_link()
         self.assertEqual(course.platform, KNOWN_COURSE_PLATFORMS["www.khanacademy.org/"])
+
+
+    def test_search_vector_migration(self):
+        expected = {
+            model: list(model.objects.order_by('pk').values_list('search_vector', flat=True))
+            for model in [Course, StudyGroup]
+        }
+        Course.objects.update(search_vector=None)
+        StudyGroup.objects.update(search_vector=None)
+        migration = importlib.import_module('studygroups.migrations.0135_search_vector')
+        migration.set_search_vectors(apps, None)
+        for model, search_vectors in expected.items():
+            self.assertEqual(list(model.objects.order_by('pk').values_list('search_vector', flat=True)), search_vectors)
+        self.assertTrue(all(search_vectors for search_vectors in expected[StudyGroup]))
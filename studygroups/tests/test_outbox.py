@@ -0,0 +1,126 @@
+from django.test import TestCase
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.utils import timezone
+
+from mock import patch
+from freezegun import freeze_time
+
+from studygroups.models import OutboxMessage
+from studygroups.models.outbox import queue_email
+from studygroups.models.outbox import deliver_outbox
+from studygroups.models.outbox import send_queued
+from studygroups.models.outbox import purge_outbox
+from studygroups.models.outbox import OUTBOX_MAX_ATTEMPTS
+from studygroups.tasks import send_outbox
+
+import datetime
+
+
+def _email(to='learner@example.net'):
+    email = EmailMultiAlternatives('Subject', 'Text body', 'from@example.net', [to], bcc=['bcc@example.net'], reply_to=['facilitator@example.net'])
+    email.attach_alternative('<p>HTML body</p>', 'text/html')
+    email.attach('lc.ics', 'BEGIN:VCALENDAR', 'text/calendar')
+    return email
+
+
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        mail.outbox = []
+
+    def test_send_once(self):
+        message = queue_email('test-1', _email())
+        self.assertEqual(queue_email('test-1', _email(to='other@example.net')), None)
+        send_queued([message])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['learner@example.net'])
+        self.assertEqual(mail.outbox[0].bcc, ['bcc@example.net'])
+        self.assertEqual(mail.outbox[0].reply_to, ['facilitator@example.net'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>HTML body</p>', 'text/html')])
+        self.assertIn('BEGIN:VCALENDAR', mail.outbox[0].attachments[0].get_payload())
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.SENT)
+        self.assertEqual(message.attempts, 1)
+
+        # sent messages aren't sent again
+        send_queued([message])
+        self.assertEqual(deliver_outbox(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @freeze_time('2020-03-02 10:00:00')
+    def test_retry(self):
+        message = queue_email('test-1', _email())
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages') as send_messages:
+            send_messages.side_effect = Exception('Connection refused')
+            self.assertEqual(deliver_outbox(), 0)
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.last_error, 'Connection refused')
+        self.assertEqual(message.send_after, timezone.now() + datetime.timedelta(minutes=5))
+
+        # not retried before send_after
+        self.assertEqual(deliver_outbox(), 0)
+        with freeze_time('2020-03-02 10:06:00'):
+            self.assertEqual(deliver_outbox(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_give_up(self):
+        message = queue_email('test-1', _email())
+        with patch('studygroups.models.outbox.send_messages') as send_messages:
+            send_messages.return_value = [Exception('Invalid recipient')]
+            for i in range(OUTBOX_MAX_ATTEMPTS):
+                OutboxMessage.objects.filter(pk=message.pk).update(send_after=timezone.now())
+                deliver_outbox()
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.FAILED)
+        self.assertEqual(message.attempts, OUTBOX_MAX_ATTEMPTS)
+
+    def test_one_connection(self):
+        for i in range(3):
+            queue_email('test-{}'.format(i), _email(to='learner{}@example.net'.format(i)))
+        send_messages = EmailBackend.send_messages
+        def fail_second(backend, messages):
+            if messages[0].to == ['learner1@example.net']:
+                raise Exception('Invalid recipient')
+            return send_messages(backend, messages)
+        with patch('studygroups.email_helper.get_connection', wraps=get_connection) as connection, \
+                patch.object(EmailBackend, 'send_messages', autospec=True, side_effect=fail_second):
+            self.assertEqual(deliver_outbox(), 2)
+        self.assertEqual(connection.call_count, 1)
+        self.assertEqual([email.to for email in mail.outbox], [['learner0@example.net'], ['learner2@example.net']])
+        message = OutboxMessage.objects.get(dedupe_key='test-1')
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.last_error, 'Invalid recipient')
+
+    def test_claimed_messages(self):
+        message = queue_email('test-1', _email())
+        OutboxMessage.objects.filter(pk=message.pk).update(status=OutboxMessage.SENDING, claimed_at=timezone.now())
+        self.assertEqual(deliver_outbox(), 0)
+
+        # the worker that claimed the message stopped before sending it
+        OutboxMessage.objects.filter(pk=message.pk).update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(deliver_outbox(), 1)
+
+    def test_send_outbox(self):
+        for i in range(250):
+            queue_email('test-{}'.format(i), _email())
+        with patch('studygroups.tasks.deliver_outbox_batch.delay') as delay:
+            send_outbox()
+        self.assertEqual(delay.call_count, 2)
+        self.assertEqual(len(mail.outbox), 100)
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.PENDING).count(), 150)
+
+    def test_purge_outbox(self):
+        sent = queue_email('test-sent', _email())
+        old = queue_email('test-old', _email())
+        pending = queue_email('test-pending', _email())
+        deliver_outbox([sent, old])
+        OutboxMessage.objects.filter(pk=old.pk).update(sent_at=timezone.now() - datetime.timedelta(days=31))
+        OutboxMessage.objects.filter(pk=pending.pk).update(created_at=timezone.now() - datetime.timedelta(days=31))
+
+        self.assertEqual(purge_outbox(), 1)
+        self.assertEqual(sorted(OutboxMessage.objects.values_list('dedupe_key', flat=True)), ['test-pending', 'test-sent'])
@@ -51,7 +51,6 @@ class TestReportViews(TestCase):
             typeform_key="123",
             study_group=study_group,
             learner=learner,
-            survey="[]",
             response="[]",
             responded_at=timezone.now()
         )
@@ -61,7 +60,6 @@ class TestReportViews(TestCase):
         survey_data = dict(
             typeform_key="123",
             study_group=study_group,
-            survey="[]",
             response="[]",
             responded_at=timezone.now()
         )
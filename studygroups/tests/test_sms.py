@@ -0,0 +1,70 @@
+from django.test import SimpleTestCase, override_settings
+
+from twilio.base.exceptions import TwilioRestException
+
+from studygroups.sms import send_bulk_message
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+import time
+import urllib.parse
+
+
+class StubTwilioHandler(BaseHTTPRequestHandler):
+    """ accepts messages like the Twilio API, except for messages to +27000000000 """
+
+    def do_POST(self):
+        data = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.requests.append((self.path, data))
+        sid = 'SM{}'.format(len(self.server.requests))
+        status, body = 201, {
+            "account_sid": "AC123", "api_version": "2010-04-01", "body": data['Body'][0],
+            "date_created": None, "date_updated": None, "date_sent": None,
+            "direction": "outbound-api", "error_code": None, "error_message": None,
+            "from": data['From'][0], "messaging_service_sid": None, "num_media": "0",
+            "num_segments": "1", "price": None, "price_unit": "USD", "sid": sid,
+            "status": "queued", "subresource_uris": {}, "to": data['To'][0],
+            "uri": '{}/{}.json'.format(self.path[:-len('.json')], sid),
+        }
+        if data['To'] == ['+27000000000']:
+            status, body = 400, {"code": 21211, "message": "Invalid 'To' Phone Number", "status": 400}
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSms(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubTwilioHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send_bulk_message(self):
+        tos = ['+27713213213', '+27000000000', '+27713213214', '+27713213213']
+        with override_settings(TWILIO_API_URL=self.api_url, TWILIO_ACCOUNT_SID='AC123', TWILIO_AUTH_TOKEN='token', TWILIO_NUMBER='+12025550100', TWILIO_RATE_LIMIT=20):
+            start = time.monotonic()
+            results = send_bulk_message(tos, 'Your learning circle has been rescheduled')
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(list(results.keys()), ['+27713213213', '+27000000000', '+27713213214'])
+        self.assertIsNone(results['+27713213213'])
+        self.assertIsNone(results['+27713213214'])
+        self.assertIsInstance(results['+27000000000'], TwilioRestException)
+        self.assertEqual(len(self.server.requests), 3)
+        path, data = self.server.requests[0]
+        self.assertEqual(path, '/2010-04-01/Accounts/AC123/Messages.json')
+        self.assertEqual(data['From'], ['+12025550100'])
+        self.assertEqual(data['Body'], ['Your learning circle has been rescheduled'])
+        # 3 messages at 20 per second
+        self.assertGreaterEqual(elapsed, 0.1)
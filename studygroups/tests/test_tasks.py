@@ -26,16 +26,22 @@ from studygroups.utils import gen_rsvp_querystring
 from studygroups.utils import check_rsvp_signature
 from studygroups.utils import gen_unsubscribe_querystring
 from studygroups.utils import check_unsubscribe_signature
+from studygroups.email_helper import render_email_templates
+from studygroups.email_helper import prerender_email_templates
 
 from studygroups.tasks import generate_reminder
+from studygroups.tasks import generate_reminders
 from studygroups.tasks import send_reminders
 from studygroups.tasks import send_reminder
 from studygroups.tasks import send_weekly_update
 from studygroups.tasks import send_learner_surveys
+from studygroups.tasks import send_learner_survey
 from studygroups.tasks import send_facilitator_survey
 from studygroups.tasks import send_facilitator_learner_survey_prompt
 from studygroups.tasks import send_final_learning_circle_report
 from studygroups.tasks import send_out_community_digest
+from studygroups.tasks import send_all_facilitator_surveys
+from studygroups import scheduler
 
 from custom_registration.models import create_user
 
@@ -146,6 +152,44 @@ class TestStudyGroupTasks(TestCase):
         generate_reminder(sg)
         self.assertEqual(Reminder.objects.all().count(), 0)
 
+    @freeze_time('2020-03-02 10:00:00')
+    def test_generate_reminders(self):
+        def _set_meetings(pk, meeting_dates, draft=False):
+            sg = StudyGroup.objects.get(pk=pk)
+            sg.timezone = 'UTC'
+            sg.draft = draft
+            sg.start_date = meeting_dates[0]
+            sg.end_date = meeting_dates[-1]
+            sg.meeting_time = datetime.time(18, 0)
+            sg.save()
+            sg.meeting_set.all().delete()
+            for meeting_date in meeting_dates:
+                Meeting.objects.create(study_group=sg, meeting_date=meeting_date, meeting_time=sg.meeting_time)
+            return sg
+
+        # meets in 3 days
+        sg1 = _set_meetings(1, [datetime.date(2020, 2, 20), datetime.date(2020, 3, 5)])
+        # meets in 5 days
+        _set_meetings(2, [datetime.date(2020, 3, 7)])
+        # the next meeting already has a reminder, the one after doesn't
+        sg3 = _set_meetings(3, [datetime.date(2020, 3, 3), datetime.date(2020, 3, 4)])
+        generate_reminder(sg3)
+        self.assertEqual(Reminder.objects.count(), 1)
+        # draft
+        _set_meetings(4, [datetime.date(2020, 3, 4)], draft=True)
+        mail.outbox = []
+
+        generate_reminders()
+        self.assertEqual(Reminder.objects.count(), 2)
+        reminder = Reminder.objects.get(study_group=sg1)
+        self.assertEqual(reminder.study_group_meeting.meeting_date, datetime.date(2020, 3, 5))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [sg1.facilitator.email])
+
+        # the reminder isn't generated again
+        generate_reminders()
+        self.assertEqual(Reminder.objects.count(), 2)
+
     def test_generate_reminder_with_long_name_and_location(self):
         # Make sure we generate a reminder less than 4 days before
         now = timezone.now()
@@ -172,7 +216,7 @@ class TestStudyGroupTasks(TestCase):
         self.assertEqual(Reminder.objects.all().count(), 1)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_dont_send_automatic_reminder_for_old_message(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -223,7 +267,7 @@ class TestStudyGroupTasks(TestCase):
         self.assertEqual(Reminder.objects.filter(sent_at__isnull=True).count(), 1)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_automatic_reminder_email(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -261,7 +305,7 @@ class TestStudyGroupTasks(TestCase):
         self.assertIn("This is my feedback y'all", mail.outbox[1].alternatives[0][0])
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_malicious_reminder_email(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -299,7 +343,42 @@ class TestStudyGroupTasks(TestCase):
         self.assertIn('&lt;a href="https://evil.ink/"&gt;this awesome link&lt;/a&gt;', mail.outbox[1].alternatives[0][0])
 
 
-    @patch('studygroups.tasks.send_message')
+    def test_prerender_meeting_reminder(self):
+        now = timezone.now()
+        sg = StudyGroup.objects.get(pk=1)
+        sg.timezone = now.strftime("%Z")
+        sg.start_date = now - datetime.timedelta(days=5)
+        sg.meeting_time = sg.start_date.time()
+        sg.end_date = sg.start_date + datetime.timedelta(weeks=2)
+        sg.save()
+        sg = StudyGroup.objects.get(pk=1)
+        generate_all_meetings(sg)
+        generate_reminder(sg)
+        reminder = Reminder.objects.get()
+        reminder.email_body = 'See you <b>soon</b> & bring https://placeholder.invalid/ a pen'
+        context = {
+            "reminder": reminder,
+            "learning_circle": sg,
+            "facilitator_message": reminder.email_body,
+            "event_meta": True,
+        }
+        render_for_learner = prerender_email_templates(
+            'studygroups/email/learner_meeting_reminder', context, ['rsvp_yes_link', 'rsvp_no_link', 'unsubscribe_link']
+        )
+        for email in ['learner@example.net', 'learner+lc@example.net', "o'learner@example.net"]:
+            application = Application.objects.create(study_group=sg, name='Learner', email=email, accepted_at=now)
+            learner_context = {
+                "rsvp_yes_link": reminder.study_group_meeting.rsvp_yes_link(email),
+                "rsvp_no_link": reminder.study_group_meeting.rsvp_no_link(email),
+                "unsubscribe_link": application.unapply_link(),
+            }
+            self.assertEqual(
+                render_for_learner(learner_context),
+                render_email_templates('studygroups/email/learner_meeting_reminder', {**context, **learner_context})
+            )
+
+
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_learner_reminder_ics(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -331,7 +410,7 @@ class TestStudyGroupTasks(TestCase):
         self.assertIn('VEVENT', mail.outbox[1].attachments[0].get_payload())
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_custom_reminder_email(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -368,7 +447,7 @@ class TestStudyGroupTasks(TestCase):
         #self.assertIn('https://example.net/{0}/optout/confirm/?user='.format(get_language()), mail.outbox[0].body)
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_facilitator_reminder_email_links(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -400,7 +479,7 @@ class TestStudyGroupTasks(TestCase):
         self.assertNotIn('{0}/{1}/optout/confirm/?user='.format(settings.DOMAIN, get_language()), mail.outbox[1].alternatives[0][0])
 
 
-    @patch('studygroups.tasks.send_message')
+    @patch('studygroups.tasks.send_bulk_message')
     def test_send_reminder_sms(self, send_message):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -539,6 +618,10 @@ class TestStudyGroupTasks(TestCase):
             self.assertIn('mail2@example.net', mail.outbox[0].to + mail.outbox[1].to)
             a1 = Application.objects.get(email=mail.outbox[0].to[0])
             self.assertIn('{0}/en/studygroup/{1}/survey/?learner={2}'.format(settings.DOMAIN, sg.uuid, a1.uuid), mail.outbox[0].body)
+            # the survey is sent to every learner once, also by send_next_week_learner_surveys
+            send_learner_surveys(sg)
+            self.assertIsNone(send_learner_survey(a1))
+            self.assertEqual(len(mail.outbox), 2)
 
         mail.outbox = []
         # way too late
@@ -580,6 +663,55 @@ class TestStudyGroupTasks(TestCase):
             self.assertIn(sg.facilitator.email, mail.outbox[0].to)
 
 
+    def test_last_meeting_at(self):
+        sg = StudyGroup.objects.get(pk=1)
+        sg.timezone = 'US/Central'
+        sg.start_date = datetime.date(2010, 1, 1)
+        sg.meeting_time = datetime.time(18, 0)
+        sg.end_date = sg.start_date + datetime.timedelta(weeks=5)
+        sg.save()
+        sg.meeting_set.all().delete()
+        self.assertEqual(StudyGroup.objects.get(pk=1).last_meeting_at, None)
+
+        generate_all_meetings(sg)
+        expected = pytz.timezone('US/Central').localize(datetime.datetime(2010, 2, 5, 18, 0))
+        self.assertEqual(StudyGroup.objects.get(pk=1).last_meeting_at, expected)
+
+        last_meeting = sg.last_meeting()
+        last_meeting.delete()
+        expected = pytz.timezone('US/Central').localize(datetime.datetime(2010, 1, 29, 18, 0))
+        self.assertEqual(StudyGroup.objects.get(pk=1).last_meeting_at, expected)
+
+        sg = StudyGroup.objects.get(pk=1)
+        sg.timezone = 'Africa/Johannesburg'
+        sg.save()
+        expected = pytz.timezone('Africa/Johannesburg').localize(datetime.datetime(2010, 1, 29, 18, 0))
+        self.assertEqual(StudyGroup.objects.get(pk=1).last_meeting_at, expected)
+
+
+    def test_send_all_facilitator_surveys(self):
+        for pk in [1, 2]:
+            sg = StudyGroup.objects.get(pk=pk)
+            sg.timezone = 'UTC'
+            sg.start_date = datetime.date(2010, 1, 1)
+            sg.meeting_time = datetime.time(18, 0) if pk == 1 else datetime.time(20, 0)
+            sg.end_date = sg.start_date + datetime.timedelta(weeks=5)
+            sg.save()
+            sg.meeting_set.all().delete()
+            generate_all_meetings(sg)
+
+        with freeze_time("2010-02-05 17:30"):
+            due = scheduler.study_groups_due(scheduler.FACILITATOR_SURVEY_OFFSET)
+            self.assertEqual([sg.pk for sg in due], [1])
+            send_all_facilitator_surveys()
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertIn(StudyGroup.objects.get(pk=1).facilitator.email, mail.outbox[0].to)
+
+        with freeze_time("2010-02-12 20:30"):
+            due = scheduler.study_groups_due(scheduler.FINAL_REPORT_OFFSET)
+            self.assertEqual([sg.pk for sg in due], [2])
+
+
     def test_send_facilitator_learner_survey_prompt(self):
         now = timezone.now()
         sg = StudyGroup.objects.get(pk=1)
@@ -2,10 +2,10 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib.postgres.search import SearchQuery
-from django.contrib.postgres.search import SearchVector
 from django.core.files.storage import get_storage_class
 from django.db import models
-from django.db.models import Q, F, Case, When, Value, Sum, Min, Max, OuterRef, Subquery, Count
+from django.db.models import Q, F, Case, When, Value, Sum, Min, Max, Avg, OuterRef, Subquery, Exists, Count, Window
+from django.db.models.functions import Cast, Coalesce, Floor
 from django.views import View
 from django.views.generic.detail import SingleObjectMixin
 from django.urls import reverse
@@ -15,17 +15,19 @@ from django.utils.decorators import method_decorator
 from django.utils.text import slugify
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition
 from django.http import HttpResponseForbidden
 
-from collections import Counter
 import json
 import datetime
+import hashlib
 import re
 import pytz
 import logging
 
 from studygroups.decorators import user_is_group_facilitator
 from studygroups.decorators import user_is_team_organizer
+from studygroups.decorators import user_is_staff
 from studygroups.models import Course
 from studygroups.models import StudyGroup
 from studygroups.models import Application
@@ -36,12 +38,20 @@ from studygroups.models import TeamInvitation
 from studygroups.models import Announcement
 from studygroups.models import generate_all_meetings
 from studygroups.models import get_json_response
+from studygroups.models import get_landing_page_stats
 from studygroups.models.course import course_platform_from_url
+from studygroups.models.course import get_course_topic_counts
+from studygroups.models.course import get_learning_circle_topic_counts
 from studygroups.models.team import eligible_team_by_email_domain
 
-from uxhelpers.utils import json_response
+from surveys.models import LearnerSurveyResponse
+from uxhelpers.utils import json_response, json_value
 
-from api.geo import getLatLonDelta
+from api.instrumentation import get_stats
+from api.instrumentation import serializing
+from studygroups.email_helper import get_inline_stats
+from api.geo import getBoundingBoxQuery
+from api.geo import haversineDistance
 from api import schema
 from api.forms import ImageForm
 
@@ -99,7 +109,30 @@ class CustomSearchQuery(SearchQuery):
         return template, params
 
 
+def _count_subquery(queryset):
+    """ return a subquery counting rows in queryset related to the outer StudyGroup """
+    counts = queryset.filter(study_group=OuterRef('pk')).order_by().values('study_group').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+
+def _prepare_for_json(study_groups):
+    """ select related objects and annotate counts used by _map_to_json
+    so that serializing a list of learning circles doesn't require extra
+    queries per learning circle """
+    return study_groups.select_related('course', 'facilitator').annotate(
+        active_meeting_count=_count_subquery(Meeting.objects.active()),
+        application_count=_count_subquery(Application.objects.all()),
+    )
+
+
 def _map_to_json(sg):
+    if hasattr(sg, 'active_meeting_count'):
+        meeting_count = sg.active_meeting_count
+        signup_count = sg.application_count
+    else:
+        meeting_count = sg.meeting_set.active().count()
+        signup_count = sg.application_set.count()
+
     data = {
         "course": {
             "id": sg.course.pk,
@@ -118,31 +151,33 @@ def _map_to_json(sg):
         "region": sg.region,
         "country": sg.country,
         "country_en": sg.country_en,
-        "latitude": sg.latitude,
-        "longitude": sg.longitude,
+        "latitude": json_value(sg.latitude),
+        "longitude": json_value(sg.longitude),
         "place_id": sg.place_id,
         "language": sg.language,
         "day": sg.day(),
-        "start_date": sg.start_date,
-        "start_datetime": sg.local_start_date(),
-        "meeting_time": sg.meeting_time,
+        "start_date": json_value(sg.start_date),
+        "start_datetime": json_value(sg.local_start_date()),
+        "meeting_time": json_value(sg.meeting_time),
         "time_zone": sg.timezone_display(),
         "end_time": sg.end_time(),
-        "weeks": sg.weeks if sg.draft else sg.meeting_set.active().count(),
+        "weeks": sg.weeks if sg.draft else meeting_count,
         "url": f"{settings.PROTOCOL}://{settings.DOMAIN}" + reverse('studygroups_signup', args=(slugify(sg.venue_name, allow_unicode=True), sg.id,)),
         "report_url": sg.report_url(),
         "studygroup_path": reverse('studygroups_view_study_group', args=(sg.id,)),
         "draft": sg.draft,
-        "signup_count": sg.application_set.count()
+        "signup_count": signup_count
     }
 
     if sg.image:
         data["image_url"] = settings.PROTOCOL + '://' + settings.DOMAIN + sg.image.url
     # TODO else set default image URL
     if hasattr(sg, 'next_meeting_date'):
-        data["next_meeting_date"] = sg.next_meeting_date
+        data["next_meeting_date"] = json_value(sg.next_meeting_date)
     if hasattr(sg, 'last_meeting_date'):
-        data["last_meeting_date"] = sg.last_meeting_date
+        data["last_meeting_date"] = json_value(sg.last_meeting_date)
+    if hasattr(sg, 'distance_km'):
+        data["distance_km"] = round(sg.distance_km, 2)
     if sg.signup_question:
         data["signup_question"] = sg.signup_question
     return data
@@ -161,18 +196,60 @@ def _intCommaList(csv):
 
 
 def _limit_offset(request):
-    if 'offset' in request.GET or 'limit' in request.GET:
-        try:
-            offset = int(request.GET.get('offset', 0))
-        except ValueError as e:
-            offset = 0
-        try:
-            limit = int(request.GET.get('limit', 100))
-        except ValueError as e:
-            limit = 100
+    try:
+        offset = int(request.GET.get('offset', 0))
+    except ValueError as e:
+        offset = 0
+    try:
+        limit = int(request.GET.get('limit', 100))
+    except ValueError as e:
+        limit = 100
     return limit, offset
 
 
+def _paginate(request, queryset, keyset=None, prepare=None, count_queryset=None):
+    """ Return a dict with the count (and offset and limit if requested) and
+    the items for the requested page.
+
+    The total count is selected alongside the page using COUNT(*) OVER () to
+    avoid a separate query. If keyset is the name of the field the queryset
+    is ordered by, `after` can be used instead of `offset` to select the rows
+    following a given value without scanning over preceding rows.
+
+    prepare is applied to the queryset used to select the page, but not to
+    the queryset used for counting. If count_queryset is given it is counted
+    instead of queryset.
+    """
+    page = prepare(queryset) if prepare else queryset
+    use_keyset = keyset is not None and 'after' in request.GET
+    if not use_keyset and 'offset' not in request.GET and 'limit' not in request.GET:
+        items = list(page)
+        count = len(items) if count_queryset is None else count_queryset.count()
+        return {'count': count}, items
+
+    if count_queryset is None:
+        count_queryset = queryset
+    limit, offset = _limit_offset(request)
+    if use_keyset:
+        after = request.GET.get('after')
+        items = list(page.filter(**{f'{keyset}__gt': after})[:limit])
+        return {'count': count_queryset.count(), 'after': after, 'limit': limit}, items
+
+    if count_queryset is not queryset:
+        items = list(page[offset:offset+limit])
+        count = count_queryset.count()
+    else:
+        items = list(page.annotate(pagination_count=Window(expression=Count('pk')))[offset:offset+limit])
+        if len(items):
+            count = items[0].pagination_count
+        elif offset == 0:
+            count = 0
+        else:
+            # the page is past the end of the results
+            count = queryset.count()
+    return {'count': count, 'offset': offset, 'limit': limit}, items
+
+
 class LearningCircleListView(View):
     def get(self, request):
         query_schema = {
@@ -181,6 +258,7 @@ class LearningCircleListView(View):
             "distance": schema.floating_point(),
             "offset": schema.integer(),
             "limit": schema.integer(),
+            "after": schema.integer(),
             "weekdays": _intCommaList,
             "user": schema.boolean(),
             "scope": schema.text(),
@@ -228,21 +306,7 @@ class LearningCircleListView(View):
         q = request.GET.get('q', None)
         if q:
             tsquery = CustomSearchQuery(q, config='simple')
-            study_groups = study_groups.annotate(
-                search = SearchVector(
-                    'city',
-                    'name',
-                    'course__title',
-                    'course__provider',
-                    'course__topics',
-                    'venue_name',
-                    'venue_address',
-                    'venue_details',
-                    'facilitator__first_name',
-                    'facilitator__last_name',
-                    config='simple'
-                )
-            ).filter(search=tsquery)
+            study_groups = study_groups.filter(search_vector=tsquery)
 
         if 'course_id' in request.GET:
             study_groups = study_groups.filter(
@@ -274,26 +338,22 @@ class LearningCircleListView(View):
             else:
                 study_groups = study_groups.exclude(id__in=study_group_ids)
 
+        keyset = 'id'
         if 'latitude' in request.GET and 'longitude' in request.GET:
             # work with floats for ease
             latitude = float(request.GET.get('latitude'))
             longitude = float(request.GET.get('longitude'))
             distance = float(request.GET.get('distance', False) or 50)
-            lat_delta, lon_delta = getLatLonDelta(latitude, longitude, distance)
-            lat_min = max(-90, latitude - lat_delta)
-            lat_max = min(90, latitude + lat_delta)
-            lon_min = max(-180, longitude - lon_delta)
-            lon_max = min(180, longitude + lon_delta)
-            # NOTE doesn't wrap around,
-            # iow, something at lat=45, lon=-189 and distance=1000 won't match
-            # lat=45, lon=189 even though they are only 222 km apart.
+            # use the (indexed) bounding box to select candidates before
+            # calculating the actual distance
             study_groups = study_groups.filter(
-                latitude__gte=lat_min,
-                latitude__lte=lat_max,
-                longitude__gte=lon_min,
-                longitude__lte=lon_max
-            )
-            # NOTE could use haversine approximation to filter more accurately
+                getBoundingBoxQuery(latitude, longitude, distance)
+            ).annotate(
+                distance_km=haversineDistance(latitude, longitude)
+            ).filter(
+                distance_km__lte=distance
+            ).order_by('distance_km', 'id')
+            keyset = None
 
         if 'topics' in request.GET:
             topics = request.GET.get('topics').split(',')
@@ -312,69 +372,168 @@ class LearningCircleListView(View):
                 query = query | Q(start_date__week_day=weekday) if query else Q(start_date__week_day=weekday)
             study_groups = study_groups.filter(query)
 
-        data = {
-            'count': len(study_groups)
-        }
-
-        if 'offset' in request.GET or 'limit' in request.GET:
-            limit, offset = _limit_offset(request)
-            data['offset'] = offset
-            data['limit'] = limit
-            study_groups = study_groups[offset:offset+limit]
-
-        data['items'] = [ _map_to_json(sg) for sg in study_groups ]
+        data, study_groups = _paginate(request, study_groups, keyset=keyset, prepare=_prepare_for_json)
+        with serializing(request):
+            data['items'] = [ _map_to_json(sg) for sg in study_groups ]
         return json_response(request, data)
 
 
 class LearningCircleTopicListView(View):
     """ Return topics for listed courses """
     def get(self, request):
-        study_group_ids = Meeting.objects.active().filter(
-            meeting_date__gte=timezone.now()
-        ).values('study_group')
-        course_ids = None
-        course_ids = StudyGroup.objects.published().filter(id__in=study_group_ids).values('course')
-
-        topics = Course.objects.active()\
-            .filter(unlisted=False)\
-            .filter(id__in=course_ids)\
-            .exclude(topics='')\
-            .values_list('topics')
-        topics = [
-            item.strip().lower() for sublist in topics for item in sublist[0].split(',')
-        ]
         data = {}
-        data['topics'] = { k: v for k, v in list(Counter(topics).items()) }
+        data['topics'] = get_learning_circle_topic_counts()
         return json_response(request, data)
 
 
 def _studygroup_object_for_map(sg):
     active = sg.end_date > datetime.date.today()
-    report_available = sg.learnersurveyresponse_set.count() > 0
 
     data = {
         "id": sg.id,
         "title": sg.name,
-        "latitude": sg.latitude,
-        "longitude": sg.longitude,
+        "latitude": json_value(sg.latitude),
+        "longitude": json_value(sg.longitude),
         "city": sg.city,
-        "start_date": sg.start_date,
+        "start_date": json_value(sg.start_date),
         "active": active
     }
 
     if active:
         data["url"] = settings.PROTOCOL + '://' + settings.DOMAIN + reverse('studygroups_signup', args=(slugify(sg.venue_name, allow_unicode=True), sg.id,))
-    elif report_available:
+    elif sg.report_available:
         data["report_url"] = sg.report_url()
 
     return data
 
 
+def _parse_bbox(value):
+    """ parse min_lon,min_lat,max_lon,max_lat """
+    if not value:
+        return None, None
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in value.split(',')]
+    except ValueError:
+        return None, 'Must be 4 numbers separated by commas: min_lon,min_lat,max_lon,max_lat'
+    return (min_lon, min_lat, max_lon, max_lat), None
+
+
+def _map_feed_version(request):
+    """ return the latest change to the data shown on the map """
+    if not hasattr(request, '_map_feed_version'):
+        latest_update = StudyGroup.objects.aggregate(Max('updated_at'))['updated_at__max']
+        latest_response = LearnerSurveyResponse.objects.aggregate(Max('id'))['id__max']
+        # whether a learning circle is active depends on the current date
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        request._map_feed_version = (max(filter(None, [latest_update, today])), latest_response, today)
+    return request._map_feed_version
+
+
+def _map_feed_etag(request, *args, **kwargs):
+    query = sorted(request.GET.lists())
+    version = '{}:{}'.format(_map_feed_version(request), query)
+    return hashlib.md5(version.encode('utf-8')).hexdigest()
+
+
+def _map_feed_last_modified(request, *args, **kwargs):
+    return _map_feed_version(request)[0]
+
+
 class LearningCirclesMapView(View):
+    """ Return published learning circles to display on a map
+
+    With format=columnar, parallel arrays are returned instead of a list of
+    objects, and learning circles without a location are excluded. flags is a
+    bitmask of MAP_FLAG_ACTIVE and MAP_FLAG_REPORT_AVAILABLE. With zoom,
+    learning circles are grouped in a grid suitable for the zoom level and
+    clusters are returned with the number of learning circles in each cluster.
+    bbox=min_lon,min_lat,max_lon,max_lat limits results to an area.
+    """
+    MAP_FLAG_ACTIVE = 1
+    MAP_FLAG_REPORT_AVAILABLE = 2
+    MAP_STREAM_THRESHOLD = 1000
+
+    @method_decorator(condition(etag_func=_map_feed_etag, last_modified_func=_map_feed_last_modified))
     def get(self, request):
-        study_groups = StudyGroup.objects.published().select_related('course').prefetch_related("learnersurveyresponse_set")
-        data = {}
-        data['items'] = [ _studygroup_object_for_map(sg) for sg in study_groups ]
+        query_schema = {
+            "format": lambda v: (v, None) if v in ['columnar', None] else (None, "must be 'columnar'"),
+            "bbox": _parse_bbox,
+            "zoom": schema.integer(),
+        }
+        data = schema.django_get_to_dict(request.GET)
+        clean_data, errors = schema.validate(query_schema, data)
+        if errors != {}:
+            return json_response(request, {"status": "error", "errors": errors})
+
+        reports = LearnerSurveyResponse.objects.filter(study_group=OuterRef('pk'))
+        study_groups = StudyGroup.objects.published().annotate(report_available=Exists(reports))
+
+        if clean_data.get('bbox'):
+            min_lon, min_lat, max_lon, max_lat = clean_data.get('bbox')
+            study_groups = study_groups.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+            if min_lon <= max_lon:
+                study_groups = study_groups.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+            else:
+                # bbox crosses the antimeridian
+                study_groups = study_groups.filter(Q(longitude__gte=min_lon) | Q(longitude__lte=max_lon))
+
+        if clean_data.get('format') != 'columnar':
+            study_groups = list(study_groups)
+            data = {}
+            data['items'] = ( _studygroup_object_for_map(sg) for sg in study_groups )
+            # encode large responses while they are sent
+            if len(study_groups) > self.MAP_STREAM_THRESHOLD:
+                return json_response(request, data, stream=True)
+            with serializing(request):
+                data['items'] = list(data['items'])
+            return json_response(request, data)
+
+        study_groups = study_groups.filter(latitude__isnull=False, longitude__isnull=False)
+        today = datetime.date.today()
+        flags = Case(
+            When(end_date__gt=today, then=Value(self.MAP_FLAG_ACTIVE)),
+            default=Value(0), output_field=models.IntegerField()
+        ) + Case(
+            When(report_available=True, then=Value(self.MAP_FLAG_REPORT_AVAILABLE)),
+            default=Value(0), output_field=models.IntegerField()
+        )
+
+        zoom = clean_data.get('zoom')
+        if zoom is None:
+            rows = study_groups.annotate(flags=flags).order_by('id').values_list('id', 'latitude', 'longitude', 'flags')
+            ids, latitudes, longitudes, flag_values = zip(*rows) if rows else ([], [], [], [])
+            data = {
+                "count": len(ids),
+                "id": ids,
+                "latitude": [float(lat) for lat in latitudes],
+                "longitude": [float(lon) for lon in longitudes],
+                "flags": flag_values,
+            }
+            return json_response(request, data)
+
+        # divide the world in cells of 64x64 pixels at the given zoom level for 256 pixel tiles
+        cell_size = 360.0 / (2**min(max(zoom, 0), 20) * 4)
+        clusters = study_groups.annotate(
+            cell_lat=Floor(Cast('latitude', models.FloatField()) / cell_size),
+            cell_lon=Floor(Cast('longitude', models.FloatField()) / cell_size),
+        ).values('cell_lat', 'cell_lon').annotate(
+            cluster_size=Count('id'),
+            cluster_id=Min('id'),
+            cluster_latitude=Avg('latitude'),
+            cluster_longitude=Avg('longitude'),
+            cluster_active=Sum(Case(When(end_date__gt=today, then=Value(1)), default=Value(0), output_field=models.IntegerField())),
+        ).order_by('cell_lat', 'cell_lon')
+        clusters = list(clusters)
+        data = {
+            "count": len(clusters),
+            "zoom": zoom,
+            # id of the learning circle for clusters with only one learning circle
+            "id": [ c['cluster_id'] if c['cluster_size'] == 1 else None for c in clusters ],
+            "latitude": [ round(float(c['cluster_latitude']), 6) for c in clusters ],
+            "longitude": [ round(float(c['cluster_longitude']), 6) for c in clusters ],
+            "size": [ c['cluster_size'] for c in clusters ],
+            "active": [ c['cluster_active'] for c in clusters ],
+        }
         return json_response(request, data)
 
 
@@ -402,7 +561,7 @@ def _course_to_json(course):
         "course_page_url": settings.PROTOCOL + '://' + settings.DOMAIN + reverse("studygroups_course_page", args=(course.id,)),
         "course_page_path": reverse("studygroups_course_page", args=(course.id,)),
         "course_edit_path": reverse("studygroups_course_edit", args=(course.id,)),
-        "created_at": course.created_at,
+        "created_at": json_value(course.created_at),
         "unlisted": course.unlisted,
         "discourse_topic_url": course.discourse_topic_url if course.discourse_topic_url else settings.PROTOCOL + '://' + settings.DOMAIN + reverse("studygroups_generate_course_discourse_topic", args=(course.id,)),
     }
@@ -474,9 +633,7 @@ class CourseListView(View):
         query = request.GET.get('q', None)
         if query:
             tsquery = CustomSearchQuery(query, config='simple')
-            courses = courses.annotate(
-                search=SearchVector('topics', 'title', 'caption', 'provider', config='simple')
-            ).filter(search=tsquery)
+            courses = courses.filter(search_vector=tsquery)
 
         if 'topics' in request.GET:
             topics = request.GET.get('topics').split(',')
@@ -504,32 +661,17 @@ class CourseListView(View):
                 course_ids = StudyGroup.objects.published().exclude(id__in=study_group_ids).values('course')
             courses = courses.filter(id__in=course_ids)
 
-        data = {
-            'count': courses.count()
-        }
-        if 'offset' in request.GET or 'limit' in request.GET:
-            limit, offset = _limit_offset(request)
-            data['offset'] = offset
-            data['limit'] = limit
-            courses = courses[offset:offset+limit]
-
-        data['items'] = [ _course_to_json(course) for course in courses ]
+        data, courses = _paginate(request, courses)
+        with serializing(request):
+            data['items'] = [ _course_to_json(course) for course in courses ]
         return json_response(request, data)
 
 
 class CourseTopicListView(View):
     """ Return topics for listed courses """
     def get(self, request):
-        topics = Course.objects.active()\
-                .filter(unlisted=False)\
-                .exclude(topics='')\
-                .values_list('topics')
-        topics = [
-            item.strip().lower() for sublist in topics for item in sublist[0].split(',')
-        ]
-        from collections import Counter
         data = {}
-        data['topics'] = { k: v for k, v in list(Counter(topics).items()) }
+        data['topics'] = get_course_topic_counts()
         return json_response(request, data)
 
 
@@ -818,7 +960,7 @@ class LandingPageLearningCirclesView(View):
         if errors != {}:
             return json_response(request, {"status": "error", "errors": errors})
 
-        study_groups_unsliced = StudyGroup.objects.published()
+        study_groups_unsliced = _prepare_for_json(StudyGroup.objects.published())
 
         if 'scope' in request.GET and request.GET.get('scope') == "team":
             user = request.user
@@ -846,42 +988,31 @@ class LandingPageLearningCirclesView(View):
                 next_meeting_date=Max('meeting__meeting_date')
             ).order_by('-next_meeting_date')
             study_groups = list(study_groups) + list(past_study_groups[:3-study_groups.count()])
-        data = {
-            'items': [ _map_to_json(sg) for sg in study_groups ]
-        }
+        with serializing(request):
+            data = {
+                'items': [ _map_to_json(sg) for sg in study_groups ]
+            }
         return json_response(request, data)
 
 
 class LandingPageStatsView(View):
     """ Return stats for the landing page """
-    """
-    - Number of active learning circles
-    - Number of cities where learning circle happened
-    - Number of facilitators who ran at least 1 learning circle
-    - Number of learning circles to date
-    """
+    """ Stats are served from a snapshot, staff can use ?fresh=1 to update the snapshot """
     def get(self, request):
-        study_groups = StudyGroup.objects.published().filter(
-            meeting__meeting_date__gte=timezone.now()
-        ).annotate(
-            next_meeting_date=Min('meeting__meeting_date')
-        )
-        cities = StudyGroup.objects.published().filter(
-            latitude__isnull=False,
-            longitude__isnull=False,
-        ).distinct('city').values('city')
-        learning_circle_count = StudyGroup.objects.published().count()
-        facilitators = StudyGroup.objects.active().distinct('facilitator').values('facilitator')
-        cities_s = list(set([c['city'].split(',')[0].strip() for c in cities]))
-        data = {
-            "active_learning_circles": study_groups.count(),
-            "cities": len(cities_s),
-            "facilitators": facilitators.count(),
-            "learning_circle_count": learning_circle_count
-        }
+        fresh = 'fresh' in request.GET and request.user.is_staff
+        data, snapshot_at = get_landing_page_stats(fresh=fresh)
+        data["snapshot_at"] = snapshot_at
         return json_response(request, data)
 
 
+@method_decorator(user_is_staff, name='dispatch')
+class InstrumentationStatsView(View):
+    """ Return query counts, timings and response sizes for recent API requests
+    to this process and the time spent inlining CSS in emails """
+    def get(self, request):
+        return json_response(request, {"views": get_stats(), "email_inlining": get_inline_stats()})
+
+
 class ImageUploadView(View):
     def post(self, request):
         form = ImageForm(request.POST, request.FILES)
@@ -921,21 +1052,16 @@ class FinalReportListView(View):
         today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
         studygroups = StudyGroup.objects.published().annotate(surveys=Count('learnersurveyresponse')).filter(surveys__gt=0, end_date__lt=today).order_by('-end_date')
 
-        data = {}
-
-        if 'offset' in request.GET or 'limit' in request.GET:
-            limit, offset = _limit_offset(request)
-            data['offset'] = offset
-            data['limit'] = limit
-            studygroups = studygroups[offset:offset+limit]
+        data, studygroups = _paginate(request, studygroups, prepare=_prepare_for_json)
 
         def _map(sg):
             data = _map_to_json(sg)
             if request.user.is_authenticated:
-                data['signup_count'] = sg.application_set.count()
+                data['signup_count'] = sg.application_count
             return data
 
-        data['items'] = [ _map(sg) for sg in studygroups ]
+        with serializing(request):
+            data['items'] = [ _map(sg) for sg in studygroups ]
 
         return json_response(request, data)
 
@@ -1015,23 +1141,16 @@ def serialize_team_data(team):
 
 class TeamListView(View):
     def get(self, request):
-        data = {}
-
         teams = Team.objects.all().order_by('name')
-
-        data["count"] = teams.count()
+        # the count includes teams without an image
+        all_teams = teams
 
         if 'image' in request.GET and request.GET.get('image') == "true":
             teams = teams.exclude(page_image="")
 
-
-        if 'offset' in request.GET or 'limit' in request.GET:
-            limit, offset = _limit_offset(request)
-            data['offset'] = offset
-            data['limit'] = limit
-            teams = teams[offset:offset+limit]
-
-        data['items'] = [ serialize_team_data(team) for team in teams ]
+        data, teams = _paginate(request, teams, count_queryset=all_teams)
+        with serializing(request):
+            data['items'] = [ serialize_team_data(team) for team in teams ]
 
         return json_response(request, data)
 
@@ -13,8 +13,7 @@ from studygroups.models import community_digest_data
 from studygroups.models import stats_dash_data
 from studygroups import charts
 
-from surveys.models import FacilitatorSurveyResponse
-from surveys.models import facilitator_survey_summary
+from surveys.models import FacilitatorSurveySummary
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -49,7 +48,15 @@ class StudyGroupFinalReport(TemplateView):
 
             return context
 
-        goals_met_chart = charts.GoalsMetChart(study_group)
+        chart_functions = {
+            'goals_chart': charts.goals_chart,
+            'goals_met_chart': lambda study_group: charts.GoalsMetChart(study_group).generate(),
+            'topic_confidence_chart': charts.topic_confidence_chart,
+            'next_steps_chart': charts.next_steps_chart,
+            'attendance_chart': charts.attendance_chart,
+            'recommendation_chart': charts.recommendation_chart,
+            'recommendation_reasons_chart': charts.recommendation_reasons_chart,
+        }
 
         context = {
             'study_group': study_group,
@@ -57,14 +64,9 @@ class StudyGroupFinalReport(TemplateView):
             'registrations': study_group.application_set.active().count(),
             'learner_survey_responses': study_group.learnersurveyresponse_set.count(),
             'facilitator_survey_responses': study_group.facilitatorsurveyresponse_set.count(),
-            'goals_chart': charts.goals_chart(study_group),
-            'goals_met_chart': goals_met_chart.generate(),
-            'topic_confidence_chart': charts.topic_confidence_chart(study_group),
-            'next_steps_chart': charts.next_steps_chart(study_group),
-            'attendance_chart': charts.attendance_chart(study_group),
-            'recommendation_chart': charts.recommendation_chart(study_group),
-            'recommendation_reasons_chart': charts.recommendation_reasons_chart(study_group),
         }
+        for name, chart_function in chart_functions.items():
+            context[name] = charts.cached_chart(name, study_group.pk, lambda: chart_function(study_group))
         return context
 
 
@@ -92,11 +94,10 @@ class CommunityDigestView(TemplateView):
 
 
 def get_low_rated_courses():
-    survey_responses = FacilitatorSurveyResponse.objects.filter(study_group__isnull=False, study_group__course__unlisted=False)
-    
-    survey_responses = [(r.study_group.course, facilitator_survey_summary(r)) for r in survey_responses]
-    low_rated_courses = [(c, r.get('course_rating')) for c, r in survey_responses if r.get('course_rating', 99) < 3 ]
-    return low_rated_courses
+    summaries = FacilitatorSurveySummary.objects.filter(
+        study_group__isnull=False, course__unlisted=False, course_rating__lt=3
+    ).select_related('course').order_by('response')
+    return [(summary.course, summary.course_rating) for summary in summaries]
 
 
 @method_decorator(user_is_staff, name='dispatch')
@@ -133,16 +134,22 @@ class StatsDashView(FormView):
         # but importing surveys.models into studygroups.models creates a circular dependency :(
         low_rated_courses = get_low_rated_courses()
 
+        chart_classes = {
+            "meetings_over_time_chart": lambda: charts.MeetingsOverTimeChart(start_time, end_time),
+            "facilitator_rating_percentage_chart" : lambda: charts.FacilitatorRatingOverTimeChart(start_time, end_time, data["studygroups_that_ended"]),
+            "studygroups_by_country_chart": lambda: charts.StudygroupsByCountryOverTimeChart(start_time, end_time, data["studygroups_that_ended"]),
+            "facilitator_course_approval_chart" : lambda: charts.FacilitatorCourseApprovalChart(start_time, end_time, data["studygroups_that_ended"]),
+            "learner_course_approval_chart" : lambda: charts.LearnerCourseApprovalChart(start_time, end_time, data["studygroups_that_ended"]),
+            "facilitator_experience_chart" : lambda: charts.FacilitatorExperienceChart(start_time, end_time, data["studygroups_that_met"]),
+            "participants_over_time_chart" : lambda: charts.ParticipantsOverTimeChart(start_time, end_time, data["studygroups_that_met"]),
+            "learner_goal_reached_chart" : lambda: charts.LearnerGoalReachedChart(start_time, end_time, data["studygroups_that_ended"]),
+            "learner_response_rate_chart" : lambda: charts.LearnerResponseRateChart(start_time, end_time, data["studygroups_that_ended"]),
+        }
+        # like the API ETags, the charts for the current date range are cached for the day
+        chart_params = (start_time.date(), end_time.date(), team_id)
         chart_data = {
-            "meetings_over_time_chart": charts.MeetingsOverTimeChart(start_time, end_time).generate(),
-            "facilitator_rating_percentage_chart" : charts.FacilitatorRatingOverTimeChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
-            "studygroups_by_country_chart": charts.StudygroupsByCountryOverTimeChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
-            "facilitator_course_approval_chart" : charts.FacilitatorCourseApprovalChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
-            "learner_course_approval_chart" : charts.LearnerCourseApprovalChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
-            "facilitator_experience_chart" : charts.FacilitatorExperienceChart(start_time, end_time, data["studygroups_that_met"]).generate(),
-            "participants_over_time_chart" : charts.ParticipantsOverTimeChart(start_time, end_time, data["studygroups_that_met"]).generate(),
-            "learner_goal_reached_chart" : charts.LearnerGoalReachedChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
-            "learner_response_rate_chart" : charts.LearnerResponseRateChart(start_time, end_time, data["studygroups_that_ended"]).generate(),
+            name: charts.cached_chart(name, chart_params, lambda: get_chart().generate())
+            for name, get_chart in chart_classes.items()
         }
 
         context.update(data)
@@ -1,29 +1,108 @@
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count
 
-from .models import FacilitatorSurveyResponse
-from .models import LearnerSurveyResponse
+from .models import LearnerSurveySummary
+from .models import FacilitatorSurveySummary
 from .models import MAX_STAR_RATING
+from .models import SUMMARY_MODELS
+from .models import save_survey_summaries
 
-from studygroups.models import StudyGroup
-from .models import learner_survey_summary
-from .models import facilitator_survey_summary
+from studygroups.models import Course
+from api.cache import invalidate_model_version
 
+from collections import Counter
+from collections import defaultdict
 import json
 
-def calculate_course_ratings(course):
-    studygroup_ids = StudyGroup.objects.filter(course=course.id).distinct().values_list("id", flat=True)
-    learner_surveys = LearnerSurveyResponse.objects.filter(study_group__in=studygroup_ids)
-    facilitator_surveys = FacilitatorSurveyResponse.objects.filter(study_group__in=studygroup_ids)
-
-    all_surveys = list(map(learner_survey_summary, learner_surveys))
-    all_surveys += list(map(facilitator_survey_summary, facilitator_surveys))
-    ratings = [s.get('course_rating') for s in all_surveys if s.get('course_rating')]
-    step_counts = { i: sum(1 for x in ratings if x == i) for i in range(1,6) }
-    ratings_sum = sum(ratings)
-    total_ratings = len(ratings)
+RATING_FIELDS = ['overall_rating', 'total_ratings', 'rating_step_counts']
+
+
+def _set_course_ratings(course, step_counts):
+    """ set the rating fields of course from the number of ratings for every step """
+    step_counts = { i: step_counts.get(i, 0) for i in range(1, MAX_STAR_RATING + 1) }
+    ratings_sum = sum(step*count for step, count in step_counts.items())
+    total_ratings = sum(step_counts.values())
     overall_rating = round(ratings_sum / total_ratings, 2) if total_ratings > 0 else 0
 
     course.rating_step_counts = json.dumps(step_counts)
     course.overall_rating = overall_rating
     course.total_ratings = total_ratings
+
+
+def _count_course_ratings(**filters):
+    """ return a Counter of ratings for every course, counted by the database """
+    counts = defaultdict(Counter)
+    for model in [LearnerSurveySummary, FacilitatorSurveySummary]:
+        rows = model.objects.filter(
+            course__isnull=False, course_rating__gte=1, course_rating__lte=MAX_STAR_RATING, **filters
+        ).order_by().values('course', 'course_rating').annotate(count=Count('id'))
+        for row in rows:
+            counts[row['course']][row['course_rating']] += row['count']
+    return counts
+
+
+def calculate_course_ratings(course):
+    step_counts = _count_course_ratings(course=course)[course.pk]
+    _set_course_ratings(course, step_counts)
     course.save()
+
+
+def calculate_all_course_ratings():
+    """ recalculate the ratings of all courses from the survey summaries with
+    one grouped query and return the number of courses that changed """
+    counts = _count_course_ratings()
+    courses = []
+    for course in Course.objects.only('id', *RATING_FIELDS):
+        ratings = [getattr(course, field) for field in RATING_FIELDS]
+        _set_course_ratings(course, counts.get(course.pk, {}))
+        if ratings != [getattr(course, field) for field in RATING_FIELDS]:
+            courses.append(course)
+    Course.objects.bulk_update(courses, RATING_FIELDS, batch_size=500)
+    if courses:
+        invalidate_model_version(Course)
+    return len(courses)
+
+
+def add_course_ratings(rating_changes):
+    """ add rating_changes, a Counter with the change in the number of ratings
+    for every (course_id, rating), to the stored ratings of the courses. Every
+    course is locked while it is updated """
+    course_changes = defaultdict(Counter)
+    for (course_id, rating), count in rating_changes.items():
+        if course_id and rating in range(1, MAX_STAR_RATING + 1) and count:
+            course_changes[course_id][rating] += count
+
+    for course_id, changes in sorted(course_changes.items()):
+        with transaction.atomic():
+            course = Course.objects.select_for_update().only('id', *RATING_FIELDS).filter(pk=course_id).first()
+            if not course:
+                continue
+            step_counts = Counter({int(step): count for step, count in json.loads(course.rating_step_counts).items()})
+            step_counts.update(changes)
+            _set_course_ratings(course, step_counts)
+            # update() doesn't send post_save, the ratings don't change the
+            # search vector or the topics of the course
+            Course.objects.filter(pk=course_id).update(**{field: getattr(course, field) for field in RATING_FIELDS})
+    if course_changes:
+        invalidate_model_version(Course)
+
+
+def save_survey_summaries_and_ratings(survey_responses):
+    """ save the summaries of survey_responses and add the change in their
+    course ratings to the ratings of the courses. The responses are locked
+    while their summaries are replaced, so concurrent saves of the same
+    response don't count the change twice """
+    rating_changes = Counter()
+    with transaction.atomic():
+        for model, summary_model in SUMMARY_MODELS.items():
+            response_ids = [survey_response.pk for survey_response in survey_responses if isinstance(survey_response, model)]
+            if response_ids:
+                # lock the responses before reading the summaries that will be replaced
+                list(model.objects.select_for_update().filter(pk__in=response_ids).order_by('pk').values_list('pk', flat=True))
+                # summaries that will be replaced
+                rating_changes.subtract(summary_model.objects.filter(response__in=response_ids).values_list('course_id', 'course_rating'))
+        summaries = save_survey_summaries(survey_responses)
+        rating_changes.update((summary.course_id, summary.course_rating) for summary in summaries)
+        add_course_ratings(rating_changes)
+    return summaries
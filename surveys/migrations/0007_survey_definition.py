@@ -0,0 +1,85 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+import hashlib
+
+
+def create_survey_definitions(apps, schema_editor):
+    SurveyDefinition = apps.get_model("surveys", "SurveyDefinition")
+    for model_name in ["FacilitatorSurveyResponse", "LearnerSurveyResponse"]:
+        SurveyResponse = apps.get_model("surveys", model_name)
+        response_ids = defaultdict(list)
+        for resp in SurveyResponse.objects.only('id', 'form_id', 'survey').iterator():
+            survey_hash = hashlib.md5(resp.survey.encode('utf-8')).hexdigest()
+            if (resp.form_id, survey_hash) not in response_ids:
+                SurveyDefinition.objects.get_or_create(
+                    form_id=resp.form_id, survey_hash=survey_hash, defaults={'survey': resp.survey}
+                )
+            response_ids[(resp.form_id, survey_hash)].append(resp.pk)
+
+        for (form_id, survey_hash), ids in response_ids.items():
+            definition = SurveyDefinition.objects.get(form_id=form_id, survey_hash=survey_hash)
+            SurveyResponse.objects.filter(pk__in=ids).update(definition=definition)
+
+
+def copy_survey_definitions(apps, schema_editor):
+    SurveyDefinition = apps.get_model("surveys", "SurveyDefinition")
+    for definition in SurveyDefinition.objects.all():
+        for model_name in ["FacilitatorSurveyResponse", "LearnerSurveyResponse"]:
+            SurveyResponse = apps.get_model("surveys", model_name)
+            SurveyResponse.objects.filter(definition=definition).update(survey=definition.survey)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0006_auto_20200302_1350'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyDefinition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('form_id', models.CharField(max_length=12)),
+                ('survey_hash', models.CharField(max_length=32)),
+                ('survey', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('form_id', 'survey_hash')},
+            },
+        ),
+        migrations.AddField(
+            model_name='facilitatorsurveyresponse',
+            name='definition',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='surveys.SurveyDefinition'),
+        ),
+        migrations.AddField(
+            model_name='learnersurveyresponse',
+            name='definition',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='surveys.SurveyDefinition'),
+        ),
+        migrations.RunPython(create_survey_definitions, copy_survey_definitions),
+        # the default is used when the field is added back to existing rows
+        migrations.AlterField(
+            model_name='facilitatorsurveyresponse',
+            name='survey',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='learnersurveyresponse',
+            name='survey',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='facilitatorsurveyresponse',
+            name='survey',
+        ),
+        migrations.RemoveField(
+            model_name='learnersurveyresponse',
+            name='survey',
+        ),
+    ]
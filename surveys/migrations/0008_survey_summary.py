@@ -0,0 +1,193 @@
+# Generated by Django 2.2.13 on 2026-10-18 10:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+# the parsing below is a copy of surveys.models at the time of this migration,
+# migrations must not depend on the current models
+
+MAX_STAR_RATING = 5
+
+
+def _get_answer_value(answer):
+    type_ = answer.get('type')
+    value = answer.get(type_)
+    if type_ == 'choice':
+        value = value.get('label')
+    return value
+
+
+def _text_value(value):
+    if isinstance(value, dict):
+        return ', '.join(value.get('labels', []))
+    return None if value is None else str(value)
+
+
+def _int_value(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_answers(response):
+    try:
+        response = json.loads(response)
+    except ValueError:
+        return []
+    if not isinstance(response, dict):
+        return []
+    return response.get('answers') or []
+
+
+def _values_by_ref(answers):
+    values = {}
+    for answer in answers:
+        values.setdefault(answer['field'].get('ref'), _get_answer_value(answer))
+    return values
+
+
+def parse_learner_survey_summary(form_id, answers, survey):
+    values = _values_by_ref(answers)
+    if form_id == settings.TYPEFORM_LEARNER_SURVEY_FORM:
+        return {
+            'goal': _text_value(values.get('goal')),
+            'goal_rating': _int_value(values.get('goal_rating_alt')),
+            'goal_extra': _text_value(values.get('goal_extra')),
+            'subject_confidence': _int_value(values.get('subject_confidence')),
+            'next_steps': _text_value(values.get('next_steps')),
+            'course_rating': _int_value(values.get('course_rating')),
+            'course_rating_reason': _text_value(values.get('course_rating_reason')),
+            'recommendation_rating': _int_value(values.get('recommendation_rating')),
+            'recommendation_rating_reason': _text_value(values.get('recommendation_rating_reason')),
+        }
+
+    goal_rating = values.get('06677105-57d8-4b18-99d7-02f77165cca8')
+    if not goal_rating:
+        goal_rating = values.get('47b94cfa-13fe-430d-b1d0-2414beedd865')
+    return {
+        'goal': _text_value(values.get('1929769b-dc20-4cd6-a849-c07ddd780456')),
+        'goal_rating': _int_value(goal_rating),
+        'next_steps': _text_value(values.get('3fa8908a-665d-4dfe-9d77-26a76294a253')),
+        'course_rating': _int_value(values.get('d8915ce4-0116-4469-b240-80e11fb4e362')),
+    }
+
+
+def _old_facilitator_course_rating(answers, survey):
+    rating_answer = next((answer for answer in answers if answer['field'].get('id') == 'Zm9XlzKGKC66'), None)
+    if not rating_answer or 'number' not in rating_answer:
+        return None
+    rating_question = next((field for field in survey.get('fields', []) if field['id'] == 'Zm9XlzKGKC66'), None)
+    facilitator_rating = rating_answer['number']
+    if rating_question and 'properties' in rating_question:
+        facilitator_steps = rating_question['properties']['steps']
+        if facilitator_steps != MAX_STAR_RATING:
+            facilitator_rating = round(facilitator_rating/facilitator_steps * MAX_STAR_RATING)
+        return facilitator_rating
+    if facilitator_rating > MAX_STAR_RATING:
+        return None
+    return facilitator_rating
+
+
+def parse_facilitator_survey_summary(form_id, answers, survey):
+    values = _values_by_ref(answers)
+    summary = {
+        'attendance_1': _int_value(values.get('attendance_1_alt')),
+        'attendance_2': _int_value(values.get('attendance_2_alt')),
+        'attendance_n': _int_value(values.get('attendance_n_alt')),
+    }
+    if form_id == settings.TYPEFORM_FACILITATOR_SURVEY_FORM:
+        goal_rating = values.get('goal_rating_alt')
+        if not goal_rating:
+            goal_rating = values.get('goal_rating_alt_2')
+        summary.update({
+            'goal': _text_value(values.get('goal_alt')),
+            'goal_rating': _int_value(goal_rating),
+            'surprise': _text_value(values.get('surprise')),
+            'stories': _text_value(values.get('stories')),
+            'course_rating': _int_value(values.get('course_rating')),
+            'course_rating_reason': _text_value(values.get('course_rating_reason')),
+            'recommendation_rating': _int_value(values.get('recommendation_rating')),
+            'recommendation_rating_reason': _text_value(values.get('recommendation_rating_reason')),
+        })
+    else:
+        summary['course_rating'] = _int_value(_old_facilitator_course_rating(answers, survey))
+    return summary
+
+
+def create_survey_summaries(apps, schema_editor):
+    SurveyDefinition = apps.get_model("surveys", "SurveyDefinition")
+    surveys = {}
+    for model_name, parse in [("Learner", parse_learner_survey_summary), ("Facilitator", parse_facilitator_survey_summary)]:
+        SurveyResponse = apps.get_model("surveys", model_name + "SurveyResponse")
+        SurveySummary = apps.get_model("surveys", model_name + "SurveySummary")
+        summaries = []
+        for resp in SurveyResponse.objects.select_related('study_group').iterator():
+            if resp.definition_id and resp.definition_id not in surveys:
+                surveys[resp.definition_id] = json.loads(SurveyDefinition.objects.get(pk=resp.definition_id).survey)
+            summaries.append(SurveySummary(
+                response_id=resp.pk,
+                study_group_id=resp.study_group_id,
+                course_id=resp.study_group.course_id if resp.study_group else None,
+                **parse(resp.form_id, _parse_answers(resp.response), surveys.get(resp.definition_id, {}))
+            ))
+        SurveySummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studygroups', '0141_outboxmessage'),
+        ('surveys', '0007_survey_definition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerSurveySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goal', models.TextField(blank=True, null=True)),
+                ('goal_rating', models.IntegerField(blank=True, null=True)),
+                ('course_rating', models.IntegerField(blank=True, null=True)),
+                ('course_rating_reason', models.TextField(blank=True, null=True)),
+                ('recommendation_rating', models.IntegerField(blank=True, null=True)),
+                ('recommendation_rating_reason', models.TextField(blank=True, null=True)),
+                ('goal_extra', models.TextField(blank=True, null=True)),
+                ('subject_confidence', models.IntegerField(blank=True, null=True)),
+                ('next_steps', models.TextField(blank=True, null=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='studygroups.Course')),
+                ('response', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='surveys.LearnerSurveyResponse')),
+                ('study_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='studygroups.StudyGroup')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='FacilitatorSurveySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goal', models.TextField(blank=True, null=True)),
+                ('goal_rating', models.IntegerField(blank=True, null=True)),
+                ('course_rating', models.IntegerField(blank=True, null=True)),
+                ('course_rating_reason', models.TextField(blank=True, null=True)),
+                ('recommendation_rating', models.IntegerField(blank=True, null=True)),
+                ('recommendation_rating_reason', models.TextField(blank=True, null=True)),
+                ('surprise', models.TextField(blank=True, null=True)),
+                ('stories', models.TextField(blank=True, null=True)),
+                ('attendance_1', models.IntegerField(blank=True, null=True)),
+                ('attendance_2', models.IntegerField(blank=True, null=True)),
+                ('attendance_n', models.IntegerField(blank=True, null=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='studygroups.Course')),
+                ('response', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='surveys.FacilitatorSurveyResponse')),
+                ('study_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='studygroups.StudyGroup')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_survey_summaries, migrations.RunPython.noop),
+    ]
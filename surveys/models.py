@@ -1,23 +1,70 @@
 # coding=utf-8
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from studygroups.models import StudyGroup
 from studygroups.models import Application
+from studygroups.models import Course
+from api.cache import invalidate_model_version
 
+from functools import lru_cache
+import hashlib
 import json
 
 MAX_STAR_RATING = 5
+# number of parsed survey definitions kept in memory
+SURVEY_CACHE_SIZE = 32
+
+
+class SurveyDefinition(models.Model):
+    """ A version of a Typeform form, shared by all responses to that version """
+    form_id = models.CharField(max_length=12)
+    survey_hash = models.CharField(max_length=32)  # md5 of survey
+    survey = models.TextField()  # This will be a JSON value
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('form_id', 'survey_hash')]
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.form_id, self.survey_hash)
+
+
+def get_survey_definition(form_id, survey):
+    """ return the SurveyDefinition for the JSON string survey """
+    survey_hash = hashlib.md5(survey.encode('utf-8')).hexdigest()
+    definition, created = SurveyDefinition.objects.get_or_create(
+        form_id=form_id, survey_hash=survey_hash, defaults={'survey': survey}
+    )
+    if created:
+        # a rolled back definition could have had the same id
+        get_survey.cache_clear()
+    return definition
+
+
+@lru_cache(maxsize=SURVEY_CACHE_SIZE)
+def get_survey(definition_id):
+    """ return the parsed survey for a SurveyDefinition. Definitions don't
+    change, so the result is kept and must not be modified """
+    survey = SurveyDefinition.objects.values_list('survey', flat=True).get(pk=definition_id)
+    return json.loads(survey)
+
 
 class TypeformSurveyResponse(models.Model):
     typeform_key = models.CharField(max_length=64, unique=True) #Called token in the JSON response
     form_id = models.CharField(max_length=12)
-    survey = models.TextField()
+    definition = models.ForeignKey(SurveyDefinition, blank=True, null=True, on_delete=models.PROTECT)
     response = models.TextField() #This will be a JSON value
     responded_at = models.DateTimeField()
 
     class Meta:
         abstract = True
 
+    def get_survey(self):
+        if not self.definition_id:
+            return {}
+        return get_survey(self.definition_id)
+
     def get_response_field(self, question_id):
         response = json.loads(self.response)
         answers = response.get('answers', [])
@@ -29,15 +76,20 @@ class TypeformSurveyResponse(models.Model):
         answer = next((answer for answer in answers if answer["field"]["ref"] == ref), None)
         if not answer:
             return None
-        type_ = answer.get('type')
-        value = answer.get(type_)
-        if type_ == 'choice':
-            value = value.get('label')
-        return value
+        return _get_answer_value(answer)
+
+    def get_summary(self):
+        """ return the stored summary, or an unsaved summary parsed from the
+        response if it was saved without one. Missing summaries are stored by
+        the update_survey_summaries command, not when reading """
+        try:
+            return self.summary
+        except ObjectDoesNotExist:
+            return build_survey_summary(self)
 
     def get_survey_field(self, field_id):
-        survey = json.loads(self.survey)
-        survey_fields = survey['fields']
+        survey = self.get_survey()
+        survey_fields = survey.get('fields', [])
         return next((field for field in survey_fields if field["id"] == field_id), None)
 
 
@@ -50,17 +102,58 @@ class LearnerSurveyResponse(TypeformSurveyResponse):
     learner = models.ForeignKey(Application, blank=True, null=True, on_delete=models.SET_NULL)
 
 
+class SurveySummary(models.Model):
+    """ The answers to a survey response used in reports, parsed once when the
+    response is saved. Answers given when signing up or creating the learning
+    circle take precedence and are applied by learner_survey_summary and
+    facilitator_survey_summary """
+    study_group = models.ForeignKey(StudyGroup, blank=True, null=True, on_delete=models.SET_NULL)
+    course = models.ForeignKey(Course, blank=True, null=True, on_delete=models.SET_NULL)
+    goal = models.TextField(blank=True, null=True)
+    goal_rating = models.IntegerField(blank=True, null=True)
+    course_rating = models.IntegerField(blank=True, null=True)
+    course_rating_reason = models.TextField(blank=True, null=True)
+    recommendation_rating = models.IntegerField(blank=True, null=True)
+    recommendation_rating_reason = models.TextField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+class LearnerSurveySummary(SurveySummary):
+    response = models.OneToOneField(LearnerSurveyResponse, on_delete=models.CASCADE, related_name='summary')
+    goal_extra = models.TextField(blank=True, null=True)
+    subject_confidence = models.IntegerField(blank=True, null=True)
+    next_steps = models.TextField(blank=True, null=True)
+
+
+class FacilitatorSurveySummary(SurveySummary):
+    response = models.OneToOneField(FacilitatorSurveyResponse, on_delete=models.CASCADE, related_name='summary')
+    surprise = models.TextField(blank=True, null=True)
+    stories = models.TextField(blank=True, null=True)
+    attendance_1 = models.IntegerField(blank=True, null=True)
+    attendance_2 = models.IntegerField(blank=True, null=True)
+    attendance_n = models.IntegerField(blank=True, null=True)
+
+
+# the summary model for each survey response model
+SUMMARY_MODELS = {
+    LearnerSurveyResponse: LearnerSurveySummary,
+    FacilitatorSurveyResponse: FacilitatorSurveySummary,
+}
+
+
 def find_field(field_id, typeform_survey):
     """ look up field_id in survey """
     survey = typeform_survey
-    fields = [ field for field in survey.get('fields') if field.get('id') == field_id ]
+    fields = [ field for field in survey.get('fields', []) if field.get('id') == field_id ]
     field = None
     if len(fields) == 1:
         return fields[0]
 
     # check if field is part of a group?
     group_fields = [
-        field.get('properties', {}).get('fields') for field in survey.get('fields') if field.get('type') == 'group'
+        field.get('properties', {}).get('fields') for field in survey.get('fields', []) if field.get('type') == 'group'
     ]
     # group_fields = [ [field, field, field], [field, field]]
     # flatten list
@@ -76,7 +169,7 @@ def normalize_data(typeform_response):
     Turn disjoint reponse and survey data from TypeForm into an dict with
     field id as key and an object with field title and answer as value
     """
-    survey = json.loads(typeform_response.survey)
+    survey = typeform_response.get_survey()
     response = json.loads(typeform_response.response)
     answers = {}
     for answer in response.get('answers', {}):
@@ -141,7 +234,161 @@ def get_all_results(query_set):
     }
 
 
+def _get_answer_value(answer):
+    type_ = answer.get('type')
+    value = answer.get(type_)
+    if type_ == 'choice':
+        value = value.get('label')
+    return value
+
+
+def _text_value(value):
+    if isinstance(value, dict):
+        # answer to a multiple choice question
+        return ', '.join(value.get('labels', []))
+    return None if value is None else str(value)
+
+
+def _int_value(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_answers(response):
+    """ return the answers in the JSON string response """
+    try:
+        response = json.loads(response)
+    except ValueError:
+        return []
+    if not isinstance(response, dict):
+        return []
+    return response.get('answers') or []
+
+
+def _values_by_ref(answers):
+    values = {}
+    for answer in answers:
+        values.setdefault(answer['field'].get('ref'), _get_answer_value(answer))
+    return values
+
+
+def parse_learner_survey_summary(form_id, response, definition_id):
+    """ return the fields of a LearnerSurveySummary for the JSON string response """
+    values = _values_by_ref(_parse_answers(response))
+    if form_id == settings.TYPEFORM_LEARNER_SURVEY_FORM:
+        return {
+            'goal': _text_value(values.get('goal')),
+            'goal_rating': _int_value(values.get('goal_rating_alt')),
+            'goal_extra': _text_value(values.get('goal_extra')),
+            'subject_confidence': _int_value(values.get('subject_confidence')),
+            'next_steps': _text_value(values.get('next_steps')),
+            'course_rating': _int_value(values.get('course_rating')),
+            'course_rating_reason': _text_value(values.get('course_rating_reason')),
+            'recommendation_rating': _int_value(values.get('recommendation_rating')),
+            'recommendation_rating_reason': _text_value(values.get('recommendation_rating_reason')),
+        }
+
+    # old survey, goal met was asked twice
+    goal_rating = values.get('06677105-57d8-4b18-99d7-02f77165cca8')
+    if not goal_rating:
+        goal_rating = values.get('47b94cfa-13fe-430d-b1d0-2414beedd865')
+    return {
+        'goal': _text_value(values.get('1929769b-dc20-4cd6-a849-c07ddd780456')),
+        'goal_rating': _int_value(goal_rating),
+        'next_steps': _text_value(values.get('3fa8908a-665d-4dfe-9d77-26a76294a253')),
+        'course_rating': _int_value(values.get('d8915ce4-0116-4469-b240-80e11fb4e362')),
+    }
+
+
+def _old_facilitator_course_rating(answers, definition_id):
+    # TODO rework this logic
+    # 1. Get rating + max rating
+    # 1. if max rating is different, scale answer
+    # 1. if rating is > max rating and quesion is missing, discard
+
+    # Zm9XlzKGKC66 = "How well did the online course {{hidden:course}} work as a learning circle?"
+    rating_answer = next((answer for answer in answers if answer['field'].get('id') == 'Zm9XlzKGKC66'), None)
+    if not rating_answer or 'number' not in rating_answer:
+        return None
+    survey = get_survey(definition_id) if definition_id else {}
+    rating_question = next((field for field in survey.get('fields', []) if field['id'] == 'Zm9XlzKGKC66'), None)
+    facilitator_rating = rating_answer['number']
+    if rating_question and 'properties' in rating_question:
+        facilitator_steps = rating_question['properties']['steps']
+        # Normalize the rating if it doesn't match MAX_STAR_RATING
+        if facilitator_steps != MAX_STAR_RATING:
+            facilitator_rating = round(facilitator_rating/facilitator_steps * MAX_STAR_RATING)
+        return facilitator_rating
+    if facilitator_rating > MAX_STAR_RATING:
+        # if we don't know how many steps the rating has and it exceeds MAX_STAR_RATING
+        # ignore this rating
+        return None
+    return facilitator_rating
+
+
+def parse_facilitator_survey_summary(form_id, response, definition_id):
+    """ return the fields of a FacilitatorSurveySummary for the JSON string response """
+    answers = _parse_answers(response)
+    values = _values_by_ref(answers)
+    summary = {
+        'attendance_1': _int_value(values.get('attendance_1_alt')),
+        'attendance_2': _int_value(values.get('attendance_2_alt')),
+        'attendance_n': _int_value(values.get('attendance_n_alt')),
+    }
+    if form_id == settings.TYPEFORM_FACILITATOR_SURVEY_FORM:
+        goal_rating = values.get('goal_rating_alt')
+        if not goal_rating:
+            goal_rating = values.get('goal_rating_alt_2')
+        summary.update({
+            'goal': _text_value(values.get('goal_alt')),
+            'goal_rating': _int_value(goal_rating),
+            'surprise': _text_value(values.get('surprise')),
+            'stories': _text_value(values.get('stories')),
+            'course_rating': _int_value(values.get('course_rating')),
+            'course_rating_reason': _text_value(values.get('course_rating_reason')),
+            'recommendation_rating': _int_value(values.get('recommendation_rating')),
+            'recommendation_rating_reason': _text_value(values.get('recommendation_rating_reason')),
+        })
+    else:
+        summary['course_rating'] = _int_value(_old_facilitator_course_rating(answers, definition_id))
+    return summary
+
+
+def build_survey_summary(survey_response):
+    """ return an unsaved summary parsed from survey_response """
+    model = SUMMARY_MODELS[type(survey_response)]
+    if model is LearnerSurveySummary:
+        parse = parse_learner_survey_summary
+    else:
+        parse = parse_facilitator_survey_summary
+    study_group = survey_response.study_group
+    return model(
+        response=survey_response,
+        study_group=study_group,
+        course_id=study_group.course_id if study_group else None,
+        **parse(survey_response.form_id, survey_response.response, survey_response.definition_id)
+    )
+
+
+def save_survey_summaries(survey_responses):
+    """ parse survey_responses and store their summaries, replacing existing
+    summaries. Returns the summaries in the same order """
+    summaries = [build_survey_summary(survey_response) for survey_response in survey_responses]
+
+    for model in SUMMARY_MODELS.values():
+        model_summaries = [summary for summary in summaries if isinstance(summary, model)]
+        if model_summaries:
+            model.objects.filter(response__in=[summary.response_id for summary in model_summaries]).delete()
+            model.objects.bulk_create(model_summaries)
+            # bulk_create doesn't send post_save
+            invalidate_model_version(model)
+    return summaries
+
+
 def _old_learner_survey_summary(response):
+    survey = response.get_summary()
     data = {
         "learned_extra": None,
         "confidence": None,
@@ -153,38 +400,35 @@ def _old_learner_survey_summary(response):
     # goal = signup goal OR survey goal OR None
     if response.learner and response.learner.get_goal():
         data['goal'] = response.learner.get_goal()
-    elif response.get_value_by_ref('1929769b-dc20-4cd6-a849-c07ddd780456'):
-        data['goal'] = response.get_value_by_ref('1929769b-dc20-4cd6-a849-c07ddd780456')
+    elif survey.goal:
+        data['goal'] = survey.goal
 
     # goal_rating = application.goal_met or survey goal met x2
     if response.learner and response.learner.goal_met:
         data['goal_rating'] = response.learner.goal_met
-    else:
-        goal_rating = response.get_value_by_ref('06677105-57d8-4b18-99d7-02f77165cca8')
-        if not goal_rating:
-            goal_rating = response.get_value_by_ref('47b94cfa-13fe-430d-b1d0-2414beedd865')
-        if goal_rating:
-            data['goal_rating'] = goal_rating
+    elif survey.goal_rating:
+        data['goal_rating'] = survey.goal_rating
 
     # next_steps = survey next steps
-    data['next_steps'] = response.get_value_by_ref('3fa8908a-665d-4dfe-9d77-26a76294a253')
+    data['next_steps'] = survey.next_steps
 
     # course rating = survey course rating
-    data['course_rating'] = response.get_value_by_ref('d8915ce4-0116-4469-b240-80e11fb4e362')
+    data['course_rating'] = survey.course_rating
     return data
 
 
 def _new_learner_survey_summary(response):
+    survey = response.get_summary()
     summary = {}
     if response.learner and response.learner.get_goal():
         summary['goal'] = response.learner.get_goal()
     else:
-        summary['goal'] = response.get_value_by_ref('goal')
+        summary['goal'] = survey.goal
 
     if response.learner and response.learner.goal_met:
         summary['goal_rating'] = response.learner.goal_met
     else:
-        summary['goal_rating'] = response.get_value_by_ref('goal_rating_alt')
+        summary['goal_rating'] = survey.goal_rating
 
     survey_fields = [
         "goal_extra",
@@ -196,7 +440,7 @@ def _new_learner_survey_summary(response):
         "recommendation_rating_reason",
     ]
     for field in survey_fields:
-        summary[field] = response.get_value_by_ref(field)
+        summary[field] = getattr(survey, field)
     return summary
 
 
@@ -214,6 +458,7 @@ def learner_survey_summary(survey_response):
         "recommendation_rating": 1,
         "recommendation_rating_reason": "blah",
     }
+    Use select_related('summary', 'learner') when summarizing many responses.
     """
     # decide based on form ID how to get the data
     if survey_response.form_id == settings.TYPEFORM_LEARNER_SURVEY_FORM:
@@ -222,21 +467,20 @@ def learner_survey_summary(survey_response):
 
 
 def _new_facilitator_survey_summary(response):
+    survey = response.get_summary()
     summary = {}
 
     # goal - presedence: study_group.goal > response.goal_alt
     if response.study_group and response.study_group.facilitator_goal:
         summary['goal'] = response.study_group.facilitator_goal
-    elif response.get_value_by_ref('goal_alt'):
-        summary['goal'] = response.get_value_by_ref('goal_alt')
+    elif survey.goal:
+        summary['goal'] = survey.goal
 
     # goal_rating - presedence: study_group.facilitator_goal_rating > response.goal_rating_alt > repsonse.goal_rating_alt_2
     if response.study_group and response.study_group.facilitator_goal_rating:
-        summary['goal_rating']: response.study_group.facilitator_goal_rating
-    elif response.get_value_by_ref('goal_rating_alt'):
-        summary['goal_rating'] = response.get_value_by_ref('goal_rating_alt')
+        summary['goal_rating'] = response.study_group.facilitator_goal_rating
     else:
-        summary['goal_rating'] = response.get_value_by_ref('goal_rating_alt_2')
+        summary['goal_rating'] = survey.goal_rating
 
     survey_fields = [
         "surprise",
@@ -247,36 +491,15 @@ def _new_facilitator_survey_summary(response):
         "recommendation_rating_reason",
     ]
     for field in survey_fields:
-        summary[field] = response.get_value_by_ref(field)
+        summary[field] = getattr(survey, field)
     return summary
 
 
 def _old_facilitator_survey_summary(response):
     summary = {}
-
-    # course_rating
-    # TODO rework this logic
-    # 1. Get rating + max rating
-    # 1. if max rating is different, scale answer
-    # 1. if rating is > max rating and quesion is missing, discard
-
-    # Zm9XlzKGKC66 = "How well did the online course {{hidden:course}} work as a learning circle?"
-    rating_question = response.get_survey_field("Zm9XlzKGKC66")
-    rating_answer = response.get_response_field("Zm9XlzKGKC66")
-    if rating_answer and 'number' in rating_answer:
-        facilitator_rating = rating_answer['number']
-        if rating_question and 'properties' in rating_question:
-            facilitator_steps = rating_question['properties']['steps']
-            # Normalize the rating if it doesn't match MAX_STAR_RATING
-            if facilitator_steps != MAX_STAR_RATING:
-                facilitator_rating = round(facilitator_rating/facilitator_steps * MAX_STAR_RATING)
-            summary['course_rating'] = facilitator_rating
-        elif facilitator_rating > MAX_STAR_RATING:
-            # if we don't know how many steps the rating has and it exceeds MAX_STAR_RATING
-            # ignore this rating
-            pass
-        else:
-            summary['course_rating'] = facilitator_rating
+    survey = response.get_summary()
+    if survey.course_rating is not None:
+        summary['course_rating'] = survey.course_rating
     return summary
 
 
@@ -292,6 +515,7 @@ def facilitator_survey_summary(survey_response):
         "recommendation_score": 4,
         "recommendation_reason": "",
     }
+    Use select_related('summary', 'study_group') when summarizing many responses.
     """
     if survey_response.form_id == settings.TYPEFORM_FACILITATOR_SURVEY_FORM:
         return _new_facilitator_survey_summary(survey_response)
@@ -1,12 +1,15 @@
 from celery import shared_task
 from .typeform import sync_facilitator_responses
 from .typeform import sync_learner_responses
-from .community_feedback import calculate_course_ratings
+from .community_feedback import calculate_all_course_ratings
 
 @shared_task
 def sync_surveys():
-    new_facilitator_responses = sync_facilitator_responses()
-    new_learner_responses = sync_learner_responses()
-    affected_courses = set([r.study_group.course for r in new_facilitator_responses + new_learner_responses if r.study_group and r.study_group.course])
-    for course in affected_courses:
-        calculate_course_ratings(course)
+    # course ratings are updated with the ratings in new responses
+    sync_facilitator_responses()
+    sync_learner_responses()
+
+
+@shared_task
+def reconcile_course_ratings():
+    calculate_all_course_ratings()
@@ -1,8 +1,34 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from mock import patch
 
 from studygroups.models import Course
+from studygroups.models import Application
+from studygroups.models import StudyGroup
+from .models import LearnerSurveyResponse
+from .models import FacilitatorSurveyResponse
+from .models import LearnerSurveySummary
+from .models import FacilitatorSurveySummary
+from .models import SurveyDefinition
+from .models import get_survey_definition
+from .models import learner_survey_summary
 from .community_feedback import calculate_course_ratings
+from .community_feedback import calculate_all_course_ratings
+from .community_feedback import add_course_ratings
+from .community_feedback import save_survey_summaries_and_ratings
+from .typeform import sync_learner_responses
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import importlib
 import json
+import threading
+import urllib.parse
 
 
 class TestCommunityFeedback(TestCase):
@@ -10,10 +36,7 @@ class TestCommunityFeedback(TestCase):
 
     def test_calculate_course_ratings(self):
         course = Course.objects.get(pk=3)
-
-        self.assertEqual(course.overall_rating, 0)
-        self.assertEqual(course.rating_step_counts, "{}")
-        self.assertEqual(course.total_ratings, 0)
+        Course.objects.filter(pk=3).update(overall_rating=0, rating_step_counts="{}", total_ratings=0)
 
         calculate_course_ratings(course)
 
@@ -24,3 +47,274 @@ class TestCommunityFeedback(TestCase):
         self.assertEqual(rating_step_counts, expected_rating_step_counts)
         self.assertEqual(course.total_ratings, 3)
 
+    def test_course_ratings_updated_with_responses(self):
+        # the ratings were added when the fixtures were loaded
+        course = Course.objects.get(pk=3)
+        self.assertEqual(course.overall_rating, 4.67)
+        self.assertEqual(course.total_ratings, 3)
+
+        response = LearnerSurveyResponse.objects.get(pk=1)
+        rating = response.summary.course_rating
+        response.study_group = StudyGroup.objects.get(pk=2)
+        response.save()
+        course = Course.objects.get(pk=3)
+        self.assertEqual(course.total_ratings, 2)
+        self.assertEqual(json.loads(course.rating_step_counts)[str(rating)], 1 if rating == 5 else 0)
+        self.assertEqual(json.loads(Course.objects.get(pk=2).rating_step_counts)[str(rating)], 1)
+
+        # learning circle moved to another course
+        study_group = StudyGroup.objects.get(pk=1)
+        study_group.course_id = 2
+        study_group.save()
+        self.assertEqual(Course.objects.get(pk=3).total_ratings, 0)
+        self.assertEqual(Course.objects.get(pk=2).total_ratings, 3)
+
+    def test_add_course_ratings_without_post_save(self):
+        saved = []
+        receiver = lambda sender, instance, **kwargs: saved.append(instance.pk)
+        post_save.connect(receiver, sender=Course)
+        try:
+            add_course_ratings(Counter({(3, 5): 1, (3, 4): -1}))
+        finally:
+            post_save.disconnect(receiver, sender=Course)
+        self.assertEqual(saved, [])
+        course = Course.objects.get(pk=3)
+        self.assertEqual(json.loads(course.rating_step_counts), {"5": 3, "4": 0, "3": 0, "2": 0, "1": 0})
+        self.assertEqual(course.overall_rating, 5)
+        self.assertEqual(course.total_ratings, 3)
+
+    def test_save_survey_summaries_twice(self):
+        response = LearnerSurveyResponse.objects.get(pk=1)
+        save_survey_summaries_and_ratings([response])
+        save_survey_summaries_and_ratings([response])
+        course = Course.objects.get(pk=3)
+        self.assertEqual(course.overall_rating, 4.67)
+        self.assertEqual(course.total_ratings, 3)
+
+    def test_calculate_all_course_ratings(self):
+        Course.objects.update(overall_rating=0, rating_step_counts="{}", total_ratings=0)
+        # two grouped queries, loading and updating the courses
+        with self.assertNumQueries(4):
+            calculate_all_course_ratings()
+        course = Course.objects.get(pk=3)
+        self.assertEqual(course.overall_rating, 4.67)
+        self.assertEqual(json.loads(course.rating_step_counts), {"5": 2, "4": 1, "3": 0, "2": 0, "1": 0})
+        self.assertEqual(Course.objects.get(pk=1).total_ratings, 0)
+        # nothing changed
+        self.assertEqual(calculate_all_course_ratings(), 0)
+
+
+
+class TestSurveyDefinition(TestCase):
+    fixtures = ['test_courses.json', 'test_studygroups.json', 'test_applications.json', 'test_survey_responses.json']
+
+    def test_get_survey_definition(self):
+        survey = json.dumps({'id': 'form-id', 'fields': [{'id': 'field-id', 'title': 'Question'}]})
+        definition = get_survey_definition('form-id', survey)
+        self.assertEqual(get_survey_definition('form-id', survey), definition)
+        self.assertNotEqual(get_survey_definition('form-id', json.dumps({'id': 'form-id', 'fields': []})), definition)
+
+        response = LearnerSurveyResponse.objects.get(pk=1)
+        response.definition = definition
+        response.save()
+        self.assertEqual(response.get_survey_field('field-id'), {'id': 'field-id', 'title': 'Question'})
+        # the parsed survey is reused
+        with self.assertNumQueries(0):
+            self.assertEqual(LearnerSurveyResponse(definition_id=definition.pk).get_survey(), json.loads(survey))
+
+    def test_responses_share_definition(self):
+        responses = LearnerSurveyResponse.objects.all()
+        self.assertEqual(len(set(response.definition_id for response in responses)), 1)
+        self.assertEqual(responses[0].get_survey()['id'], 'VA1aVz')
+
+
+class TestSurveySummary(TestCase):
+    fixtures = ['test_courses.json', 'test_studygroups.json', 'test_applications.json', 'test_survey_responses.json']
+
+    def test_summary_saved_with_response(self):
+        self.assertEqual(LearnerSurveySummary.objects.count(), 2)
+        self.assertEqual(FacilitatorSurveySummary.objects.count(), 1)
+        response = LearnerSurveyResponse.objects.get(pk=1)
+        self.assertEqual(response.summary.study_group_id, 1)
+        self.assertEqual(response.summary.course_id, 3)
+        self.assertEqual(response.summary.course_rating, response.get_value_by_ref('d8915ce4-0116-4469-b240-80e11fb4e362'))
+        self.assertEqual(response.summary.next_steps, response.get_value_by_ref('3fa8908a-665d-4dfe-9d77-26a76294a253'))
+
+        # the response isn't parsed again when summarizing it
+        response = LearnerSurveyResponse.objects.select_related('summary', 'learner').get(pk=1)
+        with self.assertNumQueries(0):
+            summary = learner_survey_summary(response)
+        self.assertEqual(summary['course_rating'], response.summary.course_rating)
+
+    def test_summary_course_updated(self):
+        study_group = StudyGroup.objects.get(pk=1)
+        study_group.course_id = 1
+        study_group.save()
+        self.assertEqual(LearnerSurveySummary.objects.filter(course_id=1).count(), 2)
+        self.assertEqual(FacilitatorSurveySummary.objects.get().course_id, 1)
+
+        # the summaries aren't checked when the course didn't change
+        study_group.name = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            study_group.save()
+        self.assertFalse(any('surveysummary' in query['sql'] for query in queries.captured_queries))
+
+    def test_update_survey_summaries(self):
+        LearnerSurveySummary.objects.update(course_rating=None)
+        FacilitatorSurveySummary.objects.all().delete()
+        Course.objects.filter(pk=3).update(overall_rating=0, rating_step_counts="{}", total_ratings=0)
+        call_command('update_survey_summaries')
+        self.assertEqual(LearnerSurveySummary.objects.count(), 2)
+        self.assertEqual(FacilitatorSurveySummary.objects.count(), 1)
+        self.assertEqual(LearnerSurveySummary.objects.filter(course_rating__isnull=True).count(), 0)
+        # the ratings counted from the summaries are restored
+        course = Course.objects.get(pk=3)
+        self.assertEqual(course.overall_rating, 4.67)
+        self.assertEqual(course.total_ratings, 3)
+
+    def test_missing_summary_not_saved_when_read(self):
+        LearnerSurveySummary.objects.all().delete()
+        response = LearnerSurveyResponse.objects.get(pk=1)
+        with CaptureQueriesContext(connection) as queries:
+            summary = response.get_summary()
+        # nothing is written
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+        self.assertIsNone(summary.pk)
+        self.assertEqual(summary.course_rating, response.get_value_by_ref('d8915ce4-0116-4469-b240-80e11fb4e362'))
+        self.assertEqual(LearnerSurveySummary.objects.count(), 0)
+
+    def test_migration_summaries(self):
+        fields = {
+            LearnerSurveySummary: ['response_id', 'study_group_id', 'course_id', 'goal', 'goal_rating', 'course_rating', 'next_steps', 'subject_confidence'],
+            FacilitatorSurveySummary: ['response_id', 'study_group_id', 'course_id', 'goal', 'goal_rating', 'course_rating', 'attendance_1'],
+        }
+        expected = {model: list(model.objects.order_by('response_id').values_list(*fields[model])) for model in fields}
+        for model in fields:
+            model.objects.all().delete()
+        migration = importlib.import_module('surveys.migrations.0008_survey_summary')
+        migration.create_survey_summaries(apps, None)
+        for model in fields:
+            self.assertEqual(list(model.objects.order_by('response_id').values_list(*fields[model])), expected[model])
+
+
+class FakeTypeformHandler(BaseHTTPRequestHandler):
+    """ serves a form and its responses like the Typeform API """
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests.append((url.path, params))
+        if url.path == '/forms/learner-form':
+            body = self.server.form
+        elif url.path == '/forms/learner-form/responses':
+            if 'after' in params and 'before' in params:
+                self.send_response(400)
+                self.end_headers()
+                return
+            if 'after' in params:
+                # in the order the responses were processed
+                items = list(self.server.items)
+                tokens = [item['token'] for item in items]
+                items = items[tokens.index(params['after']) + 1:]
+            else:
+                # newest first
+                items = sorted(self.server.items, key=lambda item: item['submitted_at'], reverse=True)
+                tokens = [item['token'] for item in items]
+                if 'before' in params:
+                    items = items[tokens.index(params['before']) + 1:]
+            body = {'total_items': len(items), 'items': items[:int(params['page_size'])]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTypeformSync(TestCase):
+    fixtures = ['test_courses.json', 'test_studygroups.json', 'test_applications.json']
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeTypeformHandler)
+        self.server.requests = []
+        self.server.form = {'id': 'learner-form', 'fields': []}
+        self.server.items = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_response(self, token, submitted_at, learner, answers=None):
+        self.server.items.append({
+            'token': token,
+            'submitted_at': submitted_at,
+            'hidden': {'studygroup_uuid': str(learner.study_group.uuid) if learner else 'not-a-uuid', 'learner_uuid': str(learner.uuid) if learner else None},
+            'answers': answers or [],
+        })
+
+    def test_sync_learner_responses(self):
+        learners = list(Application.objects.all()[:2])
+        for i in range(5):
+            self.add_response('token{}'.format(i), '2020-03-0{}T10:00:00Z'.format(i + 1), learners[i % 2] if i < 4 else None)
+
+        with override_settings(TYPEFORM_API_URL=self.api_url, TYPEFORM_LEARNER_SURVEY_FORM='learner-form'), \
+                patch('surveys.typeform.TYPEFORM_PAGE_SIZE', 2):
+            responses = sync_learner_responses()
+            self.assertEqual(len(responses), 5)
+            self.assertEqual(LearnerSurveyResponse.objects.count(), 5)
+            # 3 pages of responses and the form
+            self.assertEqual(len(self.server.requests), 4)
+            self.assertEqual([path for path, params in self.server.requests].count('/forms/learner-form'), 1)
+
+            response = LearnerSurveyResponse.objects.get(typeform_key='token1')
+            self.assertEqual(response.learner, learners[1])
+            self.assertEqual(response.study_group, learners[1].study_group)
+            self.assertEqual(response.get_survey(), self.server.form)
+            response = LearnerSurveyResponse.objects.get(typeform_key='token4')
+            self.assertIsNone(response.learner)
+            self.assertIsNone(response.study_group)
+
+            # only new responses are requested
+            self.server.requests = []
+            course_rating = {'type': 'number', 'number': 4, 'field': {'id': 'field-id', 'ref': 'course_rating'}}
+            self.add_response('token5', '2020-03-06T10:00:00Z', learners[0], [course_rating])
+            responses = sync_learner_responses()
+            self.assertEqual([response.typeform_key for response in responses], ['token5'])
+            self.assertEqual(self.server.requests[0][1]['after'], 'token4')
+            self.assertEqual(LearnerSurveyResponse.objects.count(), 6)
+            self.assertEqual(SurveyDefinition.objects.count(), 1)
+            summary = LearnerSurveySummary.objects.get(response__typeform_key='token5')
+            self.assertEqual(summary.course_rating, 4)
+            self.assertEqual(summary.course, learners[0].study_group.course)
+            self.assertEqual(LearnerSurveySummary.objects.count(), 6)
+
+            # nothing new, the form isn't requested
+            self.server.requests = []
+            self.assertEqual(sync_learner_responses(), [])
+            self.assertEqual(len(self.server.requests), 1)
+
+    def test_sync_responses_after_token(self):
+        learners = list(Application.objects.all()[:2])
+        self.add_response('token0', '2020-03-01T10:00:00Z', learners[0])
+        with override_settings(TYPEFORM_API_URL=self.api_url, TYPEFORM_LEARNER_SURVEY_FORM='learner-form'), \
+                patch('surveys.typeform.TYPEFORM_PAGE_SIZE', 2):
+            self.assertEqual(len(sync_learner_responses()), 1)
+
+            # new responses aren't processed in the order they were submitted
+            for i, day in enumerate([5, 2, 4, 3, 6]):
+                self.add_response('token{}'.format(i + 1), '2020-03-0{}T10:00:00Z'.format(day), learners[i % 2])
+            self.server.requests = []
+            responses = sync_learner_responses()
+            self.assertEqual(sorted(response.typeform_key for response in responses), ['token1', 'token2', 'token3', 'token4', 'token5'])
+            self.assertEqual(LearnerSurveyResponse.objects.count(), 6)
+            # pages continue after the last response on the previous page
+            pages = [params for path, params in self.server.requests if path == '/forms/learner-form/responses']
+            self.assertEqual([params['after'] for params in pages], ['token0', 'token2', 'token4'])
+            self.assertFalse(any('before' in params for params in pages))
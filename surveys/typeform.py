@@ -1,9 +1,11 @@
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import transaction
 
 import json
 import requests
 import logging
+import time
+import uuid
 from dateutil import parser
 
 from studygroups.models import StudyGroup
@@ -12,138 +14,195 @@ from studygroups.models import Course
 
 from .models import FacilitatorSurveyResponse
 from .models import LearnerSurveyResponse
+from .models import get_survey_definition
+from .community_feedback import save_survey_summaries_and_ratings
 
 logger = logging.getLogger(__name__)
 
+# the maximum page size supported by the Typeform responses API
+TYPEFORM_PAGE_SIZE = 1000
 
-def get_form(form_id):
-    url = 'https://api.typeform.com/forms/{}'.format(form_id)
-    response = requests.get(
+
+class TypeformError(Exception):
+    pass
+
+
+def _get(session, path, params=None):
+    url = '{}/{}'.format(getattr(settings, 'TYPEFORM_API_URL', 'https://api.typeform.com').rstrip('/'), path)
+    return session.get(
         url,
+        params=params,
         headers={'Authorization': 'bearer {}'.format(settings.TYPEFORM_ACCESS_TOKEN)},
     )
+
+
+def get_form(form_id, session=requests):
+    response = _get(session, 'forms/{}'.format(form_id))
     return response.json()
 
 
-def get_all_responses(form_id, after=None):
-    # NOTE: typeform doesn't paging, need to use after parameter, but no way
-    # to retrieve first token if len(responses) > 1000?
-    # If there are < 1000 responses the first time this is run, and < 1000 between
-    # polling intervals, this should be okay.
-    url = 'https://api.typeform.com/forms/{}/responses'.format(form_id)
+def get_response_pages(form_id, after=None, session=requests, page_size=TYPEFORM_PAGE_SIZE):
+    """ yield pages of completed responses until all responses processed
+    after the response with token after have been returned, or all responses
+    when after is None
+
+    Typeform returns responses newest first, but responses filtered with
+    after are returned in the order they were processed, so the responses
+    are paged with before or with after and never with both.
+
+    Raises TypeformError if a request fails.
+    """
     params = {
-        'page_size': 1000,
+        'page_size': page_size,
         'completed': 'true',
     }
     if after:
         params['after'] = after
-    response = requests.get(
-        url,
-        params=params,
-        headers={'Authorization': 'bearer {}'.format(settings.TYPEFORM_ACCESS_TOKEN)},
-    )
-    if response.status_code != 200:
-        logger.error('Typeform request failed')
-        return {}
-    return response.json()
+    while True:
+        response = _get(session, 'forms/{}/responses'.format(form_id), params=params)
+        if response.status_code != 200:
+            logger.error('Typeform request failed')
+            raise TypeformError('Request for responses to form {} failed with status {}'.format(form_id, response.status_code))
+        items = response.json().get('items', [])
+        if items:
+            yield items
+        if len(items) < page_size:
+            return
+        if after:
+            # continue with the responses processed after the last one on this page
+            params['after'] = items[-1].get('token')
+        else:
+            # continue with the responses submitted before the oldest one on this page
+            oldest = min(items, key=lambda item: parser.parse(item.get('submitted_at')))
+            params['before'] = oldest.get('token')
 
 
-def sync_facilitator_responses():
-    form_id = settings.TYPEFORM_FACILITATOR_SURVEY_FORM
-    form = get_form(form_id)
+def get_all_responses(form_id, after=None):
+    try:
+        return {'items': [item for page in get_response_pages(form_id, after=after) for item in page]}
+    except TypeformError:
+        return {}
 
-    last_response = FacilitatorSurveyResponse.objects.filter(form_id=form_id).order_by('-responded_at').first()
-    after = None
-    if last_response:
-        after = last_response.typeform_key
 
-    r = get_all_responses(form_id, after=after)
-    survey_responses = []
+def _hidden_field(survey, name):
+    return (survey.get('hidden') or {}).get(name)
 
-    for survey in r.get('items', []):
-        study_group_uuid = survey.get('hidden', {}).get('studygroup_uuid')
-        study_group = None
-        if study_group_uuid:
-            try:
-                study_group = StudyGroup.objects.get(uuid=study_group_uuid)
-            except ObjectDoesNotExist as e:
-                logger.debug('Study group with UUID does not exist', e)
-            except ValidationError as e:
-                logger.debug('UUID is not valid', e)
-
-        responded_at = parser.parse(survey.get('submitted_at'))
 
+def _lookup_by_uuid(queryset, values):
+    """ return a dict with the object in queryset for every UUID in values,
+    using a single query """
+    uuids = {}
+    for value in set(filter(None, values)):
+        try:
+            uuids[value] = uuid.UUID(str(value))
+        except ValueError:
+            logger.debug('UUID is not valid: %s', value)
+    objects = {obj.uuid: obj for obj in queryset.filter(uuid__in=list(uuids.values()))}
+    return {value: objects.get(uuid_) for value, uuid_ in uuids.items()}
+
+
+def _save_responses(model, form_id, definition, items, related_fields):
+    """ create or update the responses on a page with one query for each """
+    existing = {
+        survey_response.typeform_key: survey_response
+        for survey_response in model.objects.filter(typeform_key__in=[item.get('token') for item in items])
+    }
+    new_responses = []
+    updated_responses = []
+    for item, fields in zip(items, related_fields):
         data = {
             'form_id': form_id,
-            'study_group': study_group,
-            'survey': json.dumps(form),
-            'response': json.dumps(survey),
-            'responded_at': responded_at
+            'definition': definition,
+            'response': json.dumps(item),
+            'responded_at': parser.parse(item.get('submitted_at')),
         }
-        survey_response, created = FacilitatorSurveyResponse.objects.get_or_create(
-            typeform_key=survey.get('token'),
-            defaults=data
-        )
-        if not created:
+        data.update(fields)
+        survey_response = existing.get(item.get('token'))
+        if survey_response:
             for attr, value in data.items():
                 setattr(survey_response, attr, value)
-            survey_response.save()
+            updated_responses.append(survey_response)
+        else:
+            new_responses.append(model(typeform_key=item.get('token'), **data))
 
-        survey_responses.append(survey_response)
+    model.objects.bulk_create(new_responses)
+    if updated_responses:
+        model.objects.bulk_update(updated_responses, list(data.keys()))
+    return new_responses + updated_responses
 
-    return survey_responses
 
+def _sync_responses(model, form_id, get_related_fields):
+    """ save all responses to form_id submitted after the last saved response
 
-def sync_learner_responses():
-    form_id = settings.TYPEFORM_LEARNER_SURVEY_FORM
-    form = get_form(form_id)
+    get_related_fields takes the response items on a page and returns a
+    list with a dict of related objects for every item.
+    """
+    start = time.perf_counter()
+    session = requests.Session()
 
-    last_response = LearnerSurveyResponse.objects.filter(form_id=form_id).order_by('-responded_at').first()
+    last_response = model.objects.filter(form_id=form_id).order_by('-responded_at').first()
     after = None
     if last_response:
         after = last_response.typeform_key
 
-    r = get_all_responses(form_id, after=after)
+    definition = None
     survey_responses = []
+    pages = 0
+    try:
+        # the next sync starts after the newest saved response, so save all
+        # pages or none to avoid skipping the responses on a failed page
+        with transaction.atomic():
+            for items in get_response_pages(form_id, after=after, session=session, page_size=TYPEFORM_PAGE_SIZE):
+                # the same response could be included in more than one page
+                items = list({item.get('token'): item for item in items}.values())
+                if definition is None:
+                    # only get the form when there are new responses
+                    definition = get_survey_definition(form_id, json.dumps(get_form(form_id, session=session)))
+                page_responses = _save_responses(model, form_id, definition, items, get_related_fields(items))
+                save_survey_summaries_and_ratings(page_responses)
+                survey_responses += page_responses
+                pages += 1
+    except TypeformError:
+        return []
+
+    duration = time.perf_counter() - start
+    logger.info(
+        'Synced %s responses to form %s in %s pages, %.1fs (%.0f responses/s)',
+        len(survey_responses), form_id, pages, duration, len(survey_responses)/duration if duration else 0
+    )
+    return survey_responses
 
-    for survey in r.get('items', []):
 
-        study_group_uuid = survey.get('hidden').get('studygroup_uuid')
-        study_group = None
-        try:
-            study_group = StudyGroup.objects.get(uuid=study_group_uuid)
-        except ObjectDoesNotExist as e:
-            logger.debug('Study group with ID does not exist', e)
-        except ValidationError as e:
-            logger.debug('UUID is not valid', e)
-
-        responded_at = parser.parse(survey.get('submitted_at'))
-
-        learner_uuid = survey.get('hidden').get('learner_uuid')
-        learner = None
-        if learner_uuid:
-            try:
-                learner = Application.objects.get(uuid=learner_uuid)
-            except ObjectDoesNotExist as e:
-                logger.debug('Application not found', e)
-
-        data = {
-            'form_id': form_id,
-            'study_group': study_group,
-            'learner': learner,
-            'survey': json.dumps(form),
-            'response': json.dumps(survey),
-            'responded_at': responded_at
-        }
-        survey_response, created = LearnerSurveyResponse.objects.get_or_create(
-            typeform_key=survey.get('token'),
-            defaults=data
+def sync_facilitator_responses():
+    def get_related_fields(items):
+        study_groups = _lookup_by_uuid(
+            StudyGroup.objects.select_related('course'),
+            [_hidden_field(item, 'studygroup_uuid') for item in items]
         )
-        if not created:
-            for attr, value in data.items():
-                setattr(survey_response, attr, value)
-            survey_response.save()
+        return [
+            {'study_group': study_groups.get(_hidden_field(item, 'studygroup_uuid'))}
+            for item in items
+        ]
 
-        survey_responses.append(survey_response)
+    return _sync_responses(FacilitatorSurveyResponse, settings.TYPEFORM_FACILITATOR_SURVEY_FORM, get_related_fields)
 
-    return survey_responses
+
+def sync_learner_responses():
+    def get_related_fields(items):
+        study_groups = _lookup_by_uuid(
+            StudyGroup.objects.select_related('course'),
+            [_hidden_field(item, 'studygroup_uuid') for item in items]
+        )
+        learners = _lookup_by_uuid(
+            Application.objects.all(),
+            [_hidden_field(item, 'learner_uuid') for item in items]
+        )
+        return [
+            {
+                'study_group': study_groups.get(_hidden_field(item, 'studygroup_uuid')),
+                'learner': learners.get(_hidden_field(item, 'learner_uuid')),
+            }
+            for item in items
+        ]
+
+    return _sync_responses(LearnerSurveyResponse, settings.TYPEFORM_LEARNER_SURVEY_FORM, get_related_fields)
@@ -1,11 +1,109 @@
 from django import http
 from django.core.serializers.json import DjangoJSONEncoder
 
+import itertools
 import json
+import re
 
-def json_response(request, objects):
-    data = json.dumps(objects, cls=DjangoJSONEncoder)
-    if 'callback' in request.GET:
-        data = '{0}({1});'.format(request.GET['callback'], data)
-        return http.HttpResponse(data, 'text/javascript')
-    return http.HttpResponse(data, 'application/json')
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+STREAM_CHUNK_SIZE = 500
+JSONP_CONTENT_TYPE = 'text/javascript; charset=utf-8'
+
+_non_ascii = re.compile(r'[^\x00-\x7f]+')
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def json_value(value):
+    """ convert a value the same way DjangoJSONEncoder would, ahead of encoding """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return _django_encoder.default(value)
+
+
+def _stdlib_dumps(objects):
+    # a shared encoder without a custom class uses the C accelerated encoder
+    # and only calls back into Python for values it can't encode
+    return _stdlib_encoder.encode(objects)
+
+_stdlib_encoder = json.JSONEncoder(default=_django_encoder.default)
+
+
+def _orjson_dumps(objects):
+    # datetimes are passed to DjangoJSONEncoder to keep the same format
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    return orjson.dumps(objects, default=_django_encoder.default, option=option).decode('utf-8')
+
+
+json_dumps = _orjson_dumps if orjson else _stdlib_dumps
+
+
+def _escape_non_ascii(match):
+    # the same \uXXXX escapes as json.dumps(ensure_ascii=True), characters
+    # outside the BMP are written as a surrogate pair
+    encoded = match.group(0).encode('utf-16-be')
+    return ''.join('\\u{:02x}{:02x}'.format(encoded[i], encoded[i+1]) for i in range(0, len(encoded), 2))
+
+
+def _ascii_only(data):
+    """ escape non-ASCII characters in encoded JSON, orjson always writes UTF-8 """
+    return _non_ascii.sub(_escape_non_ascii, data)
+
+
+def _iterencode(objects, dumps):
+    """ encode objects in chunks, lists and iterators are encoded in batches of items """
+    if isinstance(objects, dict):
+        yield '{'
+        for i, (key, value) in enumerate(objects.items()):
+            yield '{}{}: '.format(', ' if i else '', dumps(str(key)))
+            yield from _iterencode(value, dumps)
+        yield '}'
+    elif isinstance(objects, (str, bytes)) or not hasattr(objects, '__iter__'):
+        yield dumps(objects)
+    else:
+        yield '['
+        items = iter(objects)
+        separator = ''
+        while True:
+            chunk = list(itertools.islice(items, STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            yield separator + dumps(chunk)[1:-1]
+            separator = ', '
+        yield ']'
+
+
+def json_response(request, objects, dumps=None, stream=False):
+    """ return objects as JSON, or as JSONP if a callback is given
+
+    dumps can be used to replace the encoder. With stream=True lists and
+    iterators in objects are encoded in chunks as the response is sent.
+    """
+    dumps = dumps or json_dumps
+    callback = request.GET['callback'] if 'callback' in request.GET else None
+    content_type = 'application/json' if callback is None else JSONP_CONTENT_TYPE
+
+    if stream:
+        chunks = _iterencode(objects, dumps)
+        if callback is not None:
+            # JSONP is loaded with a script tag, which may not decode UTF-8
+            chunks = itertools.chain(['{0}('.format(callback)], map(_ascii_only, chunks), [');'])
+        return http.StreamingHttpResponse(chunks, content_type)
+
+    def encode():
+        data = dumps(objects)
+        if callback is not None:
+            data = '{0}({1});'.format(callback, _ascii_only(data))
+        return data
+
+    if hasattr(request, 'metrics'):
+        with request.metrics.serializing():
+            data = encode()
+    else:
+        data = encode()
+    return http.HttpResponse(data, content_type)